@@ -4,7 +4,7 @@ import os
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from datetime import datetime
-from app.utils.ledger_utils import load_ledger, get_file_entries
+from app.utils.ledger_utils import get_ledger_snapshot, get_file_entries, get_snapshot_balance_index
 
 # 创建蓝图
 accounts_bp = Blueprint('accounts', __name__)
@@ -40,11 +40,9 @@ def get_accounts():
 @jwt_required()
 def get_account_balances():
     """获取账户余额"""
-    # 使用缓存功能获取文件到条目的映射
-    file_entries = get_file_entries()
-
-    # 加载账本以获取options
-    entries, errors, options = load_ledger()
+    # options和余额索引取自同一个快照，避免请求期间账本重新加载导致两者不一致
+    snapshot = get_ledger_snapshot()
+    options = snapshot['options']
     currency = options.get('operating_currency', 'CNY')
 
     # 从请求参数中获取日期范围
@@ -76,68 +74,58 @@ def get_account_balances():
             except ValueError:
                 pass
 
-    # 计算账户余额
-    balances = {}
+    # 余额索引在每个账本版本上只构建一次，区间内的余额变动通过二分查找得到
+    balance_index = get_snapshot_balance_index(snapshot)
+
     account_notes = {}
     account_currencies = {}
     open_accounts = set()
     closed_accounts = set()
 
-    # 遍历所有文件中的条目
-    for file_entries_list in file_entries.values():
-        for entry in file_entries_list:
-            # 检查entry是否有日期属性
-            if hasattr(entry, 'date'):
-                # 应用日期范围筛选
-                if start_date_obj or end_date_obj:
-                    entry_date = entry.date
-                    if start_date_obj and entry_date < start_date_obj:
-                        continue
-                    if end_date_obj and entry_date > end_date_obj:
-                        continue
-
-            # 处理账户的Open信息（包含note和currency）
-            if hasattr(entry, 'account'):
-                if type(entry).__name__ == 'Open':
-                    account = entry.account
-                    open_accounts.add(account)
-                    # 获取note信息
-                    if hasattr(entry, 'meta') and entry.meta:
-                        if 'note' in entry.meta:
-                            account_notes[account] = entry.meta['note']
-                    # 获取currency信息
-                    if hasattr(entry, 'currencies') and entry.currencies:
-                        # currencies可能是字符串列表或对象列表
-                        if isinstance(entry.currencies[0], str):
-                            account_currencies[account] = entry.currencies[0]
-                        else:
-                            account_currencies[account] = (
-                                entry.currencies[0].currency if hasattr(entry.currencies[0], 'currency') else currency
-                            )
-                elif type(entry).__name__ == 'Close':
-                    account = entry.account
-                    closed_accounts.add(account)
-
-            # 计算账户余额
-            if hasattr(entry, 'postings'):
-                for posting in entry.postings:
-                    account = posting.account
-                    if hasattr(posting, 'units') and posting.units:
-                        # 确保amount是数字类型
-                        amount = float(posting.units.number)
-                        if account not in balances:
-                            balances[account] = 0.0
-                        balances[account] += amount
+    def in_date_range(entry_date):
+        if start_date_obj and entry_date < start_date_obj:
+            return False
+        if end_date_obj and entry_date > end_date_obj:
+            return False
+        return True
+
+    # 处理账户的Open信息（包含note和currency）
+    for entry in balance_index.opens:
+        if not in_date_range(entry.date):
+            continue
+        account = entry.account
+        open_accounts.add(account)
+        # 获取note信息
+        if entry.meta and 'note' in entry.meta:
+            account_notes[account] = entry.meta['note']
+        # 获取currency信息
+        if entry.currencies:
+            # currencies可能是字符串列表或对象列表
+            if isinstance(entry.currencies[0], str):
+                account_currencies[account] = entry.currencies[0]
+            else:
+                account_currencies[account] = (
+                    entry.currencies[0].currency if hasattr(entry.currencies[0], 'currency') else currency
+                )
+
+    for entry in balance_index.closes:
+        if in_date_range(entry.date):
+            closed_accounts.add(entry.account)
 
     # 只返回未关闭的账户
     active_accounts = open_accounts - closed_accounts
 
     # 构建账户详情
     account_details = []
-    for account, balance in balances.items():
-        # 只包含活跃账户
+    for account in balance_index.accounts:
+        # 只包含活跃且在日期范围内有记账行的账户
         if account not in active_accounts:
             continue
+        if balance_index.posting_count(account, start_date_obj, end_date_obj) == 0:
+            continue
+
+        # 日期范围内的余额变动（各币种数值合计）
+        balance = sum(balance_index.change(account, start_date_obj, end_date_obj).values())
 
         # 提取账户类型和二级分类
         account_parts = account.split(':')
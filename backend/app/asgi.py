@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI 入口
+
+/api/events 的 SSE 连接由事件循环中的协程直接处理，空闲连接只是一个挂起的协程，
+不占用线程；其余请求通过 WsgiToAsgi 转交给原有的 Flask 应用（在线程池中执行）。
+
+启动方式：SERVER_MODE=asgi python run.py，或 uvicorn app.asgi:application
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask_jwt_extended import decode_token
+
+from app import app
+from app.events.routes import format_event
+from app.utils.ledger_utils import get_ledger_summary, get_posting_accounts, sse_broadcaster
+from app.utils.query_pool import DISCONNECTED_ENVIRON_KEY
+from app.utils.sse_broadcaster import CLOSED, SSE_KEEPALIVE_INTERVAL
+
+# 配置
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', 8))  # 执行Flask请求的线程数
+
+EVENTS_PATH = '/api/events'
+
+
+class _ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    """在线程池中并发执行WSGI请求（asgiref默认把所有请求放在同一个线程中串行执行）
+
+    请求体读取完毕后继续监听 http.disconnect，Flask中可通过 DISCONNECTED_ENVIRON_KEY 检测客户端是否已断开。
+    """
+
+    _run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+    async def __call__(self, scope, receive, send):
+        self._receive = receive
+        self._disconnected = threading.Event()
+        await super().__call__(scope, receive, send)
+
+    async def run_wsgi_app(self, body):
+        async def watch_disconnect():
+            while True:
+                message = await self._receive()
+                if message['type'] == 'http.disconnect':
+                    self._disconnected.set()
+                    return
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await self._run_wsgi_app(body)
+        finally:
+            watcher.cancel()
+
+    def build_environ(self, scope, body):
+        environ = super().build_environ(scope, body)
+        environ[DISCONNECTED_ENVIRON_KEY] = self._disconnected.is_set
+        return environ
+
+
+class _ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _ThreadPoolWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+wsgi_application = _ThreadPoolWsgiToAsgi(app)
+
+
+def _get_header(scope, name):
+    """读取请求头（name为小写的bytes）"""
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def _authenticate(scope):
+    """校验SSE请求的JWT，与 @jwt_required() 使用相同的密钥和规则"""
+    authorization = _get_header(scope, b'authorization') or ''
+    if not authorization.startswith('Bearer '):
+        return False
+    try:
+        with app.app_context():
+            decode_token(authorization[len('Bearer ') :])
+    except Exception:
+        return False
+    return True
+
+
+def _get_last_event_id(scope):
+    last_event_id = _get_header(scope, b'last-event-id')
+    if last_event_id:
+        return last_event_id
+    for part in scope.get('query_string', b'').decode('latin-1').split('&'):
+        key, _, value = part.partition('=')
+        if key == 'last_event_id' and value:
+            return value
+    return None
+
+
+async def sse_stream(scope, receive, send):
+    """SSE协程：行为与 app.events.routes.events 一致"""
+    loop = asyncio.get_running_loop()
+    last_event_id = _get_last_event_id(scope)
+
+    # 先注册订阅者，避免发送初始数据期间产生的事件丢失
+    subscription, missed = sse_broadcaster.subscribe(last_event_id, loop=loop)
+
+    async def watch_disconnect():
+        # 客户端断开时立即唤醒等待中的协程
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                sse_broadcaster.unsubscribe(subscription)
+                subscription._close()
+                return
+
+    async def emit(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+    headers = [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+    ]
+    if _get_header(scope, b'origin'):
+        # 与 Flask-CORS 的默认配置一致
+        headers.append((b'access-control-allow-origin', b'*'))
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+        if missed is not None:
+            # 重连：只补发错过的事件
+            for event_data in missed:
+                await emit(format_event(event_data['event'], event_data['data'], event_data['id']))
+        else:
+            await emit(format_event('connected', 'Connected to SSE server', subscription.start_id))
+            # 账本可能正在加载，在线程池中读取，避免阻塞事件循环
+            accounts = await loop.run_in_executor(None, get_posting_accounts)
+            await emit(format_event('accounts', accounts))
+            if last_event_id:
+                summary = await loop.run_in_executor(None, get_ledger_summary, False)
+                await emit(format_event('update', summary))
+
+        while True:
+            event_data = await subscription.get(timeout=SSE_KEEPALIVE_INTERVAL)
+            if event_data is None:
+                await emit(': keep-alive\n\n')
+                continue
+            if event_data is CLOSED:
+                break
+            await emit(format_event(event_data['event'], event_data['data'], event_data['id']))
+
+        if not watcher.done():
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    except Exception as e:
+        print(f"SSE Error: {e}")
+    finally:
+        sse_broadcaster.unsubscribe(subscription)
+        watcher.cancel()
+
+
+async def application(scope, receive, send):
+    """ASGI应用：SSE走协程，其余请求交给Flask"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Flask请求和账本加载都在事件循环的默认线程池中执行
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi-wsgi')
+                )
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if (
+        scope['type'] == 'http'
+        and scope['method'] == 'GET'
+        and scope['path'].rstrip('/') == EVENTS_PATH
+        and _authenticate(scope)
+    ):
+        await sse_stream(scope, receive, send)
+        return
+
+    # 未通过认证的SSE请求同样交给Flask，返回与WSGI模式一致的错误响应
+    await wsgi_application(scope, receive, send)
@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required
+import base64
+import csv
+import io
+import json
 import os
 import re
 from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from itertools import chain, islice
+from app.utils.ledger_index import entry_accounts
 from app.utils.ledger_utils import (
     get_dir_by_year,
     load_ledger,
@@ -12,6 +19,9 @@ from app.utils.ledger_utils import (
     get_file_by_year_month,
     get_entries_by_file,
     get_include_structure,
+    get_balance_index,
+    get_entry_indexes,
+    mark_ledger_changed,
 )
 
 # 创建蓝图
@@ -19,155 +29,458 @@ entries_bp = Blueprint('entries', __name__)
 
 # 配置
 LEDGER_FILE = os.getenv('LEDGER_FILE', 'data/main.bean')
+# 分页游标中的文件名相对于此目录
+LEDGER_DIR = os.path.dirname(os.path.abspath(LEDGER_FILE))
 PAD_EQUITY_ACCOUNT = os.getenv('PAD_EQUITY_ACCOUNT', 'Equity:Opening-Balances')
+ENTRIES_MAX_PAGE_SIZE = int(os.getenv('ENTRIES_MAX_PAGE_SIZE', 1000))  # 单次请求最多返回的条目数
+EXPORT_CHUNK_BYTES = 64 * 1024  # 流式导出时每次发送的数据块大小
+EXPORT_CSV_FIELDS = ['id', 'date', 'type', 'narration', 'account', 'number', 'currency']
+
+
+def ensure_string_keys(d):
+    """递归确保字典中所有键都是字符串类型"""
+    if isinstance(d, dict):
+        result = {}
+        for k, v in d.items():
+            result[str(k)] = ensure_string_keys(v)
+        return result
+    elif isinstance(d, (list, tuple)):
+        return [ensure_string_keys(item) for item in d]
+    else:
+        return d
+
+
+def serialize_entry(entry):
+    """将beancount条目转换为API返回的字典格式"""
+    # 确保meta字段的所有键都是字符串类型，避免JSON序列化错误
+    meta_dict = {}
+    if hasattr(entry, 'meta'):
+        meta_dict = ensure_string_keys(dict(entry.meta))
+
+    # 创建条目ID：filename:lineno
+    entry_id = ''
+    if hasattr(entry, 'meta') and 'filename' in entry.meta and 'lineno' in entry.meta:
+        # 获取相对路径（使用os.path.relpath确保跨平台兼容性）
+        filename = entry.meta['filename']
+        main_dir = os.path.dirname(LEDGER_FILE)
+        try:
+            # 使用relpath计算相对于主文件目录的相对路径
+            filename = os.path.relpath(filename, main_dir)
+        except ValueError:
+            # 如果路径不在同一驱动器（Windows）或无法计算相对路径，使用原始文件名
+            pass
+        entry_id = f"{filename}:{entry.meta['lineno']}"
+
+    entry_data = {
+        'type': type(entry).__name__,
+        'id': entry_id,
+        'date': entry.date.isoformat(),
+        'meta': meta_dict,
+    }
+
+    # 添加交易描述
+    if hasattr(entry, 'narration'):
+        entry_data['narration'] = entry.narration
+
+    # 添加标签（将frozenset转换为列表以便JSON序列化）
+    if hasattr(entry, 'tags') and entry.tags:
+        entry_data['tags'] = list(entry.tags)
+
+    # 添加记账行信息
+    if hasattr(entry, 'postings'):
+        entry_data['postings'] = []
+        for posting in entry.postings:
+            posting_data = {'account': posting.account}
+            if hasattr(posting, 'units') and posting.units:
+                posting_data['units'] = {'number': posting.units.number, 'currency': posting.units.currency}
+            entry_data['postings'].append(posting_data)
+
+    # 添加账户信息（Open类型条目）
+    if hasattr(entry, 'account'):
+        entry_data['account'] = entry.account
+
+    return entry_data
+
+
+def encode_entry(entry):
+    """将条目编码为API返回的JSON文本（与jsonify的编码规则一致）"""
+    return current_app.json.dumps(serialize_entry(entry))
+
+
+def entries_response(encoded_entries, pagination):
+    """用已编码的条目JSON文本拼接条目列表响应，避免重复编码"""
+    body = '{"entries":[' + ','.join(encoded_entries) + '],"pagination":' + current_app.json.dumps(pagination) + '}'
+    return current_app.response_class(body + '\n', mimetype=current_app.json.mimetype)
+
+
+def entry_matches(entry, account=None, entry_type=None, include_children=False):
+    """检查条目是否满足账户和类型筛选条件（include_children为True时子账户也匹配）"""
+    # 类型筛选
+    if entry_type and type(entry).__name__ != entry_type:
+        return False
+
+    # 账户筛选（Open/Close/Balance类型检查条目的账户，Transaction类型检查记账行）
+    if account:
+        for entry_account in entry_accounts(entry):
+            if entry_account == account or (include_children and entry_account.startswith(account + ':')):
+                return True
+        return False
+
+    return True
+
+
+def _cursor_filename(filename):
+    """条目文件名在游标中的表示：使用相对于账本目录的路径，不向客户端暴露服务器上的目录结构"""
+    if not os.path.isabs(filename):
+        # '<...>' 等没有对应文件的条目
+        return filename
+    try:
+        return os.path.relpath(filename, LEDGER_DIR)
+    except ValueError:
+        # Windows下不在同一驱动器，无法计算相对路径
+        return os.path.basename(filename)
+
+
+def encode_cursor(key, order):
+    """将排序键编码为不透明的分页游标"""
+    date, type_order, lineno, filename = key
+    payload = json.dumps(
+        [date.isoformat(), type_order, lineno, _cursor_filename(filename), order], separators=(',', ':')
+    )
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析分页游标
+
+    Returns:
+        tuple: (排序键, 排序方向)
+
+    Raises:
+        ValueError: 游标格式无效
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        date, type_order, lineno, filename, order = payload
+        if not (
+            isinstance(date, str)
+            and type(type_order) is int
+            and type(lineno) is int
+            and lineno >= 0
+            and isinstance(filename, str)
+            and '\0' not in filename
+            and not os.path.isabs(filename)
+            and order in ('asc', 'desc')
+        ):
+            raise ValueError('unexpected cursor fields')
+        date = datetime.fromisoformat(date).date()
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {cursor}') from e
+
+    # 还原为条目元数据中的绝对路径（排序键中的文件名）
+    if filename and not filename.startswith('<'):
+        filename = os.path.normpath(os.path.join(LEDGER_DIR, filename))
+    return (date, type_order, lineno, filename), order
+
+
+def select_entry_positions(
+    date_index,
+    account_index,
+    start_date_obj,
+    end_date_obj,
+    order,
+    account=None,
+    entry_type=None,
+    include_children=False,
+    cursor_key=None,
+    with_total=False,
+):
+    """按筛选条件从快照索引中选出条目位置（按日期排序）
+
+    Args:
+        date_index: 日期索引
+        account_index: 账户倒排索引（有账户或类型筛选时必需）
+        start_date_obj / end_date_obj: 日期范围，None表示不限
+        order: 排序方向，desc或asc
+        account / entry_type / include_children: 账户和类型筛选条件
+        cursor_key: 游标排序键，只返回排在其后的条目
+        with_total: 是否计算日期范围内满足筛选条件的条目总数（不受游标影响）
+
+    Returns:
+        tuple: (位置迭代器, 条目总数或None)
+    """
+    lo, hi = date_index.bounds(start_date_obj, end_date_obj)
+    reverse = order == 'desc'
+
+    # 账户或类型筛选使用倒排索引，开销只与该账户（或类型）的条目数有关
+    subset = None
+    if account:
+        subset = account_index.positions(account, include_children)
+    elif entry_type:
+        subset = account_index.by_type.get(entry_type, [])
+
+    def iter_window(window_lo, window_hi, window_reverse):
+        if subset is None:
+            return date_index.iter_positions(window_lo, window_hi, window_reverse)
+        return date_index.iter_subset(subset, window_lo, window_hi, window_reverse)
+
+    def type_matches(position):
+        return type(date_index.entries[position]).__name__ == entry_type
+
+    total = None
+    if with_total:
+        if subset is None:
+            total = hi - lo
+        elif account and entry_type:
+            total = sum(1 for position in iter_window(lo, hi, False) if type_matches(position))
+        else:
+            i, j = date_index.subset_bounds(subset, lo, hi)
+            total = j - i
+
+    # 游标分页：从游标对应的排序键之后开始，只需一次二分查找
+    if cursor_key is not None:
+        segments = date_index.cursor_segments(cursor_key, lo, hi, reverse)
+    else:
+        segments = [(lo, hi, reverse)]
+    positions = chain.from_iterable(iter_window(*segment) for segment in segments)
+    if account and entry_type:
+        positions = (position for position in positions if type_matches(position))
+    return positions, total
 
 
 @entries_bp.route('', methods=['GET'])
 @jwt_required()
 def get_entries():
-    """获取所有记账条目（支持时间段筛选、账户筛选、分页和排序）"""
+    """获取所有记账条目（支持时间段筛选、账户筛选、分页和排序）
+
+    支持两种分页方式：page/page_size 偏移分页，以及 cursor 游标分页
+    （首页传空的cursor，之后传上一页返回的next_cursor）。单次最多返回 ENTRIES_MAX_PAGE_SIZE 条。
+    """
     # 从请求参数中获取年份和月份
     year = request.args.get('year')
     month = request.args.get('month')
 
-    # 如果指定了年份和月份，使用缓存功能获取条目
-    if year and month:
-        entries, errors, options = get_entries_by_file(year, month)
-    else:
-        # 否则加载所有条目
-        entries, errors, options = load_ledger()
-
     # 从请求参数中获取筛选条件
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     account = request.args.get('account')  # 添加账户筛选条件
     entry_type = request.args.get('type')  # 添加类型筛选条件
+    include_children = request.args.get('include_children', 'false').lower() in ('1', 'true', 'yes')  # 包含子账户
     page = int(request.args.get('page', 1))
-    page_size = int(request.args.get('page_size', 20))
+    page_size = min(int(request.args.get('page_size', 20)), ENTRIES_MAX_PAGE_SIZE)
     sort = request.args.get('sort', 'date')  # 默认按日期排序
     order = request.args.get('order', 'desc')  # 默认降序
+    cursor = request.args.get('cursor')  # 游标分页
+
+    # 日期只解析一次
+    start_date_obj = datetime.fromisoformat(start_date).date() if start_date else None
+    end_date_obj = datetime.fromisoformat(end_date).date() if end_date else None
+
+    cursor_key = None
+    if cursor is not None:
+        if sort != 'date' or (year and month):
+            return jsonify({'error': 'Cursor pagination requires sort=date'}), 400
+        if cursor:
+            try:
+                cursor_key, cursor_order = decode_cursor(cursor)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            if cursor_order != order:
+                return jsonify({'error': 'Cursor does not match the requested order'}), 400
+
+    start = (page - 1) * page_size
+    end = start + page_size
+    next_cursor = None
+
+    if sort == 'date' and not (year and month):
+        # 按日期排序时使用日期索引：二分查找定位日期范围，结果天然有序，只序列化返回的条目
+        date_index, account_index = get_entry_indexes(with_account_index=bool(account or entry_type))
+        positions, total = select_entry_positions(
+            date_index,
+            account_index,
+            start_date_obj,
+            end_date_obj,
+            order,
+            account=account,
+            entry_type=entry_type,
+            include_children=include_children,
+            cursor_key=cursor_key,
+            with_total=True,
+        )
+
+        if cursor is not None:
+            start, end = 0, page_size
+        elif start_date and end_date:
+            # 包含date范围时不分页，但最多返回 ENTRIES_MAX_PAGE_SIZE 条
+            start, end = 0, min(total, ENTRIES_MAX_PAGE_SIZE)
+
+        # 多取一条用于判断是否还有下一页
+        page_positions = list(islice(positions, start, end + 1))
+        if len(page_positions) > end - start:
+            page_positions = page_positions[: end - start]
+            if page_positions:
+                next_cursor = encode_cursor(date_index.keys[page_positions[-1]], order)
+
+        # 条目的JSON文本缓存在快照索引上，翻页时不再重复序列化
+        encoded_entries = [date_index.encoded(position, encode_entry) for position in page_positions]
+    else:
+        # 如果指定了年份和月份，使用缓存功能获取条目
+        if year and month:
+            entries, errors, options = get_entries_by_file(year, month)
+        else:
+            # 否则加载所有条目
+            entries, errors, options = load_ledger()
 
-    # 转换为适合JSON的格式并应用筛选
-    entries_data = []
-    for entry in entries:
-        if hasattr(entry, 'date'):
-            # 时间段筛选
-            if start_date or end_date:
-                entry_date = entry.date
-                if start_date and entry_date < datetime.fromisoformat(start_date).date():
+        # 转换为适合JSON的格式并应用筛选
+        entries_data = []
+        for entry in entries:
+            if hasattr(entry, 'date'):
+                # 时间段筛选
+                if start_date_obj and entry.date < start_date_obj:
                     continue
-                if end_date and entry_date > datetime.fromisoformat(end_date).date():
+                if end_date_obj and entry.date > end_date_obj:
                     continue
-
-            # 递归函数：确保字典中所有键都是字符串类型
-            def ensure_string_keys(d):
-                if isinstance(d, dict):
-                    result = {}
-                    for k, v in d.items():
-                        result[str(k)] = ensure_string_keys(v)
-                    return result
-                elif isinstance(d, (list, tuple)):
-                    return [ensure_string_keys(item) for item in d]
-                else:
-                    return d
-
-            # 确保meta字段的所有键都是字符串类型，避免JSON序列化错误
-            meta_dict = {}
-            if hasattr(entry, 'meta'):
-                meta_dict = ensure_string_keys(dict(entry.meta))
-
-            # 创建条目ID：filename:lineno
-            entry_id = ''
-            if hasattr(entry, 'meta') and 'filename' in entry.meta and 'lineno' in entry.meta:
-                # 获取相对路径（使用os.path.relpath确保跨平台兼容性）
-                filename = entry.meta['filename']
-                main_dir = os.path.dirname(LEDGER_FILE)
-                try:
-                    # 使用relpath计算相对于主文件目录的相对路径
-                    filename = os.path.relpath(filename, main_dir)
-                except ValueError:
-                    # 如果路径不在同一驱动器（Windows）或无法计算相对路径，使用原始文件名
-                    pass
-                entry_id = f"{filename}:{entry.meta['lineno']}"
-
-            entry_data = {
-                'type': type(entry).__name__,
-                'id': entry_id,
-                'date': entry.date.isoformat(),
-                'meta': meta_dict,
-            }
-
-            # 类型筛选
-            if entry_type and entry_data['type'] != entry_type:
-                continue
-
-            # 添加交易描述
-            if hasattr(entry, 'narration'):
-                entry_data['narration'] = entry.narration
-
-            # 添加标签（将frozenset转换为列表以便JSON序列化）
-            if hasattr(entry, 'tags') and entry.tags:
-                entry_data['tags'] = list(entry.tags)
-
-            # 添加记账行信息
-            if hasattr(entry, 'postings'):
-                entry_data['postings'] = []
-                for posting in entry.postings:
-                    posting_data = {'account': posting.account}
-                    if hasattr(posting, 'units') and posting.units:
-                        posting_data['units'] = {'number': posting.units.number, 'currency': posting.units.currency}
-                    entry_data['postings'].append(posting_data)
-
-            # 添加账户信息（Open类型条目）
-            if hasattr(entry, 'account'):
-                entry_data['account'] = entry.account
-
-            # 账户筛选
-            if account:
-                # 检查Open/Close/Balance类型的账户
-                if hasattr(entry, 'account') and entry.account == account:
-                    entries_data.append(entry_data)
-                # 检查Transaction类型的记账行
-                elif hasattr(entry, 'postings'):
-                    for posting in entry.postings:
-                        if posting.account == account:
-                            entries_data.append(entry_data)
-                            break
-            else:
-                entries_data.append(entry_data)
-
-    # 排序
-    entries_data.sort(key=lambda x: x[sort] if sort in x else '', reverse=(order == 'desc'))
+                if entry_matches(entry, account, entry_type, include_children):
+                    entries_data.append(serialize_entry(entry))
+
+        # 排序
+        entries_data.sort(key=lambda x: x[sort] if sort in x else '', reverse=(order == 'desc'))
+
+        total = len(entries_data)
+        # 如果包含date范围, 则取消分页（最多返回 ENTRIES_MAX_PAGE_SIZE 条）
+        if start_date and end_date:
+            start, end = 0, min(total, ENTRIES_MAX_PAGE_SIZE)
+        encoded_entries = [current_app.json.dumps(entry_data) for entry_data in entries_data[start:end]]
+
+    if cursor is not None:
+        return entries_response(
+            encoded_entries,
+            {
+                'total': total,
+                'page_size': page_size,
+                'has_more': next_cursor is not None,
+                'next_cursor': next_cursor,
+            },
+        )
 
     # 分页
-    total = len(entries_data)
-    start = (page - 1) * page_size
-    end = start + page_size
-    paginated_entries = entries_data[start:end]
     pages = (total + page_size - 1) // page_size
 
     # 如果包含date范围, 则取消分页
     if start_date and end_date:
         page = 1
-        page_size = total
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_entries = entries_data[start:end]
-        pages = 1
+        page_size = min(total, ENTRIES_MAX_PAGE_SIZE)
+        pages = (total + page_size - 1) // page_size if page_size else 1
+
+    pagination = {
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'pages': pages,
+    }
+    if next_cursor is not None:
+        # 还有更多结果时附带游标，客户端可以继续以游标方式翻页
+        pagination['next_cursor'] = next_cursor
 
     # 返回分页结果
-    return jsonify(
-        {
-            'entries': paginated_entries,
-            'pagination': {
-                'total': total,
-                'page': page,
-                'page_size': page_size,
-                'pages': pages,
-            },
-        }
+    return entries_response(encoded_entries, pagination)
+
+
+@entries_bp.route('/export', methods=['GET'])
+@jwt_required()
+def export_entries():
+    """流式导出记账条目（NDJSON或CSV），筛选条件与获取条目列表一致
+
+    条目逐个编码并分块发送，内存占用不随导出规模增长，第一个条目编码后立即发送。
+    CSV格式中每个记账行一行，没有记账行的条目（Open/Balance等）输出一行。
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': f'Unsupported export format: {export_format}'}), 400
+
+    # 从请求参数中获取筛选条件
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    account = request.args.get('account')
+    entry_type = request.args.get('type')
+    include_children = request.args.get('include_children', 'false').lower() in ('1', 'true', 'yes')
+    order = request.args.get('order', 'asc')  # 导出默认按日期升序
+    start_date_obj = datetime.fromisoformat(start_date).date() if start_date else None
+    end_date_obj = datetime.fromisoformat(end_date).date() if end_date else None
+
+    # 导出期间固定使用同一个快照的索引
+    date_index, account_index = get_entry_indexes(with_account_index=bool(account or entry_type))
+    positions, _ = select_entry_positions(
+        date_index,
+        account_index,
+        start_date_obj,
+        end_date_obj,
+        order,
+        account=account,
+        entry_type=entry_type,
+        include_children=include_children,
     )
 
+    def iter_ndjson_lines():
+        for position in positions:
+            yield date_index.encoded(position, encode_entry) + '\n'
+
+    def iter_csv_lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def take_line(row):
+            writer.writerow(row)
+            line = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return line
+
+        yield take_line(EXPORT_CSV_FIELDS)
+        for position in positions:
+            entry = date_index.entries[position]
+            entry_data = serialize_entry(entry)
+            base = [entry_data['id'], entry_data['date'], entry_data['type'], entry_data.get('narration', '')]
+            if entry_data.get('postings'):
+                for posting in entry_data['postings']:
+                    units = posting.get('units') or {}
+                    yield take_line(base + [posting['account'], units.get('number', ''), units.get('currency', '')])
+            else:
+                amount = getattr(entry, 'amount', None)
+                yield take_line(
+                    base
+                    + [
+                        entry_data.get('account', ''),
+                        amount.number if amount else '',
+                        amount.currency if amount else '',
+                    ]
+                )
+
+    def generate():
+        lines = iter_ndjson_lines() if export_format == 'ndjson' else iter_csv_lines()
+        chunk = []
+        chunk_size = 0
+        first = True
+        for line in lines:
+            chunk.append(line)
+            chunk_size += len(line)
+            # 第一块立即发送，之后按块大小发送
+            if first or chunk_size >= EXPORT_CHUNK_BYTES:
+                yield ''.join(chunk)
+                chunk = []
+                chunk_size = 0
+                first = False
+        if chunk:
+            yield ''.join(chunk)
+
+    if export_format == 'ndjson':
+        mimetype = 'application/x-ndjson'
+    else:
+        mimetype = 'text/csv'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=entries.{export_format}'
+    return response
+
 
 @entries_bp.route('', methods=['POST'])
 @jwt_required()
@@ -238,28 +551,25 @@ def add_entry():
             number = data['amount']
             currency = 'CNY'
 
-        # 计算当前账户余额
-        entries, errors, options = load_ledger()
+        # 计算当前账户余额（需要基于最新账本计算）
+        balance_index = get_balance_index(wait_fresh=True)
         account = data['account']
         balance_date = datetime.fromisoformat(data['date']).date()
 
-        # 计算截至balance日期前一天的账户余额
-        current_balance = 0.0
-        for entry in entries:
-            if hasattr(entry, 'date') and entry.date < balance_date:
-                if hasattr(entry, 'postings'):
-                    for posting in entry.postings:
-                        if posting.account == account and hasattr(posting, 'units') and posting.units:
-                            current_balance += float(posting.units.number)
+        # 计算截至balance日期前一天该币种的账户余额（账户中的其他币种不参与比较）
+        current_balance = balance_index.balance_before(account, balance_date).get(currency, Decimal(0))
 
-        # 转换目标余额为浮点数
-        target_balance = float(number)
+        # 目标余额同样使用Decimal，避免浮点误差
+        try:
+            target_balance = Decimal(str(number))
+        except InvalidOperation:
+            return jsonify({'error': f'Invalid amount: {number}'}), 400
 
         # 构建条目字符串
         entry_str = ""
 
         # 如果当前余额与目标余额不一致，添加Pad指令
-        if abs(current_balance - target_balance) > 0.001:  # 允许小数点后三位的误差
+        if abs(current_balance - target_balance) > Decimal('0.001'):  # 允许小数点后三位的误差
             # Pad的日期应该是balance的前一天
             pad_date = balance_date - timedelta(days=1)
             entry_str = f"{pad_date.isoformat()} pad {account} {PAD_EQUITY_ACCOUNT}\n"
@@ -333,6 +643,9 @@ def add_entry():
         with open(ledge_file, 'a', encoding='utf-8') as f:
             f.write('\n' + f'{ledge_include_line} ;{year}年账本合集')
 
+    # 立即使账本缓存失效，并等待新快照就绪后再通知订阅者
+    mark_ledger_changed(wait_fresh=True)
+
     # 通知SSE订阅者有新条目添加
     notify_subscribers("entry_added", data)
 
@@ -441,6 +754,9 @@ def update_entry(entry_id):
         with open(full_path, 'w', encoding='utf-8') as f:
             f.writelines(new_lines)
 
+        # 立即使账本缓存失效，并等待新快照就绪后再通知订阅者
+        mark_ledger_changed(wait_fresh=True)
+
         # 通知SSE订阅者有条目更新
         notify_subscribers("entry_updated", data)
 
@@ -499,6 +815,9 @@ def delete_entry(entry_id):
         with open(full_path, 'w', encoding='utf-8') as f:
             f.writelines(new_lines)
 
+        # 立即使账本缓存失效，并等待新快照就绪后再通知订阅者
+        mark_ledger_changed(wait_fresh=True)
+
         # 通知SSE订阅者有条目删除
         notify_subscribers("entry_deleted", {'id': entry_id})
 
@@ -1,61 +1,64 @@
 # -*- coding: utf-8 -*-
-from flask import Blueprint, Response
+from flask import Blueprint, Response, request
 from flask_jwt_extended import jwt_required
-import time
 import json
-from app.utils.ledger_utils import load_ledger, sse_subscribers
+from app.utils.ledger_utils import get_ledger_summary, get_posting_accounts, sse_broadcaster
+from app.utils.sse_broadcaster import CLOSED, SSE_KEEPALIVE_INTERVAL
 
 # 创建蓝图
 events_bp = Blueprint('events', __name__)
 
 
+def format_event(event, data, event_id=None):
+    """格式化SSE消息，带ID的消息会被客户端记录，用于重连时的 Last-Event-ID"""
+    # 使用字符串格式化来构造JSON数据，避免在生成器中使用jsonify
+    message = f'data: {{"event": "{event}", "data": {json.dumps(data)}}}\n\n'
+    if event_id is not None:
+        message = f'id: {event_id}\n' + message
+    return message
+
+
 @events_bp.route('', methods=['GET'])
 @jwt_required()
 def events():
-    """SSE端点，用于实时通知账本更新"""
+    """SSE端点，用于实时通知账本更新
 
-    def event_stream():
-        # 客户端连接时发送欢迎消息
-        yield f'data: {{"event": "connected", "data": "Connected to SSE server"}}\n\n'
-        # 发送账户列表
-        entries, errors, options = load_ledger()
-
-        # 收集所有账户
-        accounts = set()
-        for entry in entries:
-            if hasattr(entry, 'postings'):
-                for posting in entry.postings:
-                    accounts.add(posting.account)
-        # 发送账户列表
-        yield f'data: {{"event": "accounts", "data": {json.dumps(sorted(list(accounts)))}}}\n\n'
-
-        # 创建一个队列来接收事件
-        queue = []
-
-        # 定义回调函数，用于将事件添加到队列
-        def callback(event_data):
-            queue.append(event_data)
-
-        # 添加订阅者
-        sse_subscribers.append(callback)
+    客户端重连时携带 Last-Event-ID 请求头（或 last_event_id 参数），只补发断开期间错过的事件；
+    错过的事件已不在缓冲区中时，重新发送账户列表和一次update事件，由客户端完整刷新。
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
 
+    def event_stream():
+        # 先注册订阅者，避免发送初始数据期间产生的事件丢失
+        subscription, missed = sse_broadcaster.subscribe(last_event_id)
         try:
+            if missed is not None:
+                # 重连：只补发错过的事件
+                for event_data in missed:
+                    yield format_event(event_data['event'], event_data['data'], event_data['id'])
+            else:
+                # 客户端连接时发送欢迎消息（带上当前事件ID，作为之后重连补发的起点）
+                yield format_event('connected', 'Connected to SSE server', subscription.start_id)
+                # 发送账户列表
+                yield format_event('accounts', get_posting_accounts())
+                if last_event_id:
+                    # 错过的事件已无法补发，通知客户端完整刷新
+                    yield format_event('update', get_ledger_summary(wait_fresh=False))
+
             while True:
-                # 如果队列中有事件，发送它们
-                while queue:
-                    event_data = queue.pop(0)
-                    # 使用字符串格式化来构造JSON数据，避免在生成器中使用jsonify
-                    yield f'data: {{"event": "{event_data["event"]}", "data": {json.dumps(event_data["data"])}}}\n\n'
-
-                # 等待一段时间再检查新事件
-                time.sleep(0.5)
-        except GeneratorExit:
-            # 客户端断开连接时移除订阅者
-            sse_subscribers.remove(callback)
+                # 阻塞等待新事件，空闲时定期发送保活注释（客户端会忽略注释行）
+                event_data = subscription.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                if event_data is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event_data is CLOSED:
+                    # 消费过慢被广播器断开，客户端会带着 Last-Event-ID 自动重连
+                    break
+                yield format_event(event_data['event'], event_data['data'], event_data['id'])
         except Exception as e:
-            # 其他错误时移除订阅者
             print(f"SSE Error: {e}")
-            if callback in sse_subscribers:
-                sse_subscribers.remove(callback)
+        finally:
+            # 客户端断开连接或出错时移除订阅者
+            sse_broadcaster.unsubscribe(subscription)
 
     return Response(event_stream(), mimetype='text/event-stream')
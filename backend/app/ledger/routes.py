@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-import beanquery
-from app.utils.ledger_utils import load_ledger
+from app.utils.ledger_utils import get_ledger_snapshot, query_cache, query_flight, query_pool
+from app.utils.query_plans import plan_cache
+from app.utils.query_pool import QueryCancelled, QueryTimeout, client_disconnected
 
 # 创建蓝图
 ledger_bp = Blueprint('ledger', __name__)
@@ -12,8 +13,8 @@ ledger_bp = Blueprint('ledger', __name__)
 @jwt_required()
 def get_ledger():
     """获取账本基本信息"""
-    entries, errors, options = load_ledger()
-    from app.utils.ledger_utils import ledger_cache
+    snapshot = get_ledger_snapshot()
+    entries, errors, options = snapshot['entries'], snapshot['errors'], snapshot['options']
 
     # 确保返回的数据都是可序列化的类型
     # 将frozenset等不可序列化对象转换为可序列化类型
@@ -46,7 +47,12 @@ def get_ledger():
             'entries_count': len(entries),
             'errors_count': len(errors),
             'errors': serializable_errors,
-            'last_modified': ledger_cache['last_modified'],
+            'last_modified': snapshot['last_modified'],
+            'load': snapshot.get('load_stats'),
+            'query_cache': query_cache.stats(),
+            'query_flight': query_flight.stats(),
+            'query_pool': query_pool.stats(),
+            'query_plans': plan_cache.stats(),
         }
     )
 
@@ -54,19 +60,30 @@ def get_ledger():
 @ledger_bp.route('/query', methods=['POST'])
 @jwt_required()
 def run_query():
-    """执行Beancount查询"""
+    """执行Beancount查询
+
+    查询在进程池中执行，超过 QUERY_TIMEOUT 秒或客户端断开连接时被中断，
+    最多返回 QUERY_MAX_ROWS 行（truncated 表示结果被截断）。
+    """
     data = request.json
     query = data.get('query', '')
 
     if not query:
         return jsonify({'error': 'Query is required'}), 400
 
-    entries, errors, options = load_ledger()
+    snapshot = get_ledger_snapshot()
+    if snapshot is None:
+        return jsonify({'error': 'Ledger is not available'}), 500
+    environ = request.environ
 
     try:
-        rows = beanquery.run_query(entries, options, query)
-        headers = [str(h) for h in rows[0]]
-        results = [dict(zip(headers, row)) for row in rows[1]]
-        return jsonify({'headers': headers, 'results': results})
+        headers, rows, truncated = query_pool.run(snapshot, query, cancelled=lambda: client_disconnected(environ))
+        results = [dict(zip(headers, row)) for row in rows]
+        return jsonify({'headers': headers, 'results': results, 'truncated': truncated})
+    except QueryTimeout:
+        return jsonify({'error': f'Query timed out after {query_pool.timeout:g} seconds'}), 504
+    except QueryCancelled:
+        # 客户端已断开，响应不会被读取
+        return jsonify({'error': 'Query cancelled'}), 499
     except Exception as e:
         return jsonify({'error': str(e)}), 400
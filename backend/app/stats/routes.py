@@ -12,70 +12,53 @@ logging.basicConfig(
     encoding="utf-8",
 )
 logger = logging.getLogger(__name__)
-from app.utils.ledger_utils import load_ledger, run_query_with_cache, get_file_by_year_month, get_entries_by_file
+from app.utils.ledger_utils import (
+    load_ledger,
+    run_query_with_cache,
+    get_file_by_year_month,
+    get_entries_by_file,
+    get_stats_engine,
+    get_posting_frame,
+)
+from app.utils.currency_sums import CurrencySums, to_json
+from app.utils.posting_frame import INTERVALS, posting_timeseries
+from app.utils.stats_engine import account_matcher, month_bounds
 from datetime import datetime
-import re
+import os
+
+# 配置
+STATS_ENGINE = os.getenv('STATS_ENGINE', 'native').lower()  # native（单次遍历汇总）/ beanquery（每个请求执行查询）
+TIMESERIES_MAX_PERIODS = int(os.getenv('TIMESERIES_MAX_PERIODS', 2000))  # 时间序列接口单次返回的最多周期数
 
 # 创建蓝图
 stats_bp = Blueprint("stats", __name__)
 
 
-# 解析position字段，提取金额部分
-def parse_position(position):
-    """解析position字段，提取金额部分
-    Beancount的position格式可能是：
-    - 数字类型：int/float
-    - 字符串类型：'金额 货币'，如'-16581.55 CNY'
-    - Amount对象：有amount属性
-    - Inventory对象：包含多个Amount对象的集合
-    """
-    if isinstance(position, (int, float)):
-        return float(position)
+def get_operating_currency(options):
+    """账本的主要货币"""
+    return options.get("operating_currency", ["CNY"])[0] if options.get("operating_currency") else "CNY"
+
+
+def currency_breakdown(**sums):
+    """把多个按币种的合计转换为 {币种: {名称: 金额}}"""
+    currencies = sorted(set().union(*sums.values()))
+    return {currency: {name: amounts.number(currency) for name, amounts in sums.items()} for currency in currencies}
 
-    try:
-        # 处理字符串类型
-        if isinstance(position, str):
-            # 查找第一个数字或负号
-            match = re.search(r'^-?\d+(\.\d+)?', position.strip())
-            if match:
-                return float(match.group())
-
-        # 处理Amount对象
-        elif hasattr(position, 'amount'):
-            return float(position.amount)
-
-        # 处理Inventory对象（包含多个Amount）
-        elif hasattr(position, 'get_amounts'):
-            total = 0.0
-            for amount_obj in position.get_amounts():
-                if hasattr(amount_obj, 'amount'):
-                    total += float(amount_obj.amount)
-            return total
-
-        # 处理可迭代对象（可能是Inventory的其他实现）
-        elif hasattr(position, '__iter__') and not isinstance(position, (str, dict)):
-            try:
-                total = 0.0
-                for item in position:
-                    if hasattr(item, 'amount'):
-                        total += float(item.amount)
-                    else:
-                        # 尝试直接解析item
-                        total += parse_position(item)
-                return total
-            except Exception:
-                pass
-
-        # 作为最后尝试，转换为字符串再处理
-        elif hasattr(position, '__str__'):
-            position_str = str(position)
-            match = re.search(r'(-?\d+(\.\d+)?)', position_str)
-            if match:
-                return float(match.group(1))
-    except Exception as e:
-        logger.error(f"解析position失败: {position}, 类型: {type(position)}, 错误: {str(e)}")
 
-    return 0.0
+def run_stats_query(entries, options, query):
+    """执行统计查询，返回结果行（字典）列表
+
+    Raises:
+        ValueError: 查询结果为空
+    """
+    result = run_query_with_cache(entries, options, query)
+    if result is None:
+        raise ValueError("查询结果为空")
+    if not result or len(result) != 2:
+        return []
+    rtypes, rrows = result
+    headers = [str(col[0]) for col in rtypes]
+    return [dict(zip(headers, row)) for row in rrows if len(row) == len(headers)]
 
 
 @stats_bp.route('/monthly-expenses', methods=['GET'])
@@ -111,6 +94,7 @@ def get_monthly_expenses():
                 # 构建日期范围条件
                 where_clause = f"date >= {start.strftime('%Y-%m-%d')} and date <= {end.strftime('%Y-%m-%d')} and account ~ 'Expenses:*'"
                 group_by_clause = "year, month, account"
+                date_range = (start.date(), end.date())
             except ValueError:
                 return jsonify({"error": "日期格式无效，应为YYYY-MM-DD"}), 400
         else:
@@ -119,74 +103,55 @@ def get_monthly_expenses():
             current_month = datetime.now().month
             where_clause = f"year = {current_year} and month = {current_month} and account ~ 'Expenses:*'"
             group_by_clause = "year, month, account"
-
-        # 构建查询
-        query = f"""SELECT 
+            date_range = month_bounds(current_year, current_month)
+
+        if STATS_ENGINE == 'native':
+            # 从按 (年, 月, 账户) 汇总的结果中读取，不再扫描记账行
+            engine = get_stats_engine()
+            rows = [
+                {"account": account, "total": totals.cost}
+                for (_, _, account), totals in engine.aggregate(*date_range, match=account_matcher('Expenses:*'))
+            ]
+        else:
+            # 构建查询
+            query = f"""SELECT 
             year, month, account, sum(cost(position)) as total
         FROM 
             {where_clause}
         GROUP BY {group_by_clause}
         ORDER BY {order_by_clause}"""
 
-        try:
-            result = run_query_with_cache(entries, options, query)
-            if result is None:
-                return jsonify({"error": "查询执行失败", "details": "查询结果为空"}), 500
-        except Exception as e:
-            return jsonify({"error": "查询执行失败", "details": str(e)}), 500
-
-        # 处理查询结果
-        if result and len(result) == 2:
-            rtypes, rrows = result
-            headers = [str(col[0]) for col in rtypes]
-
-            expenses = []
-            total_expense = 0.0
-
-            for row in rrows:
-                if len(row) == len(headers):
-                    row_dict = dict(zip(headers, row))
-                    account = row_dict.get("account", "")
-                    total = row_dict.get("total", 0)
-
-                    # 解析金额
-                    amount = parse_position(total)
-                    total_expense += amount
-
-                    expenses.append({"account": account, "total": amount})
-
-            # 按金额降序排序
-            expenses.sort(key=lambda x: x["total"], reverse=True)
-
-            return (
-                jsonify(
+            try:
+                rows = run_stats_query(entries, options, query)
+            except Exception as e:
+                return jsonify({"error": "查询执行失败", "details": str(e)}), 500
+
+        # 处理查询结果：按币种精确累加，total 为主要货币的金额
+        currency = get_operating_currency(options)
+        expenses = []
+        total_expense = CurrencySums()
+
+        for row in rows:
+            amounts = CurrencySums.of(row.get("total"))
+            total_expense += amounts
+            expenses.append({"account": row.get("account", ""), "total": amounts.number(currency), "amounts": amounts})
+
+        # 按金额降序排序，金额相同时按账户排序
+        expenses.sort(key=lambda x: (-x["total"], x["account"]))
+
+        return (
+            jsonify(
+                to_json(
                     {
                         "monthly_expenses": expenses,
-                        "total_expense": total_expense,
-                        "currency": (
-                            options.get("operating_currency", ["CNY"])[0]
-                            if options.get("operating_currency")
-                            else "CNY"
-                        ),
-                    }
-                ),
-                200,
-            )
-        else:
-            return (
-                jsonify(
-                    {
-                        "monthly_expenses": [],
-                        "total_expense": 0.0,
-                        "currency": (
-                            options.get("operating_currency", ["CNY"])[0]
-                            if options.get("operating_currency")
-                            else "CNY"
-                        ),
+                        "total_expense": total_expense.number(currency),
+                        "total_expense_by_currency": total_expense,
+                        "currency": currency,
                     }
-                ),
-                200,
-            )
+                )
+            ),
+            200,
+        )
 
     except Exception as e:
         logger.error(f"API处理异常: {str(e)}", exc_info=True)
@@ -224,6 +189,7 @@ def get_monthly_income_expense():
 
                 # 构建日期范围条件，不使用单引号包裹日期
                 where_clause = f"date >= {start.strftime('%Y-%m-%d')} and date <= {end.strftime('%Y-%m-%d')} and (account ~ 'Expenses' OR account ~ 'Liabilities' OR account ~ 'Income')"
+                date_range = (start.date(), end.date())
             except ValueError:
                 return jsonify({"error": "日期格式无效，应为YYYY-MM-DD"}), 400
         else:
@@ -231,81 +197,66 @@ def get_monthly_income_expense():
             current_year = datetime.now().year
             current_month = datetime.now().month
             where_clause = f"year = {current_year} and month = {current_month} and (account ~ 'Expenses' OR account ~ 'Liabilities' OR account ~ 'Income')"
-
-        # 构建查询
-        query = f"""SELECT 
+            date_range = month_bounds(current_year, current_month)
+
+        if STATS_ENGINE == 'native':
+            # 读取按一级账户汇总的分组，与 root(account, 1) 分组一致；
+            # 一级账户名包含匹配模式时，其下全部账户都满足原查询条件
+            engine = get_stats_engine()
+            rows = [
+                {"account": root, "total": totals.units}
+                for (_, _, root), totals in engine.aggregate(
+                    *date_range, match=account_matcher('Expenses', 'Liabilities', 'Income'), depth=1
+                )
+            ]
+        else:
+            # 构建查询
+            query = f"""SELECT 
             year, month, root(account, 1) as account, sum(position) as total 
         FROM 
             {where_clause}
         GROUP BY {group_by_clause}
         ORDER BY year, month, account"""
 
-        try:
-            result = run_query_with_cache(entries, options, query)
-            if result is None:
-                return jsonify({"error": "查询执行失败", "details": "查询结果为空"}), 500
-        except Exception as e:
-            return jsonify({"error": "查询执行失败", "details": str(e)}), 500
-
-        # 处理查询结果
-        if result and len(result) == 2:
-            rtypes, rrows = result
-            headers = [str(col[0]) for col in rtypes]
-
-            income = 0.0
-            expense = 0.0
-            liabilities = 0.0
-
-            for row in rrows:
-                if len(row) == len(headers):
-                    row_dict = dict(zip(headers, row))
-                    account = row_dict.get("account", "").lower()
-                    total = row_dict.get("total", 0)
-
-                    # 解析金额
-                    amount = parse_position(total)
-
-                    if account == "income":
-                        # 收入在beancount中通常为负数，转换为正数
-                        income += abs(amount)
-                    elif account == "expenses":
-                        # 支出在beancount中通常为正数，但可能因查询方式不同而有差异
-                        expense += abs(amount)
-                    elif account == "liabilities":
-                        # 负债处理
-                        liabilities += amount
-
-            return (
-                jsonify(
+            try:
+                rows = run_stats_query(entries, options, query)
+            except Exception as e:
+                return jsonify({"error": "查询执行失败", "details": str(e)}), 500
+
+        # 处理查询结果：按币种精确累加
+        income = CurrencySums()
+        expense = CurrencySums()
+        liabilities = CurrencySums()
+
+        for row in rows:
+            account = row.get("account", "").lower()
+            amount = CurrencySums.of(row.get("total"))
+
+            if account == "income":
+                # 收入在beancount中通常为负数，转换为正数
+                income += abs(amount)
+            elif account == "expenses":
+                # 支出在beancount中通常为正数，但可能因查询方式不同而有差异
+                expense += abs(amount)
+            elif account == "liabilities":
+                # 负债处理
+                liabilities += amount
+
+        currency = get_operating_currency(options)
+        return (
+            jsonify(
+                to_json(
                     {
-                        "income": income,
-                        "expense": expense,
-                        "liabilities": liabilities,
-                        "currency": (
-                            options.get("operating_currency", ["CNY"])[0]
-                            if options.get("operating_currency")
-                            else "CNY"
-                        ),
+                        "income": income.number(currency),
+                        "expense": expense.number(currency),
+                        "liabilities": liabilities.number(currency),
+                        "currency": currency,
+                        "by_currency": currency_breakdown(income=income, expense=expense, liabilities=liabilities),
                     }
-                ),
-                200,
-            )
-        else:
-            return (
-                jsonify(
-                    {
-                        "income": 0.0,
-                        "expense": 0.0,
-                        "liabilities": 0.0,
-                        "currency": (
-                            options.get("operating_currency", ["CNY"])[0]
-                            if options.get("operating_currency")
-                            else "CNY"
-                        ),
-                    }
-                ),
-                200,
-            )
+                )
+            ),
+            200,
+        )
 
     except Exception as e:
         logger.error(f"API处理异常: {str(e)}", exc_info=True)
@@ -347,101 +298,159 @@ def get_account_statistics():
             except ValueError:
                 return jsonify({"error": "日期格式无效，应为YYYY-MM-DD"}), 400
 
-        # 构建查询
-        query = f"""SELECT 
+        if STATS_ENGINE == 'native':
+            # 账户余额不受日期范围限制（与上面的查询条件一致）
+            engine = get_stats_engine()
+            rows = [
+                {"account": account, "total": totals.units}
+                for account, totals in engine.account_totals(match=account_matcher('Assets', 'Liabilities')).items()
+            ]
+        else:
+            # 构建查询
+            query = f"""SELECT 
             account, sum(position) as total 
         FROM 
             {where_clause}
         GROUP BY {group_by_clause}
         ORDER BY account"""
 
-        try:
-            result = run_query_with_cache(entries, options, query)
-            if result is None:
-                return jsonify({"error": "查询执行失败", "details": "查询结果为空"}), 500
-        except Exception as e:
-            return jsonify({"error": "查询执行失败", "details": str(e)}), 500
+            try:
+                rows = run_stats_query(entries, options, query)
+            except Exception as e:
+                return jsonify({"error": "查询执行失败", "details": str(e)}), 500
 
         # 处理查询结果
-        if result and len(result) == 2:
-            rtypes, rrows = result
-            headers = [str(col[0]) for col in rtypes]
-
-            accounts = []
-            assets_total = 0.0
-            liabilities_total = 0.0
-
-            for row in rrows:
-                if len(row) == len(headers):
-                    row_dict = dict(zip(headers, row))
-                    account_full = row_dict.get("account", "")
-                    total = row_dict.get("total", 0)
-
-                    # 解析金额
-                    amount = parse_position(total)
-
-                    # 提取账户类型和名称
-                    account_parts = account_full.split(':')
-                    account_type = account_parts[0] if account_parts else "Other"
-                    account_name = ':'.join(account_parts[1:]) if len(account_parts) > 1 else account_parts[0]
-
-                    # 处理资产和负债的总和
-                    if account_type.lower() == "assets":
-                        assets_total += abs(amount)  # 资产金额取绝对值
-                    elif account_type.lower() == "liabilities":
-                        liabilities_total += amount  # 负债保留原始值
-
-                    accounts.append(
-                        {
-                            "name": account_name,
-                            "fullName": account_full,
-                            "type": account_type,
-                            "balance": abs(amount),  # 账户余额取绝对值
-                            "rawBalance": amount,  # 保留原始值用于内部计算
-                            "currency": (
-                                options.get("operating_currency", ["CNY"])[0]
-                                if options.get("operating_currency")
-                                else "CNY"
-                            ),
-                        }
-                    )
-
-            # 按账户类型和名称排序
-            accounts.sort(key=lambda x: (x["type"].lower(), x["name"]))
-
-            return (
-                jsonify(
-                    {
-                        "accounts": accounts,
-                        "assets_total": assets_total,
-                        "liabilities_total": liabilities_total,
-                        "net_worth": assets_total - liabilities_total,  # 净资产 = 资产总额 - 负债总额
-                        "currency": (
-                            options.get("operating_currency", ["CNY"])[0]
-                            if options.get("operating_currency")
-                            else "CNY"
-                        ),
-                    }
-                ),
-                200,
+        currency = get_operating_currency(options)
+        accounts = []
+        assets_total = CurrencySums()
+        liabilities_total = CurrencySums()
+
+        for row in rows:
+            account_full = row.get("account", "")
+            amounts = CurrencySums.of(row.get("total"))
+            amount = amounts.number(currency)
+
+            # 提取账户类型和名称
+            account_parts = account_full.split(':')
+            account_type = account_parts[0] if account_parts else "Other"
+            account_name = ':'.join(account_parts[1:]) if len(account_parts) > 1 else account_parts[0]
+
+            # 处理资产和负债的总和
+            if account_type.lower() == "assets":
+                assets_total += abs(amounts)  # 资产金额取绝对值
+            elif account_type.lower() == "liabilities":
+                liabilities_total += amounts  # 负债保留原始值
+
+            accounts.append(
+                {
+                    "name": account_name,
+                    "fullName": account_full,
+                    "type": account_type,
+                    "balance": abs(amount),  # 账户余额取绝对值
+                    "rawBalance": amount,  # 保留原始值用于内部计算
+                    "currency": currency,
+                    "balances": amounts,  # 各币种的原始余额
+                }
             )
-        else:
-            return (
-                jsonify(
+
+        # 按账户类型和名称排序
+        accounts.sort(key=lambda x: (x["type"].lower(), x["name"]))
+
+        net_worth = assets_total - liabilities_total  # 净资产 = 资产总额 - 负债总额
+        return (
+            jsonify(
+                to_json(
                     {
-                        "accounts": [],
-                        "assets_total": 0.0,
-                        "liabilities_total": 0.0,
-                        "net_worth": 0.0,
-                        "currency": (
-                            options.get("operating_currency", ["CNY"])[0]
-                            if options.get("operating_currency")
-                            else "CNY"
+                        "accounts": accounts,
+                        "assets_total": assets_total.number(currency),
+                        "liabilities_total": liabilities_total.number(currency),
+                        "net_worth": net_worth.number(currency),
+                        "currency": currency,
+                        "by_currency": currency_breakdown(
+                            assets_total=assets_total, liabilities_total=liabilities_total, net_worth=net_worth
                         ),
                     }
-                ),
-                200,
+                )
+            ),
+            200,
+        )
+
+    except Exception as e:
+        logger.error(f"API处理异常: {str(e)}", exc_info=True)
+        return jsonify({"error": "服务器内部错误", "details": str(e)}), 500
+
+
+@stats_bp.route('/timeseries', methods=['GET'])
+@jwt_required()
+def get_timeseries():
+    """获取按日/周/月汇总的账户金额序列，一次请求返回多个账户（含子账户）的趋势
+
+    查询参数：
+        accounts: 账户或父账户，逗号分隔，默认 Expenses
+        interval: daily / weekly / monthly，默认 monthly
+        depth: 指定时把每个账户下的子账户按前depth级拆分为多条序列（分类明细）
+        start_date / end_date: 日期范围（YYYY-MM-DD），不指定时取匹配记账行的范围
+        currency: 币种，默认账本的主要货币
+    """
+    try:
+        # 加载账本
+        entries, errors, options = load_ledger()
+
+        if errors and len(errors) > 0:
+            return jsonify({"error": "账本加载错误", "details": [str(e) for e in errors]}), 500
+
+        if not entries or not options:
+            return jsonify({"error": "账本数据无效"}), 500
+
+        accounts = [
+            account.strip() for account in request.args.get('accounts', 'Expenses').split(',') if account.strip()
+        ]
+        if not accounts:
+            return jsonify({"error": "账户不能为空"}), 400
+
+        interval = request.args.get('interval', 'monthly').lower()
+        if interval not in INTERVALS:
+            return jsonify({"error": f"interval 应为 {' / '.join(INTERVALS)}"}), 400
+
+        depth = request.args.get('depth')
+        if depth is not None:
+            if not depth.isdigit() or int(depth) < 1:
+                return jsonify({"error": "depth 应为正整数"}), 400
+            depth = int(depth)
+
+        # 获取日期范围参数
+        try:
+            start_date = request.args.get('start_date')
+            end_date = request.args.get('end_date')
+            start = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
+            end = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+        except ValueError:
+            return jsonify({"error": "日期格式无效，应为YYYY-MM-DD"}), 400
+
+        currency = request.args.get('currency') or get_operating_currency(options)
+
+        frame, columns = get_posting_frame()
+        try:
+            periods, series = posting_timeseries(
+                frame, columns, accounts, currency, interval, start, end, depth, max_periods=TIMESERIES_MAX_PERIODS
             )
+        except ValueError as e:
+            return jsonify({"error": "日期范围过大", "details": str(e)}), 400
+
+        return (
+            jsonify(
+                {
+                    "interval": interval,
+                    "currency": currency,
+                    "periods": periods,
+                    "series": [
+                        {"prefix": prefix, "account": account, "values": values, "total": total}
+                        for prefix, account, values, total in series
+                    ],
+                }
+            ),
+            200,
+        )
 
     except Exception as e:
         logger.error(f"API处理异常: {str(e)}", exc_info=True)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+按币种的精确金额合计
+
+统计接口的查询结果（beanquery 返回的 Inventory，或统计引擎的 Totals）直接按结构读取为
+{币种: Decimal}，不经过字符串解析，不丢失其他币种和精度。
+计算全程使用 Decimal，只在生成 JSON 响应时转换为 float（见 to_json()）。
+"""
+from decimal import Decimal
+
+from beancount.core.amount import Amount
+from beancount.core.inventory import Inventory
+from beancount.core.position import Position
+
+ZERO = Decimal(0)
+
+
+class CurrencySums(dict):
+    """{币种: Decimal}，支持按币种相加、相减、取反和取绝对值"""
+
+    @classmethod
+    def of(cls, value):
+        """读取查询结果中的金额
+
+        Args:
+            value: Inventory、Position、Amount，None表示没有金额
+
+        Raises:
+            TypeError: 不是金额类型
+        """
+        sums = cls()
+        if value is None:
+            return sums
+        if isinstance(value, Inventory):
+            for position in value:
+                sums.add(position.units.currency, position.units.number)
+        elif isinstance(value, Position):
+            sums.add(value.units.currency, value.units.number)
+        elif isinstance(value, Amount):
+            sums.add(value.currency, value.number)
+        else:
+            raise TypeError(f"无法识别的金额类型: {type(value).__name__}")
+        return sums
+
+    def add(self, currency, number):
+        self[currency] = self.get(currency, ZERO) + number
+
+    def number(self, currency):
+        """指定币种的金额，没有该币种时为0"""
+        return self.get(currency, ZERO)
+
+    def __iadd__(self, other):
+        for currency, number in other.items():
+            self.add(currency, number)
+        return self
+
+    def __add__(self, other):
+        result = CurrencySums(self)
+        result += other
+        return result
+
+    def __neg__(self):
+        return CurrencySums({currency: -number for currency, number in self.items()})
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __abs__(self):
+        return CurrencySums({currency: abs(number) for currency, number in self.items()})
+
+
+def to_json(value):
+    """把响应中的 Decimal 转换为 float（按币种的合计转换为 {币种: float}，币种排序），其余值原样保留"""
+    if isinstance(value, Decimal):
+        # 避免输出 -0.0
+        return float(value) + 0.0
+    if isinstance(value, CurrencySums):
+        return {currency: to_json(value[currency]) for currency in sorted(value)}
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    return value
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+进程间事件总线
+
+多进程部署时，各工作进程在同一个目录下各自绑定一个 Unix 数据报套接字，
+广播时向目录中的其他套接字逐个发送消息，不依赖外部消息服务。
+用于在工作进程之间同步账本版本变化和SSE事件：写入请求所在的进程修改账本后，
+其他进程立即使缓存失效，并把事件推送给各自的SSE客户端。
+
+目录中还保存了共享的事件编号（文件锁保护的计数器）和纪元，
+使不同进程发出的SSE事件ID全局唯一且递增，客户端重连到任意进程都能补发错过的事件。
+"""
+import errno
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import threading
+
+EPOCH_FILE = 'epoch'
+SEQUENCE_FILE = 'sequence'
+SOCKET_SUFFIX = '.sock'
+MAX_MESSAGE_SIZE = 256 * 1024
+
+
+def create_bus_directory(directory=None):
+    """创建事件总线目录（在fork工作进程之前由主进程调用）
+
+    Args:
+        directory: 目录路径，为空时在临时目录下新建
+
+    Returns:
+        str: 目录路径
+    """
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    else:
+        directory = tempfile.mkdtemp(prefix='moneymint-bus-')
+
+    # 清理上次运行遗留的套接字，并写入本次运行的纪元
+    for filename in os.listdir(directory):
+        if filename.endswith(SOCKET_SUFFIX):
+            os.unlink(os.path.join(directory, filename))
+    with open(os.path.join(directory, EPOCH_FILE), 'w') as f:
+        f.write(f'{os.getpid():x}{os.urandom(4).hex()}')
+    with open(os.path.join(directory, SEQUENCE_FILE), 'w') as f:
+        f.write('0')
+    return directory
+
+
+class EventBus:
+    """基于 Unix 数据报套接字的进程间广播"""
+
+    def __init__(self, directory, on_message):
+        self.directory = directory
+        self.on_message = on_message
+        self.socket_path = os.path.join(directory, f'{os.getpid()}{SOCKET_SUFFIX}')
+        with open(os.path.join(directory, EPOCH_FILE)) as f:
+            self.epoch = f.read().strip()
+        self._sequence_fd = os.open(os.path.join(directory, SEQUENCE_FILE), os.O_RDWR)
+        self._sequence_lock = threading.Lock()
+        self._socket = None
+        self._thread = None
+        self.sent = 0
+        self.received = 0
+        self.failed = 0
+
+    def next_sequence(self):
+        """从共享计数器取下一个事件序号（跨进程递增）"""
+        with self._sequence_lock:
+            fcntl.flock(self._sequence_fd, fcntl.LOCK_EX)
+            try:
+                value = int(os.pread(self._sequence_fd, 32, 0) or b'0') + 1
+                encoded = str(value).encode('ascii')
+                os.pwrite(self._sequence_fd, encoded, 0)
+                os.ftruncate(self._sequence_fd, len(encoded))
+                return value
+            finally:
+                fcntl.flock(self._sequence_fd, fcntl.LOCK_UN)
+
+    def start(self):
+        """绑定本进程的套接字并启动接收线程"""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.socket_path)
+        self._thread = threading.Thread(target=self._receive_loop, name='event-bus', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def _receive_loop(self):
+        sock = self._socket
+        while True:
+            try:
+                payload = sock.recv(MAX_MESSAGE_SIZE)
+            except OSError:
+                return  # 套接字已关闭
+            try:
+                message = json.loads(payload)
+            except ValueError:
+                continue
+            self.received += 1
+            try:
+                # 同一发送方的消息按发送顺序依次处理
+                self.on_message(message)
+            except Exception as e:
+                print(f"Event bus handler failed: {e}")
+
+    def _peers(self):
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [
+            os.path.join(self.directory, filename)
+            for filename in filenames
+            if filename.endswith(SOCKET_SUFFIX) and os.path.join(self.directory, filename) != self.socket_path
+        ]
+
+    def broadcast(self, message):
+        """向其他所有进程发送消息（不阻塞；对方接收缓冲区已满时丢弃该消息）"""
+        if self._socket is None:
+            return
+        payload = json.dumps(message, default=str).encode('utf-8')
+        if len(payload) > MAX_MESSAGE_SIZE:
+            print(f"Event bus message too large ({len(payload)} bytes), skipped")
+            self.failed += 1
+            return
+
+        for peer in self._peers():
+            try:
+                self._socket.sendto(payload, socket.MSG_DONTWAIT, peer)
+                self.sent += 1
+            except OSError as e:
+                self.failed += 1
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    # 对应的进程已退出，清理遗留的套接字
+                    try:
+                        os.unlink(peer)
+                    except OSError:
+                        pass
+                else:
+                    print(f"Event bus send to {peer} failed: {e}")
+
+    def stats(self):
+        return {
+            'directory': self.directory,
+            'peers': len(self._peers()),
+            'sent': self.sent,
+            'received': self.received,
+            'failed': self.failed,
+        }
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+账本快照索引
+
+索引在每个账本快照上按需构建一次（见 ledger_utils.get_ledger_index），
+快照替换后随旧快照一起释放，因此索引内容永远与所在快照一致。
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from decimal import Decimal
+
+from beancount.core import data
+
+
+class BalanceIndex:
+    """按账户的每日余额前缀和索引
+
+    每个账户保存按日期排序的日期数组，以及截至每个日期（含）的各币种累计余额和记账行数，
+    "截至某日的余额"和"两个日期之间的变动"都只需一次二分查找。
+    """
+
+    def __init__(self, entries):
+        postings = defaultdict(list)  # 账户 -> [(日期, 币种, 数量)]
+        self.opens = []  # Open条目，按条目顺序
+        self.closes = []  # Close条目，按条目顺序
+
+        for entry in entries:
+            if isinstance(entry, data.Open):
+                self.opens.append(entry)
+            elif isinstance(entry, data.Close):
+                self.closes.append(entry)
+            elif isinstance(entry, data.Transaction):
+                for posting in entry.postings:
+                    if posting.units:
+                        postings[posting.account].append(
+                            (entry.date, posting.units.currency, posting.units.number)
+                        )
+
+        self._dates = {}  # 账户 -> 有记账行的日期（升序、去重）
+        self._totals = {}  # 账户 -> 截至对应日期的累计余额 {币种: Decimal}
+        self._counts = {}  # 账户 -> 截至对应日期的累计记账行数
+        for account, items in postings.items():
+            # 条目本身已按日期排序，稳定排序只在插件插入了乱序条目时才有实际开销
+            items.sort(key=lambda item: item[0])
+            dates = []
+            totals = []
+            counts = []
+            running = {}
+            count = 0
+            for date, currency, number in items:
+                running[currency] = running.get(currency, Decimal(0)) + number
+                count += 1
+                if dates and dates[-1] == date:
+                    totals[-1] = dict(running)
+                    counts[-1] = count
+                else:
+                    dates.append(date)
+                    totals.append(dict(running))
+                    counts.append(count)
+            self._dates[account] = dates
+            self._totals[account] = totals
+            self._counts[account] = counts
+
+    @property
+    def accounts(self):
+        """有记账行的全部账户"""
+        return self._dates.keys()
+
+    def _position(self, account, date, inclusive):
+        """截至date的累计位置下标，-1表示之前没有任何记账行"""
+        dates = self._dates.get(account)
+        if not dates:
+            return -1
+        if date is None:
+            return len(dates) - 1
+        if inclusive:
+            return bisect_right(dates, date) - 1
+        return bisect_left(dates, date) - 1
+
+    def _total_at(self, account, position):
+        if position < 0:
+            return {}
+        return self._totals[account][position]
+
+    def _count_at(self, account, position):
+        if position < 0:
+            return 0
+        return self._counts[account][position]
+
+    def balance(self, account, date=None):
+        """截至date（含当天）的各币种余额，date为None时返回全部记账行的余额"""
+        return dict(self._total_at(account, self._position(account, date, True)))
+
+    def balance_before(self, account, date):
+        """date之前（不含当天）的各币种余额"""
+        return dict(self._total_at(account, self._position(account, date, False)))
+
+    def change(self, account, start_date=None, end_date=None):
+        """[start_date, end_date] 区间内的各币种净变动，两端为None表示不限"""
+        end = self._total_at(account, self._position(account, end_date, True))
+        if start_date is None:
+            return dict(end)
+        start = self._total_at(account, self._position(account, start_date, False))
+        return {currency: number - start.get(currency, Decimal(0)) for currency, number in end.items()}
+
+    def posting_count(self, account, start_date=None, end_date=None):
+        """[start_date, end_date] 区间内的记账行数"""
+        end = self._count_at(account, self._position(account, end_date, True))
+        if start_date is None:
+            return end
+        return end - self._count_at(account, self._position(account, start_date, False))
+
+
+def entry_order_key(entry):
+    """条目的全序排序键：beancount 的 entry_sortkey 加上文件名，保证同一天内的顺序在不同快照间确定"""
+    meta = entry.meta or {}
+    return (entry.date, data.SORT_ORDER.get(type(entry), 0), meta.get('lineno') or 0, meta.get('filename') or '')
+
+
+class EntryDateIndex:
+    """按日期排序的条目索引
+
+    条目按 entry_order_key 排序（与账本中的原有顺序一致）；条目在 entries 中的下标
+    即为其位置编号，日期范围查询通过二分查找得到位置区间。
+    排序键不依赖位置，因此可以作为分页游标在新快照中重新定位。
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=entry_order_key)
+        self.keys = [entry_order_key(entry) for entry in self.entries]
+        self.dates = [key[0] for key in self.keys]
+        self._encoded = [None] * len(self.entries)  # 条目的API表示（JSON文本），按需填充
+
+    def __len__(self):
+        return len(self.entries)
+
+    def encoded(self, position, encoder):
+        """位置对应条目的JSON文本，每个快照上每个条目只编码一次
+
+        Args:
+            position: 条目位置
+            encoder: 将条目编码为JSON文本的函数，同一索引上必须始终使用同一个函数
+        """
+        text = self._encoded[position]
+        if text is None:
+            text = encoder(self.entries[position])
+            self._encoded[position] = text
+        return text
+
+    def bounds(self, start_date=None, end_date=None):
+        """[start_date, end_date] 对应的位置区间 [lo, hi)，两端为None表示不限"""
+        lo = 0 if start_date is None else bisect_left(self.dates, start_date)
+        hi = len(self.dates) if end_date is None else bisect_right(self.dates, end_date)
+        return lo, max(lo, hi)
+
+    def iter_positions(self, lo, hi, reverse=False):
+        """按日期顺序遍历位置区间 [lo, hi)
+
+        reverse为True时日期降序，同一天内仍保持原有顺序（与按日期稳定倒序排序的结果一致）。
+        """
+        if not reverse:
+            yield from range(lo, hi)
+            return
+        while hi > lo:
+            group_start = bisect_left(self.dates, self.dates[hi - 1], lo, hi)
+            yield from range(group_start, hi)
+            hi = group_start
+
+    def subset_bounds(self, positions, lo, hi):
+        """有序位置列表中落在位置区间 [lo, hi) 内的下标区间"""
+        return bisect_left(positions, lo), bisect_left(positions, hi)
+
+    def iter_subset(self, positions, lo, hi, reverse=False):
+        """按日期顺序遍历有序位置列表中落在位置区间 [lo, hi) 内的位置，顺序规则同 iter_positions()"""
+        i, j = self.subset_bounds(positions, lo, hi)
+        if not reverse:
+            for k in range(i, j):
+                yield positions[k]
+            return
+        while j > i:
+            # 同一天的条目在位置列表中连续，定位这一天在列表中的起点
+            day_start = bisect_left(self.dates, self.dates[positions[j - 1]], lo, hi)
+            group_start = bisect_left(positions, day_start, i, j)
+            for k in range(group_start, j):
+                yield positions[k]
+            j = group_start
+
+    def cursor_segments(self, key, lo, hi, reverse=False):
+        """位置区间 [lo, hi) 中排在游标key之后的部分
+
+        升序时为key之后的全部位置；降序时先是key所在日期中排在key之后的位置（同一天内升序），
+        再是更早的日期。新快照中插入或删除的条目不会导致重复或遗漏。
+
+        Returns:
+            list: [(lo, hi, reverse), ...]，按顺序遍历各段即可
+        """
+        after = max(lo, min(hi, bisect_right(self.keys, key, lo, hi)))
+        if not reverse:
+            return [(after, hi, False)]
+        day_start = bisect_left(self.dates, key[0], lo, hi)
+        day_end = bisect_right(self.dates, key[0], lo, hi)
+        return [(after, max(after, day_end), False), (lo, day_start, True)]
+
+    def iter_range(self, start_date=None, end_date=None, reverse=False):
+        """按日期顺序遍历日期范围内的条目"""
+        lo, hi = self.bounds(start_date, end_date)
+        for position in self.iter_positions(lo, hi, reverse):
+            yield self.entries[position]
+
+
+def entry_accounts(entry):
+    """条目涉及的账户：Open/Close/Balance等取其account，交易取各记账行的账户"""
+    if hasattr(entry, 'account'):
+        return {entry.account}
+    if hasattr(entry, 'postings'):
+        return {posting.account for posting in entry.postings}
+    return set()
+
+
+class EntryAccountIndex:
+    """账户和条目类型到条目位置的倒排索引
+
+    位置编号来自同一快照上的 EntryDateIndex，每个位置列表都按日期顺序排列，
+    可以直接与日期范围组合，查询开销只与该账户（或类型）的条目数有关。
+    """
+
+    def __init__(self, date_index):
+        self.by_account = defaultdict(list)  # 账户 -> 位置列表
+        self.by_prefix = defaultdict(list)  # 账户及其各级父账户 -> 位置列表
+        self.by_type = defaultdict(list)  # 条目类型 -> 位置列表
+
+        for position, entry in enumerate(date_index.entries):
+            self.by_type[type(entry).__name__].append(position)
+
+            accounts = entry_accounts(entry)
+            prefixes = set()
+            for account in accounts:
+                self.by_account[account].append(position)
+                parts = account.split(':')
+                for i in range(1, len(parts) + 1):
+                    prefixes.add(':'.join(parts[:i]))
+            for prefix in prefixes:
+                self.by_prefix[prefix].append(position)
+
+    def positions(self, account, include_children=False):
+        """涉及账户的条目位置列表，include_children为True时包含全部子账户"""
+        index = self.by_prefix if include_children else self.by_account
+        return index.get(account, [])
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+增量账本加载器
+
+将 beancount.loader 的加载流程拆分为"逐文件解析"和"跨文件处理"两个阶段：
+每个文件的解析结果按内容哈希缓存，重新加载时只解析内容发生变化的文件；
+排序、booking、插件和校验等跨文件阶段在合并后的条目上重新执行。
+各文件串行解析：在进程池中并行解析时，解析结果序列化传回的开销超过了并行节省的时间（见 bench_loader.py）。
+"""
+import copy
+import glob
+import hashlib
+import io
+import os
+import sys
+import threading
+
+from beancount.core import data
+from beancount.loader import LoadError, aggregate_options_map, compute_input_hash, run_transformations
+from beancount.ops import validation
+from beancount.parser import booking, options, parser
+
+
+def _parse_content(filename, content, encoding):
+    """解析单个文件的内容"""
+    return parser.parse_file(io.BytesIO(content), report_filename=filename, encoding=encoding)
+
+
+class LedgerLoader:
+    """按文件缓存解析结果的账本加载器"""
+
+    def __init__(self, encoding='utf-8'):
+        self.encoding = encoding
+        self._lock = threading.Lock()
+        self._parse_cache = {}  # 键为文件绝对路径，值为(内容哈希, 解析结果, 是否为本轮新解析)
+        self.last_stats = {}
+
+    @property
+    def file_hashes(self):
+        """最近一次加载中每个文件的内容哈希"""
+        return {filename: cached[0] for filename, cached in self._parse_cache.items()}
+
+    def parse_file(self, filename):
+        """解析单个文件，内容未变化时直接返回缓存的解析结果
+
+        Returns:
+            tuple: ((entries, errors, options_map), 是否重新解析)
+        """
+        with open(filename, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+
+        cached = self._parse_cache.get(filename)
+        if cached is not None and cached[0] == digest:
+            return cached[1], cached[2]
+
+        result = _parse_content(filename, content, self.encoding)
+        self._parse_cache[filename] = (digest, result, True)
+        return result, True
+
+    def _parse_recursive(self, filename):
+        """从主文件开始按include顺序解析全部文件（与 beancount.loader._parse_recursive 行为一致）"""
+        entries = []
+        parse_errors = []
+        options_map = None
+        other_options_map = []
+        filenames_seen = set()
+        parsed_count = 0
+
+        source_stack = [filename]
+        while source_stack:
+            filename = os.path.normpath(source_stack.pop(0))
+            is_top_level = options_map is None
+
+            # 检查重复解析的文件
+            if filename in filenames_seen:
+                parse_errors.append(
+                    LoadError(data.new_metadata('<load>', 0), 'Duplicate filename parsed: "{}"'.format(filename))
+                )
+                continue
+
+            # 检查文件是否存在
+            if not os.path.exists(filename):
+                parse_errors.append(
+                    LoadError(data.new_metadata('<load>', 0), 'File "{}" does not exist'.format(filename))
+                )
+                continue
+
+            filenames_seen.add(filename)
+            (src_entries, src_errors, src_options_map), parsed = self.parse_file(filename)
+            parsed_count += parsed
+
+            entries.extend(src_entries)
+            parse_errors.extend(src_errors)
+
+            # 只使用主文件的选项，其他文件的选项只参与聚合
+            if is_top_level:
+                # 缓存的解析结果会被多次使用，聚合前复制一份，避免修改缓存中的选项
+                options_map = copy.copy(src_options_map)
+                options_map['dcontext'] = copy.deepcopy(src_options_map['dcontext'])
+            else:
+                other_options_map.append(src_options_map)
+
+            # 展开include（支持glob）
+            cwd = os.path.dirname(filename)
+            for include_filename in src_options_map['include']:
+                search_path = include_filename
+                if not os.path.isabs(include_filename):
+                    search_path = os.path.join(cwd, include_filename)
+                matched_filenames = glob.glob(search_path, recursive=True)
+                if not matched_filenames:
+                    parse_errors.append(
+                        LoadError(
+                            data.new_metadata('<load>', 0),
+                            'File glob "{}" does not match any files'.format(include_filename),
+                        )
+                    )
+                source_stack.extend(matched_filenames)
+
+        if options_map is None:
+            options_map = options.OPTIONS_DEFAULTS.copy()
+
+        options_map['include'] = sorted(filenames_seen)
+        options_map = aggregate_options_map(options_map, other_options_map)
+
+        # 移除不再属于include图的文件的缓存，并清除本轮新解析标记
+        for cached_filename, (digest, result, _) in list(self._parse_cache.items()):
+            if cached_filename not in filenames_seen:
+                del self._parse_cache[cached_filename]
+            else:
+                self._parse_cache[cached_filename] = (digest, result, False)
+
+        self.last_stats = {'parsed_files': parsed_count, 'reused_files': len(filenames_seen) - parsed_count}
+        return entries, parse_errors, options_map
+
+    def load_file(self, filename):
+        """加载账本文件：增量解析后执行排序、booking、插件和校验
+
+        Args:
+            filename: 主账本文件路径
+
+        Returns:
+            tuple: (entries, errors, options_map)，与 beancount.loader.load_file 一致
+        """
+        filename = os.path.abspath(filename)
+
+        with self._lock:
+            entries, parse_errors, options_map = self._parse_recursive(filename)
+        entries.sort(key=data.entry_sortkey)
+
+        # 跨文件阶段：booking、插件、校验
+        entries, balance_errors = booking.book(entries, options_map)
+        parse_errors.extend(balance_errors)
+
+        saved_pythonpath = list(sys.path)
+        try:
+            if 'pythonpath' in options_map:
+                sys.path[0:0] = options_map['pythonpath']
+            entries, errors = run_transformations(entries, parse_errors, options_map, None)
+        finally:
+            sys.path[:] = saved_pythonpath
+
+        errors.extend(validation.validate(entries, options_map, None, None))
+
+        options_map['input_hash'] = compute_input_hash(options_map['include'])
+        return entries, errors, options_map
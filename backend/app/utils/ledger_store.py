@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+账本快照的磁盘缓存
+
+将加载后的条目、选项以及由此派生的索引（include结构、文件映射、年月映射）序列化到磁盘，
+缓存键为include图中每个文件的内容哈希。重启后如果没有任何文件变化，直接反序列化即可，
+无需重新解析整个账本。
+
+缓存只用于冷启动，由 CacheWriter 在后台线程中延迟写入，不占用重新加载（以及等待新快照的写入请求）的时间。
+"""
+import hashlib
+import os
+import pickle
+import struct
+import sys
+import threading
+import time
+
+import beancount
+
+# 配置
+LEDGER_DISK_CACHE = os.getenv('LEDGER_DISK_CACHE', 'true').lower() == 'true'
+LEDGER_CACHE_WRITE_DELAY = float(os.getenv('LEDGER_CACHE_WRITE_DELAY', 30))  # 重新加载后延迟写入磁盘缓存的秒数
+
+# 缓存文件格式：8字节魔数 + 4字节格式版本号，之后是pickle数据
+CACHE_MAGIC = b'MMLEDGER'
+CACHE_FORMAT_VERSION = 1
+CACHE_HEADER = struct.Struct('>8sI')
+
+# 写入磁盘缓存的快照字段
+CACHED_KEYS = (
+    'entries',
+    'errors',
+    'options',
+    'include_structure',
+    'reverse_include',
+    'file_entries',
+    'year_month_files',
+)
+
+
+def get_cache_file(ledger_file):
+    """获取磁盘缓存文件路径，默认位于账本目录下的 .cache 目录"""
+    cache_file = os.getenv('LEDGER_CACHE_FILE')
+    if cache_file:
+        return cache_file
+    return os.path.join(os.path.dirname(os.path.abspath(ledger_file)), '.cache', 'ledger.cache')
+
+
+def hash_file(file_path):
+    """计算文件内容的SHA-256哈希，文件不存在时返回None"""
+    try:
+        with open(file_path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (FileNotFoundError, PermissionError, IsADirectoryError):
+        return None
+
+
+def compute_file_hashes(filenames, known=None):
+    """计算一组文件的内容哈希
+
+    Args:
+        filenames: 文件路径列表
+        known: 已知的文件哈希（如增量加载器刚计算过的），这些文件不再重复读取
+
+    Returns:
+        dict: 键为文件绝对路径，值为内容哈希（文件不存在时为None）
+    """
+    known = known or {}
+    file_hashes = {}
+    for file_path in filenames:
+        file_path = os.path.abspath(file_path)
+        file_hashes[file_path] = known[file_path] if file_path in known else hash_file(file_path)
+    return file_hashes
+
+
+def _environment_tag():
+    """缓存依赖的运行环境：beancount版本变化时条目结构可能不同，必须重新加载"""
+    return {'beancount': beancount.__version__, 'python': list(sys.version_info[:2])}
+
+
+def load_snapshot(cache_file):
+    """从磁盘缓存读取账本快照
+
+    Args:
+        cache_file: 缓存文件路径
+
+    Returns:
+        tuple: (快照字典, 文件哈希)，缓存不存在、格式不兼容或任一文件已变化时返回None
+    """
+    try:
+        with open(cache_file, 'rb') as f:
+            header = f.read(CACHE_HEADER.size)
+            if len(header) != CACHE_HEADER.size:
+                return None
+            magic, format_version = CACHE_HEADER.unpack(header)
+            if magic != CACHE_MAGIC or format_version != CACHE_FORMAT_VERSION:
+                print(f"Ledger cache format mismatch, ignoring: {cache_file}")
+                return None
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # 缓存文件损坏时的异常类型多种多样，统一忽略并重新加载
+        print(f"Failed to read ledger cache {cache_file}: {e}")
+        return None
+
+    if payload.get('environment') != _environment_tag():
+        print(f"Ledger cache was written by a different environment, ignoring: {cache_file}")
+        return None
+
+    file_hashes = payload['file_hashes']
+    if compute_file_hashes(file_hashes) != file_hashes:
+        return None
+
+    return payload['snapshot'], file_hashes
+
+
+def save_snapshot(cache_file, snapshot, file_hashes):
+    """将账本快照写入磁盘缓存（先写临时文件再原子替换）
+
+    Args:
+        cache_file: 缓存文件路径
+        snapshot: 账本快照
+        file_hashes: include图中每个文件的内容哈希
+    """
+    payload = {
+        'environment': _environment_tag(),
+        'file_hashes': file_hashes,
+        'snapshot': {key: snapshot[key] for key in CACHED_KEYS},
+    }
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT_VERSION))
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except Exception as e:
+        print(f"Failed to write ledger cache {cache_file}: {e}")
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+
+class CacheWriter:
+    """在后台线程中写入磁盘缓存
+
+    登记待写入的快照后等待一段时间再写入；期间有更新的快照时只写最新的一份，
+    连续修改账本时不会每次重新加载都序列化一遍整个账本。
+    """
+
+    def __init__(self, delay=LEDGER_CACHE_WRITE_DELAY):
+        self.delay = delay
+        self._condition = threading.Condition()
+        self._pending = None  # (缓存文件, 快照, 文件哈希, 写入时刻)
+        self._thread = None
+        self.written = 0
+
+    def schedule(self, cache_file, snapshot, file_hashes, delay=None):
+        """登记待写入的快照，替换尚未写入的旧快照
+
+        Args:
+            delay: 延迟写入的秒数，None表示使用默认的延迟
+        """
+        due = time.monotonic() + (self.delay if delay is None else delay)
+        with self._condition:
+            self._pending = (cache_file, snapshot, file_hashes, due)
+            self._condition.notify_all()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ledger-cache-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending is None:
+                        self._thread = None
+                        return
+                    remaining = self._pending[3] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                cache_file, snapshot, file_hashes, _ = self._pending
+                self._pending = None
+            self._write(cache_file, snapshot, file_hashes)
+
+    def _write(self, cache_file, snapshot, file_hashes):
+        start_time = time.perf_counter()
+        save_snapshot(cache_file, snapshot, file_hashes)
+        self.written += 1
+        print(f"Ledger cache written in {time.perf_counter() - start_time:.4f} seconds")
+
+    def flush(self):
+        """立即写入尚未写入的快照，并等待后台线程退出（fork之前、进程退出时调用）"""
+        with self._condition:
+            pending, self._pending = self._pending, None
+            thread = self._thread
+            self._condition.notify_all()
+        if thread is not None:
+            # 进行中的写入完成后线程即退出
+            thread.join()
+        if pending is not None:
+            self._write(*pending[:3])
+
+    def reset_after_fork(self):
+        """fork出的子进程中调用：丢弃继承自父进程的状态（写入线程不会被子进程继承）"""
+        self._condition = threading.Condition()
+        self._pending = None
+        self._thread = None
@@ -1,143 +1,665 @@
 # -*- coding: utf-8 -*-
-import hashlib
+import atexit
 import os
+import queue
 import re
 import time
 import threading
 import beancount.loader
-import beanquery.query
 from collections import defaultdict
 from datetime import datetime
+from flask import has_request_context, request
+from app.utils import ledger_store
+from app.utils.event_bus import EventBus
+from app.utils.ledger_index import BalanceIndex, EntryAccountIndex, EntryDateIndex
+from app.utils.ledger_loader import LedgerLoader
+from app.utils.ledger_watcher import LedgerWatcher
+from app.utils.lru_cache import LRUCache
+from app.utils.posting_columns import PostingColumns
+from app.utils.posting_frame import build_posting_frame
+from app.utils.query_plans import run_query
+from app.utils.query_pool import QueryPool
+from app.utils.single_flight import SingleFlight
+from app.utils.sse_broadcaster import SseBroadcaster
+from app.utils.stats_engine import StatsEngine
 
 # 配置
 LEDGER_FILE = os.getenv('LEDGER_FILE', 'data/main.bean')
 PAD_EQUITY_ACCOUNT = os.getenv('PAD_EQUITY_ACCOUNT', 'Equity:Opening-Balances')
+LEDGER_INCREMENTAL_PARSE = os.getenv('LEDGER_INCREMENTAL_PARSE', 'true').lower() == 'true'  # 是否按文件增量解析
+LEDGER_MAX_STALENESS = float(os.getenv('LEDGER_MAX_STALENESS', 5))  # 账本变化后旧快照最多继续使用的秒数
+
+# 文件修改时间的精度余量（秒）：只能比较修改时间时，加载开始前这段时间内修改的文件也视为加载期间被修改
+MTIME_SLACK = 1.0
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv('QUERY_CACHE_MAX_ENTRIES', 256))  # 查询缓存最多保存的结果数
+QUERY_CACHE_MAX_BYTES = int(os.getenv('QUERY_CACHE_MAX_MB', 64)) * 1024 * 1024  # 查询缓存的近似内存上限
 
 # 缓存机制
-ledger_cache = {'entries': None, 'errors': None, 'options': None, 'last_modified': 0}
-query_cache = {}  # 查询结果缓存，键为查询哈希，值为(结果, 账本修改时间)
+ledger_cache = {'entries': None, 'errors': None, 'options': None, 'version': -1, 'last_modified': 0}
+# 查询结果缓存：有界LRU，账本版本变化时整体清空
+query_cache = LRUCache(max_entries=QUERY_CACHE_MAX_ENTRIES, max_bytes=QUERY_CACHE_MAX_BYTES)
+# 合并同时到达的相同查询：只执行一次，其余请求等待并共享结果
+query_flight = SingleFlight()
+# 快照索引构建同样只执行一次
+index_flight = SingleFlight()
+# 自定义查询（POST /api/ledger/query）在工作进程中执行，可超时中断
+query_pool = QueryPool()
 
 # 锁用于线程安全
 cache_lock = threading.Lock()
-query_cache_lock = threading.Lock()
+reload_condition = threading.Condition(cache_lock)  # 后台重新加载完成时通知等待的读者
+
+# 后台重新加载状态
+reload_state = {'running': False, 'stale_since': None, 'error': None, 'failed_version': None}
+
+# 按文件缓存解析结果的增量加载器
+ledger_loader = LedgerLoader(encoding='utf-8')
+
+# 磁盘缓存在后台延迟写入，进程退出时写入尚未写入的快照
+cache_writer = ledger_store.CacheWriter()
+atexit.register(cache_writer.flush)
+
+# 账本文件变更监听器，维护账本版本号；版本号变化时立即触发后台重新加载
+ledger_watcher = LedgerWatcher(on_change=lambda: _on_ledger_changed())
+
+# SSE事件广播器（每个订阅者一个有界队列）
+sse_broadcaster = SseBroadcaster()
+
+# fork之前被监听的文件，工作进程中重新监听
+_fork_watch_files = frozenset()
+
+# 进程间事件总线，多进程部署时由 start_event_bus() 在各工作进程中创建
+event_bus = None
+# 其他工作进程转发来的SSE事件，由分发线程按到达顺序等待新快照后发布（不阻塞总线的接收线程）
+_bus_events = queue.Queue()
+
+
+def get_file_modification_time(filenames):
+    """获取账本文件的最后修改时间（取include图中所有文件修改时间的最大值）"""
+    latest_mtime = 0
+    for file_path in filenames:
+        try:
+            file_mtime = os.path.getmtime(file_path)
+        except OSError:
+            continue
+        if file_mtime > latest_mtime:
+            latest_mtime = file_mtime
+    return latest_mtime
+
+
+def mark_ledger_changed(wait_fresh=False):
+    """标记账本已被修改（由写入接口调用），无需等待文件监听事件即可使缓存失效
+
+    Args:
+        wait_fresh: 为True时等待包含本次修改的新快照构建完成后再返回，
+            保证写入后紧接着的读取（包括SSE通知触发的刷新）能看到本次修改
+    """
+    # 稍后到达的本次写入的文件变更事件不再重复递增版本号
+    ledger_watcher.acknowledge()
+    version = ledger_watcher.bump()
+    if event_bus is not None:
+        # 其他工作进程同样立即使缓存失效，不必等待各自的文件监听事件
+        event_bus.broadcast({'type': 'bump'})
+    if wait_fresh:
+        get_ledger_snapshot(wait_fresh=True)
+    return version
+
+
+def request_wants_fresh():
+    """当前请求是否要求读取最新账本（写入后立即读取的场景）
+
+    通过查询参数 fresh=1 或请求头 X-Ledger-Fresh: 1 指定。
+    """
+    if not has_request_context():
+        return False
+    flag = request.args.get('fresh') or request.headers.get('X-Ledger-Fresh')
+    return flag is not None and flag.lower() in ('1', 'true', 'yes')
 
-# SSE订阅者
-sse_subscribers = []
 
+def get_ledger_files(snapshot):
+    """获取快照对应的include图中的全部文件（包括尚未创建的被include文件）"""
+    return set(snapshot['options'].get('include', [])) | set(snapshot['reverse_include']) | {LEDGER_FILE}
 
-def get_file_modification_time():
-    """获取账本文件的最后修改时间"""
-    # 获取主文件的修改时间
-    main_mtime = os.path.getmtime(LEDGER_FILE)
 
-    # 检查data目录下所有文件的修改时间
-    data_dir = os.path.dirname(LEDGER_FILE)
+def build_ledger_snapshot(version, use_disk_cache=False):
+    """加载账本并构建一份新的快照（条目、include结构和各类映射）
 
-    if os.path.exists(data_dir):
-        for root, dirs, files in os.walk(data_dir):
-            for file in files:
-                if file.endswith('.bean'):
-                    file_path = os.path.join(root, file)
-                    file_mtime = os.path.getmtime(file_path)
-                    if file_mtime > main_mtime:
-                        main_mtime = file_mtime
+    快照构建完成之前不会被任何读者看到，构建完成后由调用方整体替换 ledger_cache。
 
-    return main_mtime
+    Args:
+        version: 开始加载时的账本版本号
+        use_disk_cache: 是否优先从磁盘缓存读取（冷启动时使用）
+
+    Returns:
+        dict: 账本快照
+    """
+    start_time = time.perf_counter()
+    load_started_at = time.time()
+    watched_before = ledger_watcher.files
+    cache_file = ledger_store.get_cache_file(LEDGER_FILE)
+
+    snapshot = None
+    if use_disk_cache and ledger_store.LEDGER_DISK_CACHE:
+        cached = ledger_store.load_snapshot(cache_file)
+        if cached is not None:
+            snapshot, content_hashes = cached
+            load_source = 'disk_cache'
+
+    if snapshot is None:
+        snapshot = _load_ledger_files()
+        load_source = 'full_load'
+        content_hashes = ledger_loader.file_hashes if LEDGER_INCREMENTAL_PARSE else None
+
+    load_time = time.perf_counter() - start_time
+    print(f"Ledger loaded ({load_source}) in {load_time:.4f} seconds")
+
+    # 监听include图中的全部文件
+    watched_files = get_ledger_files(snapshot)
+    ledger_watcher.watch(watched_files)
+
+    # 加载开始时还没有被监听的文件（冷启动时的全部文件、新被include的文件）在加载期间的修改不会产生事件，
+    # 监听生效之后再核对一次，发现修改时递增版本号，由重新加载线程再加载一次
+    if _changed_during_load(ledger_watcher.files - watched_before, content_hashes, load_started_at):
+        print("Ledger files changed while loading, reloading again")
+        ledger_watcher.bump()
+
+    # 完整加载的快照在替换之后由后台线程写入磁盘缓存（见 _reload_worker），这里只记录文件哈希
+    if load_source == 'full_load' and ledger_store.LEDGER_DISK_CACHE:
+        snapshot['file_hashes'] = ledger_store.compute_file_hashes(watched_files, known=content_hashes)
+
+    snapshot['version'] = version
+    snapshot['last_modified'] = get_file_modification_time(watched_files)
+    snapshot['load_stats'] = {'source': load_source, 'seconds': load_time}
+    snapshot['indexes'] = {}  # 按需构建的索引，见 get_ledger_index()
+    if load_source == 'full_load' and LEDGER_INCREMENTAL_PARSE:
+        snapshot['load_stats'].update(ledger_loader.last_stats)
+    if len(snapshot['errors']) > 0:
+        print(f"errors: {snapshot['errors']}")
+    return snapshot
+
+
+def _changed_during_load(filenames, content_hashes, load_started_at):
+    """检查文件在加载开始之后是否被修改过
+
+    Args:
+        filenames: 需要检查的文件（绝对路径）
+        content_hashes: 加载时读取到的文件内容哈希，None表示未知，此时比较修改时间
+        load_started_at: 加载开始的时间戳
+    """
+    for file_path in filenames:
+        if content_hashes is not None:
+            if ledger_store.hash_file(file_path) != content_hashes.get(file_path):
+                return True
+        elif get_file_modification_time([file_path]) >= load_started_at - MTIME_SLACK:
+            return True
+    return False
+
+
+def _load_ledger_files():
+    """完整解析账本文件，构建条目、include结构和各类映射"""
+    print(f"Reloading ledger file: {LEDGER_FILE}")
+
+    # 分析include结构，构建文件目录缓存
+    include_structure, reverse_include = analyze_include_structure(LEDGER_FILE)
+
+    # 使用UTF-8编码加载账本文件
+    if LEDGER_INCREMENTAL_PARSE:
+        # 只重新解析内容发生变化的文件
+        entries, errors, options = ledger_loader.load_file(LEDGER_FILE)
+        print(
+            f"Parsed {ledger_loader.last_stats['parsed_files']} files, "
+            f"reused {ledger_loader.last_stats['reused_files']} cached files"
+        )
+    else:
+        entries, errors, options = beancount.loader.load_file(LEDGER_FILE, encoding='utf-8')
+
+    # 构建文件到条目的映射
+    file_entries = defaultdict(list)
+    for entry in entries:
+        if hasattr(entry, 'meta') and 'filename' in entry.meta:
+            filename = entry.meta['filename']
+            file_entries[filename].append(entry)
 
+    # 构建年份和月份的文件映射
+    year_month_files = defaultdict(dict)
+    base_dir = os.path.dirname(LEDGER_FILE)
 
-def load_ledger():
-    """加载账本文件（带缓存机制）"""
+    # 遍历所有文件，提取年份和月份信息
+    for filename in file_entries.keys():
+        # 获取相对于主文件目录的路径
+        try:
+            rel_path = os.path.relpath(filename, base_dir)
+        except ValueError:
+            rel_path = filename
+
+        # 解析年份和月份信息（主要针对date目录下的文件）
+        if 'date' in rel_path:
+            parts = rel_path.split(os.sep)
+            for i, part in enumerate(parts):
+                if part.isdigit() and len(part) == 4:  # 年份
+                    year = part
+                    # 检查下一个部分是否是月份文件
+                    if i + 1 < len(parts) and parts[i + 1].endswith('.bean'):
+                        month_file = parts[i + 1]
+                        # 提取月份信息（如2024-01.bean -> 01）
+                        if '-' in month_file:
+                            month = month_file.split('-')[1].split('.')[0]
+                            year_month_files[year][month] = filename
+
+    return {
+        'entries': entries,
+        'errors': errors,
+        'options': options,
+        'include_structure': include_structure,
+        'reverse_include': reverse_include,
+        'file_entries': file_entries,
+        'year_month_files': year_month_files,
+    }
+
+
+def _reload_worker():
+    """后台重新加载线程：构建新快照并原子替换，直到快照与最新版本号一致"""
     global ledger_cache
 
-    current_mtime = get_file_modification_time()
+    while True:
+        with cache_lock:
+            version = ledger_watcher.version
+            if ledger_cache['entries'] is not None and ledger_cache['version'] == version:
+                reload_state['running'] = False
+                reload_state['stale_since'] = None
+                reload_condition.notify_all()
+                return
+
+        cold_start = ledger_cache['entries'] is None
+        try:
+            # 冷启动时优先使用磁盘缓存
+            snapshot = build_ledger_snapshot(version, use_disk_cache=cold_start)
+        except Exception as e:
+            print(f"Ledger reload failed: {e}")
+            with cache_lock:
+                reload_state['running'] = False
+                reload_state['error'] = e
+                reload_state['failed_version'] = version
+                reload_condition.notify_all()
+            return
+
+        _carry_over_indexes(ledger_cache, snapshot)
+
+        with cache_lock:
+            # 原子替换：读者要么看到完整的旧快照，要么看到完整的新快照
+            ledger_cache = snapshot
+            reload_state['error'] = None
+            reload_state['failed_version'] = None
+            reload_condition.notify_all()
+
+        if 'file_hashes' in snapshot:
+            # 磁盘缓存只用于冷启动：冷启动的完整加载尽快写入，之后的重新加载延迟写入，
+            # 连续修改账本时只写最后一份，写缓存不会拖慢等待新快照的写入请求
+            cache_writer.schedule(
+                ledger_store.get_cache_file(LEDGER_FILE), snapshot, snapshot['file_hashes'], 0 if cold_start else None
+            )
+
+
+def _carry_over_indexes(previous, snapshot):
+    """由旧快照的索引增量派生新快照的索引（在替换快照之前调用）
+
+    新快照只追加了交易时（例如 add_entry），统计引擎只更新新增交易所在的分组，不必重新遍历全部记账行。
+    """
+    engine = previous.get('indexes', {}).get('stats') if previous['entries'] is not None else None
+    if engine is None:
+        return
+    start_time = time.perf_counter()
+    updated = engine.updated(snapshot['entries'])
+    if updated is not None:
+        snapshot['indexes']['stats'] = updated
+        print(f"Index stats updated incrementally in {time.perf_counter() - start_time:.4f} seconds")
+
+
+def _start_reload_locked():
+    """在持有 cache_lock 时启动后台重新加载（已有重新加载在进行时不重复启动）"""
+    if reload_state['stale_since'] is None:
+        reload_state['stale_since'] = time.monotonic()
+    if reload_state['running'] or reload_state['failed_version'] == ledger_watcher.version:
+        return
+    reload_state['running'] = True
+    threading.Thread(target=_reload_worker, name='ledger-reload', daemon=True).start()
+
+
+def _on_ledger_changed():
+    """账本版本号变化时立即在后台开始重新加载，缩短读者看到旧数据的时间"""
+    if ledger_cache['entries'] is None:
+        return
+    with cache_lock:
+        _start_reload_locked()
+
+
+def get_ledger_snapshot(wait_fresh=None):
+    """获取当前账本快照（stale-while-revalidate）
+
+    版本号未变化时直接返回缓存的快照。账本变化后在后台线程中重新加载，
+    在此期间读者继续使用旧快照，直到新快照构建完成后原子替换。
+    旧快照最多被使用 LEDGER_MAX_STALENESS 秒，超过后读者会等待新快照。
+
+    Args:
+        wait_fresh: 为True时等待与当前版本号一致的快照；为None时根据当前请求的fresh参数决定
+
+    Returns:
+        dict: 账本快照，主文件不存在时返回None
+    """
+    # 热路径：版本号未变化时直接返回缓存
+    snapshot = ledger_cache
+    version = ledger_watcher.version
+    if snapshot['entries'] is not None and snapshot['version'] == version:
+        return snapshot
 
     # 检查主文件是否存在
     if not os.path.exists(LEDGER_FILE):
         print(f"Error: Ledger file not found at {LEDGER_FILE}")
+        return None
+
+    if wait_fresh is None:
+        wait_fresh = request_wants_fresh()
+
+    with cache_lock:
+        _start_reload_locked()
+
+        # 已有快照且未超过最大容忍时间时，直接返回旧快照
+        if ledger_cache['entries'] is not None and not wait_fresh:
+            if time.monotonic() - reload_state['stale_since'] <= LEDGER_MAX_STALENESS:
+                return ledger_cache
+
+        # 等待后台线程构建出不旧于调用时版本号的快照
+        while ledger_cache['entries'] is None or ledger_cache['version'] < version:
+            if not reload_state['running']:
+                break
+            reload_condition.wait()
+
+        if ledger_cache['entries'] is None and reload_state['error'] is not None:
+            raise reload_state['error']
+        return ledger_cache
+
+
+def load_ledger(wait_fresh=None):
+    """加载账本文件（带缓存机制）
+
+    缓存是否有效只取决于账本版本号：文件监听器在include图中的文件变化时递增版本号，
+    因此缓存命中时不需要访问文件系统。
+
+    Args:
+        wait_fresh: 是否等待最新的账本快照，见 get_ledger_snapshot()
+    """
+    snapshot = get_ledger_snapshot(wait_fresh)
+    if snapshot is None:
         return None, None, None
+    return snapshot['entries'], snapshot['errors'], snapshot['options']
+
+
+def warm_ledger():
+    """预热账本快照及常用索引（多进程部署时在fork之前调用，工作进程以写时复制方式共享）"""
+    start_time = time.perf_counter()
+    snapshot = get_ledger_snapshot(wait_fresh=True)
+    if snapshot is None:
+        return None
+    get_snapshot_index(snapshot, 'balance', _build_balance_index)
+    get_snapshot_index(snapshot, 'entry_date', _build_entry_date_index)
+    get_snapshot_index(snapshot, 'entry_account', _build_entry_account_index)
+    get_snapshot_index(snapshot, 'posting_accounts', _build_posting_accounts)
+    get_snapshot_index(snapshot, 'postings', _build_posting_columns)
+    get_snapshot_index(snapshot, 'posting_frame', _build_posting_frame)
+    get_snapshot_index(snapshot, 'stats', _build_stats_engine)
+    print(f"Ledger warmed in {time.perf_counter() - start_time:.4f} seconds")
+    return snapshot
+
+
+def prepare_for_fork():
+    """fork工作进程之前在主进程中调用：停止文件监听线程，写入待写入的磁盘缓存
+
+    主进程不处理请求，不需要继续监听；后台线程也不会被子进程继承，
+    工作进程中由 reinit_after_fork() 重新启动。
+    """
+    global _fork_watch_files
 
     with cache_lock:
-        # 如果缓存为空或文件已修改，则重新加载
-        if ledger_cache['entries'] is None or current_mtime > ledger_cache['last_modified']:
-            print(f"Reloading ledger file: {LEDGER_FILE}")
-            # 使用UTF-8编码加载账本文件
-            entries, errors, options = beancount.loader.load_file(LEDGER_FILE, encoding='utf-8')
-
-            # 根据beancount load_file的返回值构建目录结构
-            # 分析include结构，构建文件目录缓存
-            include_structure, reverse_include = analyze_include_structure(LEDGER_FILE)
-
-            # 构建文件到条目的映射
-            file_entries = defaultdict(list)
-            for entry in entries:
-                if hasattr(entry, 'meta') and 'filename' in entry.meta:
-                    filename = entry.meta['filename']
-                    file_entries[filename].append(entry)
-
-            # 构建年份和月份的文件映射
-            year_month_files = defaultdict(dict)
-            base_dir = os.path.dirname(LEDGER_FILE)
-
-            # 遍历所有文件，提取年份和月份信息
-            for filename in file_entries.keys():
-                # 获取相对于主文件目录的路径
-                try:
-                    rel_path = os.path.relpath(filename, base_dir)
-                except ValueError:
-                    rel_path = filename
-
-                # 解析年份和月份信息（主要针对date目录下的文件）
-                if 'date' in rel_path:
-                    parts = rel_path.split(os.sep)
-                    for i, part in enumerate(parts):
-                        if part.isdigit() and len(part) == 4:  # 年份
-                            year = part
-                            # 检查下一个部分是否是月份文件
-                            if i + 1 < len(parts) and parts[i + 1].endswith('.bean'):
-                                month_file = parts[i + 1]
-                                # 提取月份信息（如2024-01.bean -> 01）
-                                if '-' in month_file:
-                                    month = month_file.split('-')[1].split('.')[0]
-                                    year_month_files[year][month] = filename
-
-            ledger_cache = {
-                'entries': entries,
-                'errors': errors,
-                'options': options,
-                'last_modified': current_mtime,
-                'include_structure': include_structure,
-                'reverse_include': reverse_include,
-                'file_entries': file_entries,
-                'year_month_files': year_month_files,
-            }
-            if len(errors) > 0:
-                print(f"errors: {errors}")
-
-    return ledger_cache['entries'], ledger_cache['errors'], ledger_cache['options']
+        # 等待进行中的后台重新加载完成，避免fork时锁处于被持有状态
+        while reload_state['running']:
+            reload_condition.wait()
+    # 写入线程同样要在fork之前结束
+    cache_writer.flush()
+    _fork_watch_files = ledger_watcher.files
+    ledger_watcher.stop()
+
+
+def reinit_after_fork():
+    """在fork出的工作进程中调用：重新启动文件监听，重置SSE广播器和查询进程池"""
+    sse_broadcaster.reset_after_fork()
+    query_pool.reset_after_fork()
+    cache_writer.reset_after_fork()
+    # 查询进程池的派生进程必须在启动文件监听等后台线程之前fork
+    start_query_pool()
+
+    files = _fork_watch_files
+    if not files and ledger_cache['entries'] is not None:
+        files = get_ledger_files(ledger_cache)
+    if files:
+        ledger_watcher.watch(files)
+        # 主进程停止监听之后账本可能已被修改
+        if ledger_cache['entries'] is not None and get_file_modification_time(files) > ledger_cache['last_modified']:
+            ledger_watcher.bump()
+
+
+def _load_query_ledger():
+    """在查询进程池的派生进程中重新加载账本"""
+    if LEDGER_INCREMENTAL_PARSE:
+        entries, _, options = ledger_loader.load_file(LEDGER_FILE)
+    else:
+        entries, _, options = beancount.loader.load_file(LEDGER_FILE, encoding='utf-8')
+    return entries, options
+
+
+def start_query_pool():
+    """启动查询进程池（fork派生进程），必须在当前进程启动任何后台线程之前调用"""
+    query_pool.start(ledger_cache if ledger_cache['entries'] is not None else None, _load_query_ledger)
+
+
+def _on_bus_message(message):
+    """处理其他工作进程通过事件总线发来的消息（在总线接收线程中调用，不能阻塞）"""
+    if message.get('type') == 'bump':
+        # 只递增版本号，由后台线程重新加载；等待新快照会阻塞接收，期间到达的消息可能被丢弃
+        ledger_watcher.acknowledge()
+        ledger_watcher.bump()
+    elif message.get('type') == 'event':
+        _bus_events.put(message)
+
+
+def _publish_bus_event(message):
+    """发布其他工作进程转发来的SSE事件"""
+    try:
+        # 等待新快照就绪，客户端收到事件后刷新才能读到修改后的账本
+        get_ledger_snapshot(wait_fresh=True)
+    except Exception as e:
+        print(f"Error reloading ledger before forwarding event: {e}")
+    sse_broadcaster.publish({'event': message['event'], 'data': message['data']}, event_id=message['id'])
+
+
+def _dispatch_bus_events():
+    """事件分发线程：按到达顺序逐个发布总线转发来的SSE事件"""
+    while True:
+        _publish_bus_event(_bus_events.get())
+
+
+def start_event_bus(directory):
+    """在工作进程中加入进程间事件总线（fork之后调用）
+
+    Args:
+        directory: 主进程通过 event_bus.create_bus_directory() 创建的目录
+    """
+    global event_bus
+    bus = EventBus(directory, _on_bus_message)
+    bus.start()
+    threading.Thread(target=_dispatch_bus_events, name='event-bus-dispatch', daemon=True).start()
+    # 各进程共用纪元和事件序号，客户端重连到任意进程都能补发错过的事件
+    sse_broadcaster.use_shared_sequence(bus.epoch, bus.next_sequence)
+    event_bus = bus
+    print(f"Worker {os.getpid()} joined event bus at {directory}")
 
 
 def get_include_structure():
     """获取include结构缓存"""
-    load_ledger()  # 确保缓存已加载
-    return ledger_cache.get('include_structure', {})
+    snapshot = get_ledger_snapshot() or ledger_cache
+    return snapshot.get('include_structure', {})
 
 
 def get_reverse_include():
     """获取反向include映射缓存"""
-    load_ledger()  # 确保缓存已加载
-    return ledger_cache.get('reverse_include', {})
+    snapshot = get_ledger_snapshot() or ledger_cache
+    return snapshot.get('reverse_include', {})
 
 
 def get_file_entries():
     """获取文件到条目的映射缓存"""
-    load_ledger()  # 确保缓存已加载
-    return ledger_cache.get('file_entries', defaultdict(list))
+    snapshot = get_ledger_snapshot() or ledger_cache
+    return snapshot.get('file_entries', defaultdict(list))
 
 
 def get_year_month_files():
     """获取年份月份文件映射缓存"""
-    load_ledger()  # 确保缓存已加载
-    return ledger_cache.get('year_month_files', defaultdict(dict))
+    snapshot = get_ledger_snapshot() or ledger_cache
+    return snapshot.get('year_month_files', defaultdict(dict))
+
+
+def get_snapshot_index(snapshot, name, builder):
+    """获取指定快照上的索引，每个快照只构建一次
+
+    Args:
+        snapshot: 账本快照
+        name: 索引名称
+        builder: 根据快照构建索引的函数
+
+    Returns:
+        索引对象
+    """
+    index = snapshot['indexes'].get(name)
+    if index is not None:
+        return index
+
+    def build():
+        if name not in snapshot['indexes']:
+            start_time = time.perf_counter()
+            snapshot['indexes'][name] = builder(snapshot)
+            print(f"Index {name} built in {time.perf_counter() - start_time:.4f} seconds")
+        return snapshot['indexes'][name]
+
+    return index_flight.do((id(snapshot), name), build)
+
+
+def get_ledger_index(name, builder, wait_fresh=None):
+    """获取当前快照上的索引
+
+    Args:
+        name: 索引名称
+        builder: 根据快照构建索引的函数
+        wait_fresh: 是否等待最新的账本快照，见 get_ledger_snapshot()
+
+    Returns:
+        索引对象，主文件不存在时返回None
+    """
+    snapshot = get_ledger_snapshot(wait_fresh)
+    if snapshot is None:
+        return None
+    return get_snapshot_index(snapshot, name, builder)
+
+
+def _build_balance_index(snapshot):
+    return BalanceIndex(snapshot['entries'])
+
+
+def _build_entry_date_index(snapshot):
+    return EntryDateIndex(snapshot['entries'])
+
+
+def _build_entry_account_index(snapshot):
+    # 位置编号必须来自同一快照的日期索引
+    return EntryAccountIndex(get_snapshot_index(snapshot, 'entry_date', _build_entry_date_index))
+
+
+def get_balance_index(wait_fresh=None):
+    """获取按账户的每日余额前缀和索引"""
+    return get_ledger_index('balance', _build_balance_index, wait_fresh)
+
+
+def get_snapshot_balance_index(snapshot):
+    """获取指定快照上的余额索引（与该快照的条目和options保持一致）"""
+    return get_snapshot_index(snapshot, 'balance', _build_balance_index)
+
+
+def _build_posting_columns(snapshot):
+    return PostingColumns(snapshot['entries'])
+
+
+def get_posting_columns(wait_fresh=None):
+    """获取列式记账行（NumPy 数组，向量化求和与分组）"""
+    return get_ledger_index('postings', _build_posting_columns, wait_fresh)
+
+
+def _build_posting_frame(snapshot):
+    return build_posting_frame(get_snapshot_index(snapshot, 'postings', _build_posting_columns))
+
+
+def get_posting_frame(wait_fresh=None):
+    """获取同一快照上的记账行 DataFrame 和列式记账行
+
+    Returns:
+        tuple: (DataFrame, PostingColumns)，主文件不存在时返回(None, None)
+    """
+    snapshot = get_ledger_snapshot(wait_fresh)
+    if snapshot is None:
+        return None, None
+    frame = get_snapshot_index(snapshot, 'posting_frame', _build_posting_frame)
+    return frame, get_snapshot_index(snapshot, 'postings', _build_posting_columns)
+
+
+def _build_stats_engine(snapshot):
+    # 由同一快照的列式记账行向量化构建
+    return StatsEngine(snapshot['entries'], columns=get_snapshot_index(snapshot, 'postings', _build_posting_columns))
+
+
+def get_stats_engine(wait_fresh=None):
+    """获取按 (年, 月, 账户) 汇总记账行的统计引擎（每个快照只遍历一次记账行）"""
+    return get_ledger_index('stats', _build_stats_engine, wait_fresh)
+
+
+def _build_posting_accounts(snapshot):
+    accounts = set()
+    for entry in snapshot['entries']:
+        if hasattr(entry, 'postings'):
+            for posting in entry.postings:
+                accounts.add(posting.account)
+    return sorted(accounts)
+
+
+def get_posting_accounts(wait_fresh=None):
+    """获取记账行中出现过的全部账户（已排序，每个快照只计算一次）"""
+    return get_ledger_index('posting_accounts', _build_posting_accounts, wait_fresh)
+
+
+def get_entry_indexes(with_account_index=False, wait_fresh=None):
+    """获取同一快照上的日期索引和账户倒排索引
+
+    Args:
+        with_account_index: 是否同时获取账户倒排索引（不需要时不构建）
+        wait_fresh: 是否等待最新的账本快照，见 get_ledger_snapshot()
+
+    Returns:
+        tuple: (EntryDateIndex, EntryAccountIndex或None)，主文件不存在时返回(None, None)
+    """
+    snapshot = get_ledger_snapshot(wait_fresh)
+    if snapshot is None:
+        return None, None
+    date_index = get_snapshot_index(snapshot, 'entry_date', _build_entry_date_index)
+    account_index = None
+    if with_account_index:
+        account_index = get_snapshot_index(snapshot, 'entry_account', _build_entry_account_index)
+    return date_index, account_index
 
 
 def get_file_by_year_month(year, month):
@@ -172,29 +694,35 @@ def get_include_chain(filename):
     return chain
 
 
+def get_ledger_summary(wait_fresh=True):
+    """账本摘要数据（SSE的update事件内容）
+
+    Args:
+        wait_fresh: 是否等待最新快照，默认等待，确保摘要反映刚发生的修改
+    """
+    snapshot = get_ledger_snapshot(wait_fresh=wait_fresh)
+    options = snapshot['options']
+    return {
+        'title': options.get('title', 'My Ledger'),
+        'currency': options.get('operating_currency', 'CNY'),
+        'entries_count': len(snapshot['entries']),
+        'errors_count': len(snapshot['errors']),
+        'errors': snapshot['errors'],
+        'last_modified': snapshot['last_modified'],
+    }
+
+
 def notify_subscribers(event="update", data=None):
     """通知所有SSE订阅者"""
-    global sse_subscribers
-
     if data is None:
         # 发送账本摘要数据
-        entries, errors, options = load_ledger()
-        data = {
-            'title': options.get('title', 'My Ledger'),
-            'currency': options.get('operating_currency', 'CNY'),
-            'entries_count': len(entries),
-            'errors_count': len(errors),
-            'errors': errors,
-            'last_modified': ledger_cache['last_modified'],
-        }
-
-    # 发送事件给所有订阅者
-    for subscriber in sse_subscribers[:]:  # 使用副本避免修改问题
-        try:
-            subscriber({'event': event, 'data': data})
-        except Exception as e:
-            # 移除失效的订阅者
-            sse_subscribers.remove(subscriber)
+        data = get_ledger_summary()
+
+    # 发送事件给所有订阅者（不会被消费过慢的订阅者阻塞）
+    event_id = sse_broadcaster.publish({'event': event, 'data': data})
+    if event_bus is not None:
+        # 转发给其他工作进程的SSE订阅者，沿用同一个事件ID
+        event_bus.broadcast({'type': 'event', 'id': event_id, 'event': event, 'data': data})
 
 
 def run_query_with_cache(entries, options, query):
@@ -211,37 +739,44 @@ def run_query_with_cache(entries, options, query):
     # 查询计时
     start_time = time.time()
 
-    global query_cache
-
-    # 生成查询的哈希值作为缓存键
-    query_hash = hashlib.md5((query + str(options)).encode('utf-8')).hexdigest()
-
-    with query_cache_lock:
-        # 检查缓存中是否有有效结果
-        current_mtime = ledger_cache['last_modified']
-        if query_hash in query_cache:
-            cached_result, cache_mtime = query_cache[query_hash]
-            if cache_mtime == current_mtime:
+    # 缓存内容绑定账本版本号，查询语句本身即可作为缓存键（选项随快照一起变化）
+    # 传入的条目可能来自旧快照，只有当前快照的查询结果才读写缓存
+    snapshot = ledger_cache
+    current_version = snapshot['version'] if snapshot['entries'] is entries else None
+
+    if current_version is not None:
+        cached_result = query_cache.get(query, current_version)
+        if cached_result is not None:
+            return cached_result
+
+    # 缓存不存在或已过期，执行查询；同一快照上相同的查询同时只执行一次
+    def execute():
+        # 等待进入时前一次执行可能刚刚写入缓存
+        if current_version is not None:
+            cached_result = query_cache.get(query, current_version)
+            if cached_result is not None:
                 return cached_result
 
-    # 缓存不存在或已过期，执行查询
+        try:
+            # 相同结构的查询复用缓存的语法树，只重新编译和执行
+            result = run_query(entries, options, query)
+        except Exception as e:
+            print(f"Query execution failed: {str(e)}")
+            return None
 
-    try:
-        result = beanquery.query.run_query(entries, options, query)
-    except Exception as e:
-        print(f"Query execution failed: {str(e)}")
-        return None
+        # 将结果存入缓存
+        if current_version is not None:
+            query_cache.put(query, result, current_version)
 
-    # 将结果存入缓存
-    with query_cache_lock:
-        query_cache[query_hash] = (result, current_mtime)
+        # 查询计时结束
+        end_time = time.time()
+        query_time = end_time - start_time
+        print(f"Query executed in {query_time:.4f} seconds")
 
-    # 查询计时结束
-    end_time = time.time()
-    query_time = end_time - start_time
-    print(f"Query executed in {query_time:.4f} seconds")
+        return result
 
-    return result
+    # 条目列表的身份标识一个快照，执行期间快照被请求引用，id不会被复用
+    return query_flight.do((id(entries), query), execute)
 
 
 def initialize_default_ledger():
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+账本文件变更监听
+
+监听 include 图中的所有账本文件，只有在被监听的文件发生变化时才递增账本版本号，
+使 load_ledger() 的热路径只需比较一个整数，而不必每次遍历数据目录。
+Linux 下使用 inotify，其他平台（或 inotify 不可用时）退化为后台轮询。
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+# 配置
+WATCHER_MODE = os.getenv('LEDGER_WATCHER', 'auto')  # auto / inotify / poll
+WATCHER_POLL_INTERVAL = float(os.getenv('LEDGER_WATCHER_POLL_INTERVAL', 1.0))
+
+# inotify 常量（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# 监听目录而不是文件本身，这样编辑器"写临时文件再重命名"的保存方式也能被捕获
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# 合并连续 inotify 事件的等待时间（秒）
+COALESCE_DELAY = 0.02
+
+
+def file_state(file_path):
+    """文件的状态（修改时间、大小、inode），用于判断文件是否被修改过；文件不存在时返回None"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size, stat.st_ino
+
+
+def _existing_parent(directory):
+    """最近的已存在的上级目录"""
+    while not os.path.isdir(directory):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    return directory
+
+
+class _InotifyBackend:
+    """基于 inotify 的监听后端，按目录注册监听"""
+
+    def __init__(self, on_change):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._dir_to_wd = {}
+        self._wd_to_dir = {}
+        self._dir_files = {}
+        self._missing_dirs = set()  # 被监听文件所在的、尚不存在的目录
+
+    def sync(self, files):
+        """根据新的文件集合增删目录监听"""
+        dir_files = {}
+        for file_path in files:
+            dir_files.setdefault(os.path.dirname(file_path), set()).add(os.path.basename(file_path))
+
+        with self._lock:
+            self._dir_files = dir_files
+            self._sync_watches_locked()
+
+    def _sync_watches_locked(self):
+        """为文件所在的目录注册监听
+
+        目录尚不存在时（例如新年份的 date/<year>/ 目录）监听最近的已存在的上级目录，
+        目录被创建后再改为监听目录本身，见 _read_events()。
+
+        Returns:
+            set: 本次新增监听的目录
+        """
+        wanted = set()
+        missing = set()
+        for directory in self._dir_files:
+            if os.path.isdir(directory):
+                wanted.add(directory)
+            else:
+                missing.add(directory)
+                wanted.add(_existing_parent(directory))
+        self._missing_dirs = missing
+
+        for directory in list(self._dir_to_wd):
+            if directory not in wanted:
+                wd = self._dir_to_wd.pop(directory)
+                self._wd_to_dir.pop(wd, None)
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+        added = set()
+        for directory in wanted:
+            if directory in self._dir_to_wd:
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                print(f"Failed to watch directory {directory}: errno {ctypes.get_errno()}")
+                continue
+            self._dir_to_wd[directory] = wd
+            self._wd_to_dir[wd] = directory
+            added.add(directory)
+        return added
+
+    def _read_events(self):
+        """读取并解析当前可读的 inotify 事件
+
+        Returns:
+            tuple: (是否有被监听的文件发生变化, 变化的文件集合；无法确定具体文件时为None)
+        """
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return False, set()
+
+        paths = set()
+        unknown = False
+        resync = False
+        offset = 0
+        with self._lock:
+            while offset + EVENT_HEADER.size <= len(buffer):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+                name = buffer[offset + EVENT_HEADER.size : offset + EVENT_HEADER.size + length]
+                name = os.fsdecode(name.rstrip(b'\0'))
+                offset += EVENT_HEADER.size + length
+
+                if mask & IN_Q_OVERFLOW:
+                    # 事件队列溢出，无法确定哪些文件变化，直接视为已变化
+                    unknown = True
+                    resync = True
+                    continue
+
+                directory = self._wd_to_dir.get(wd)
+                if mask & IN_IGNORED:
+                    # 目录已被删除（sync()主动移除的监听不会再出现在映射中），改为监听其上级目录
+                    if directory is not None:
+                        self._wd_to_dir.pop(wd, None)
+                        self._dir_to_wd.pop(directory, None)
+                        resync = True
+                    continue
+                if directory is None:
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    # 尚不存在的目录（或其上级目录）被创建，需要监听新目录
+                    created = os.path.join(directory, name)
+                    if any(missing == created or missing.startswith(created + os.sep) for missing in self._missing_dirs):
+                        resync = True
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    unknown = True
+                elif name in self._dir_files.get(directory, ()):
+                    paths.add(os.path.join(directory, name))
+
+            if resync:
+                # 监听新目录之前文件可能已经被创建
+                for directory in self._sync_watches_locked():
+                    for name in self._dir_files.get(directory, ()):
+                        if os.path.exists(os.path.join(directory, name)):
+                            paths.add(os.path.join(directory, name))
+        return unknown or bool(paths), None if unknown else paths
+
+    def run(self, stop_event):
+        """读取 inotify 事件，直到 stop_event 被设置"""
+        while not stop_event.is_set():
+            readable, _, _ = select.select([self._fd], [], [], 0.5)
+            if not readable:
+                continue
+            changed, paths = self._read_events()
+            if not changed:
+                continue
+            # 一次保存通常会产生多个事件，合并短时间内连续到达的事件只递增一次版本号
+            while select.select([self._fd], [], [], COALESCE_DELAY)[0]:
+                more_changed, more_paths = self._read_events()
+                if more_changed:
+                    paths = None if paths is None or more_paths is None else paths | more_paths
+            self._on_change(paths)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PollingBackend:
+    """轮询后端：只定期 stat include 图中的文件，不遍历整个目录"""
+
+    def __init__(self, on_change, interval):
+        self._on_change = on_change
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def sync(self, files):
+        """更新需要轮询的文件集合，已有文件保留原来的状态"""
+        with self._lock:
+            self._stats = {
+                file_path: self._stats[file_path] if file_path in self._stats else file_state(file_path)
+                for file_path in files
+            }
+
+    def run(self, stop_event):
+        while not stop_event.wait(self._interval):
+            paths = set()
+            with self._lock:
+                for file_path, old_stat in self._stats.items():
+                    new_stat = file_state(file_path)
+                    if new_stat != old_stat:
+                        self._stats[file_path] = new_stat
+                        paths.add(file_path)
+            if paths:
+                self._on_change(paths)
+
+    def close(self):
+        pass
+
+
+class LedgerWatcher:
+    """账本变更监听器
+
+    维护一个单调递增的账本版本号。调用方在加载账本时记录版本号，
+    之后只需比较版本号即可判断缓存是否失效。
+    """
+
+    def __init__(self, mode=WATCHER_MODE, poll_interval=WATCHER_POLL_INTERVAL, on_change=None):
+        self.mode = mode
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self._version = 0
+        self._version_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._backend = None
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._files = frozenset()
+        self._acknowledged = {}  # 应用自身写入后记录的文件状态，见 acknowledge()
+        self.ignored = 0  # 因文件状态与记录一致而忽略的变更事件数
+
+    @property
+    def version(self):
+        """当前账本版本号"""
+        return self._version
+
+    @property
+    def backend_name(self):
+        """当前使用的监听后端名称"""
+        if isinstance(self._backend, _InotifyBackend):
+            return 'inotify'
+        if isinstance(self._backend, _PollingBackend):
+            return 'poll'
+        return None
+
+    def bump(self):
+        """递增账本版本号，使所有基于旧版本的缓存失效"""
+        with self._version_lock:
+            self._version += 1
+            version = self._version
+        if self.on_change is not None:
+            self.on_change()
+        return version
+
+    def acknowledge(self):
+        """记录被监听文件的当前状态（应用自身修改账本文件之后、递增版本号之前调用）
+
+        随后到达的变更事件如果文件状态与记录一致，说明该文件在记录之后没有再被修改，
+        这次修改已经包含在紧接着的版本号递增中，不再重复递增，避免一次写入触发两次重新加载。
+        """
+        states = {file_path: file_state(file_path) for file_path in self._files}
+        with self._version_lock:
+            self._acknowledged = states
+
+    def _on_files_changed(self, paths):
+        """监听后端发现文件变化时调用，paths为None表示无法确定具体文件"""
+        if paths is not None:
+            with self._version_lock:
+                acknowledged = self._acknowledged
+            if all(path in acknowledged and file_state(path) == acknowledged[path] for path in paths):
+                self.ignored += 1
+                return
+        self.bump()
+
+    def _create_backend(self):
+        if self.mode in ('auto', 'inotify'):
+            try:
+                return _InotifyBackend(self._on_files_changed)
+            except (OSError, AttributeError) as e:
+                if self.mode == 'inotify':
+                    raise
+                print(f"inotify unavailable ({e}), falling back to polling")
+        return _PollingBackend(self._on_files_changed, self.poll_interval)
+
+    def start(self):
+        """启动后台监听线程（重复调用无副作用）"""
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._backend is None:
+                self._backend = self._create_backend()
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._backend.run, args=(self._stop_event,), name='ledger-watcher', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """停止后台监听线程"""
+        with self._start_lock:
+            self._stop_event.set()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            if self._backend is not None:
+                self._backend.close()
+                self._backend = None
+            self._files = frozenset()
+
+    def watch(self, files):
+        """设置需要监听的文件集合（通常是 include 图中的全部文件），必要时启动监听"""
+        files = frozenset(os.path.abspath(file_path) for file_path in files)
+        self.start()
+        if files != self._files:
+            self._backend.sync(files)
+            self._files = files
+
+    @property
+    def files(self):
+        """当前被监听的文件集合"""
+        return self._files
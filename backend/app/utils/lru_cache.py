@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+有界LRU缓存
+
+按条目数和近似内存占用限制缓存大小，超出时淘汰最久未使用的条目。
+缓存内容绑定账本版本号：账本版本变化后整体清空，不再保留旧版本的结果。
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+
+def approximate_size(value, depth=3):
+    """估算对象占用的内存字节数（递归到有限深度，足以反映查询结果的规模）"""
+    size = sys.getsizeof(value)
+    if depth <= 0 or isinstance(value, (str, bytes, int, float)):
+        return size
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += approximate_size(key, depth - 1) + approximate_size(item, depth - 1)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for item in value:
+            size += approximate_size(item, depth - 1)
+    return size
+
+
+class LRUCache:
+    """线程安全的有界LRU缓存，带命中/未命中/淘汰计数"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, sizeof=approximate_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._lock = threading.Lock()
+        self._items = OrderedDict()  # 键 -> (值, 近似字节数)
+        self._bytes = 0
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.purges = 0
+
+    def _purge_locked(self, version):
+        """账本版本变化时清空全部缓存"""
+        if self._items:
+            self.purges += 1
+        self._items.clear()
+        self._bytes = 0
+        self._version = version
+
+    def get(self, key, version):
+        """读取缓存，返回None表示未命中
+
+        Args:
+            key: 缓存键
+            version: 调用方使用的账本版本号
+        """
+        with self._lock:
+            if version != self._version:
+                if self._version is None or version > self._version:
+                    self._purge_locked(version)
+                self.misses += 1
+                return None
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, version):
+        """写入缓存；旧版本的结果直接丢弃，超出限制时淘汰最久未使用的条目"""
+        size = self._sizeof(value)
+        with self._lock:
+            if self._version is None or version > self._version:
+                self._purge_locked(version)
+            elif version < self._version:
+                return
+            if size > self.max_bytes:
+                return
+
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._purge_locked(self._version)
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'purges': self.purges,
+            }
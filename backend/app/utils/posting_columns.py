@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+列式记账行存储
+
+每个账本快照上把全部交易的记账行展开为平行的 NumPy 数组（日期序数、账户ID、币种ID、金额、条目下标），
+求和、分组和日期范围筛选都是向量化运算，不再逐条遍历 Python 对象、逐个把 Decimal 转换为 float。
+
+金额同时保存为 float64（近似值）和按币种定标的 int64 整数（精确值）：
+每个币种以其全部金额中最多的小数位数定标，整数求和后再换算回 Decimal，与逐条累加 Decimal 的结果完全一致。
+无法无损定标的币种（小数位数过多或求和可能溢出）标记为不精确，调用方对这些记账行回退为逐条累加。
+"""
+import math
+from decimal import Decimal
+
+import numpy as np
+from beancount.core import data
+
+# 定标后整数绝对值的上限：float64 换算为整数时无误差，且全部记账行求和不会溢出 int64
+MAX_SCALED = 2**50
+MAX_SCALED_TOTAL = 2**62
+
+
+class PostingColumns:
+    """按条目顺序（即日期顺序）排列的记账行列"""
+
+    def __init__(self, entries):
+        dates = []
+        accounts = []
+        currencies = []
+        numbers = []
+        exponents = []
+        entry_indexes = []
+        slots = []
+        has_cost = []
+        self.account_ids = {}  # 账户名 -> 账户ID
+        self.currency_ids = {}  # 币种 -> 币种ID
+
+        for index, entry in enumerate(entries):
+            if not isinstance(entry, data.Transaction):
+                continue
+            ordinal = entry.date.toordinal()
+            for slot, posting in enumerate(entry.postings):
+                units = posting.units
+                if units is None or not isinstance(units.number, Decimal):
+                    continue
+                account_id = self.account_ids.get(posting.account)
+                if account_id is None:
+                    account_id = self.account_ids[posting.account] = len(self.account_ids)
+                currency_id = self.currency_ids.get(units.currency)
+                if currency_id is None:
+                    currency_id = self.currency_ids[units.currency] = len(self.currency_ids)
+                dates.append(ordinal)
+                accounts.append(account_id)
+                currencies.append(currency_id)
+                numbers.append(units.number)
+                exponents.append(units.number.as_tuple().exponent)
+                entry_indexes.append(index)
+                slots.append(slot)
+                has_cost.append(posting.cost is not None)
+
+        self.account_names = list(self.account_ids)
+        self.currency_names = list(self.currency_ids)
+        self.numbers = numbers  # 精确金额（Decimal）
+        self.date = np.array(dates, dtype=np.int32)  # date.toordinal()
+        self.account = np.array(accounts, dtype=np.int32)
+        self.currency = np.array(currencies, dtype=np.int32)
+        self.amount = np.array(numbers, dtype=np.float64)
+        self.exponent = np.minimum(np.array(exponents, dtype=np.int32), 0)  # Decimal的指数（小数位数取负）
+        self.entry = np.array(entry_indexes, dtype=np.int32)  # 所在条目在快照条目列表中的下标
+        self.slot = np.array(slots, dtype=np.int32)  # 在条目记账行中的下标
+        self.has_cost = np.array(has_cost, dtype=bool)
+
+        self.sorted = bool(len(self.date) == 0 or np.all(self.date[1:] >= self.date[:-1]))
+        self._scale()
+
+    def __len__(self):
+        return len(self.date)
+
+    def _scale(self):
+        """按币种把金额定标为 int64 整数"""
+        count = len(self.currency_names)
+        self.scales = np.zeros(count, dtype=np.int32)  # 币种 -> 小数位数
+        self.exact = np.zeros(count, dtype=bool)  # 币种 -> 是否可以精确求和
+        self.scaled = np.zeros(len(self.date), dtype=np.int64)
+        for currency_id in range(count):
+            rows = self.currency == currency_id
+            scale = int(-self.exponent[rows].min())
+            values = np.rint(self.amount[rows] * 10.0**scale)
+            largest = float(np.abs(values).max())
+            if largest >= MAX_SCALED or largest * int(rows.sum()) >= MAX_SCALED_TOTAL:
+                continue
+            self.scales[currency_id] = scale
+            self.exact[currency_id] = True
+            self.scaled[rows] = values.astype(np.int64)
+
+    def bounds(self, start_date=None, end_date=None):
+        """[start_date, end_date] 对应的行区间 [lo, hi)（要求按日期排序，见 sorted）"""
+        lo = 0 if start_date is None else int(np.searchsorted(self.date, start_date.toordinal(), 'left'))
+        hi = len(self.date) if end_date is None else int(np.searchsorted(self.date, end_date.toordinal(), 'right'))
+        return lo, max(lo, hi)
+
+    def account_filter(self, match):
+        """账户ID -> 是否匹配的布尔数组，可直接用 account_filter(match)[self.account] 得到行掩码"""
+        return np.array([bool(match(name)) for name in self.account_names], dtype=bool)
+
+    def exact_rows(self):
+        """可以按定标整数精确求和的行（无成本且币种可精确定标）"""
+        return ~self.has_cost & self.exact[self.currency]
+
+    def _sort_groups(self, keys, rows):
+        """按 keys 和币种对行排序分组
+
+        Returns:
+            tuple: (排序后的行下标, 各组在排序结果中的起始位置, 各组的键数组列表)
+        """
+        columns = [np.asarray(key, dtype=np.int64)[rows] for key in keys]
+        columns.append(self.currency[rows].astype(np.int64))
+
+        # 各列组合为一个整数键；stable排序保证同组内的行保持原有顺序
+        sizes = [int(column.max()) + 1 for column in columns]
+        if math.prod(sizes) <= np.iinfo(np.int64).max:
+            combined = np.zeros(len(rows), dtype=np.int64)
+            for column, size in zip(columns, sizes):
+                combined = combined * size + column
+            order = np.argsort(combined, kind='stable')
+            sorted_keys = combined[order]
+            changed = sorted_keys[1:] != sorted_keys[:-1]
+        else:
+            # 各列取值范围的乘积超出 int64，组合键会溢出，改为按各列逐级排序（lexsort 同样是稳定排序，最后一个键为主键）
+            order = np.lexsort(columns[::-1])
+            changed = np.zeros(len(rows) - 1, dtype=bool)
+            for column in columns:
+                sorted_column = column[order]
+                changed |= sorted_column[1:] != sorted_column[:-1]
+        starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+        return rows[order], starts, [column[order][starts] for column in columns[:-1]]
+
+    def group_sums(self, keys, rows=None):
+        """按 keys 和币种分组，求各组金额的精确和
+
+        Args:
+            keys: 分组键，每个键是与全部行一一对应的非负整数数组
+            rows: 参与分组的行下标数组，None表示全部行；这些行必须可精确求和，见 exact_rows()
+
+        Returns:
+            tuple: (各组的键数组列表, 币种ID数组, Decimal金额列表, 各组首行下标数组)，
+                分组按键和币种升序排列；首行下标可用于还原币种在组内首次出现的顺序
+        """
+        if rows is None:
+            rows = np.arange(len(self.date))
+        if len(rows) == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in keys], np.zeros(0, dtype=np.int32), [], rows
+        ordered_rows, starts, group_keys = self._sort_groups(keys, rows)
+
+        totals = np.add.reduceat(self.scaled[ordered_rows], starts)
+        exponents = np.minimum.reduceat(self.exponent[ordered_rows], starts)
+        first_rows = ordered_rows[starts]
+        group_currencies = self.currency[first_rows]
+
+        # 换算回 Decimal，指数取组内金额的最小指数，与逐条累加 Decimal 的结果一致
+        numbers = [
+            Decimal(int(total)).scaleb(-int(self.scales[currency_id])).quantize(Decimal(1).scaleb(int(exponent)))
+            for total, currency_id, exponent in zip(totals, group_currencies, exponents)
+        ]
+        return group_keys, group_currencies, numbers, first_rows
+
+    def float_sums(self, keys, rows=None):
+        """按 keys 和币种分组求 float64 近似和（图表等不需要精确值的场景）
+
+        Returns:
+            tuple: (各组的键数组列表, 币种ID数组, float64 金额数组)
+        """
+        if rows is None:
+            rows = np.arange(len(self.date))
+        if len(rows) == 0:
+            return [np.zeros(0, dtype=np.int64) for _ in keys], np.zeros(0, dtype=np.int32), np.zeros(0)
+        ordered_rows, starts, group_keys = self._sort_groups(keys, rows)
+        return group_keys, self.currency[ordered_rows[starts]], np.add.reduceat(self.amount[ordered_rows], starts)
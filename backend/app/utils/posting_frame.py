@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+记账行时间序列
+
+在列式记账行（见 posting_columns）之上构建 pandas DataFrame，每个账本快照只构建一次。
+趋势图需要的按日/周/月、按账户或父账户的金额序列由一次分组求和得到，
+不必按月逐次请求统计接口、逐次执行查询。
+"""
+import numpy as np
+import pandas as pd
+
+from app.utils.stats_engine import EPOCH_ORDINAL, account_root
+
+# 时间粒度 -> pandas 周期频率（周以周一为起始）
+INTERVALS = {
+    'daily': 'D',
+    'weekly': 'W-SUN',
+    'monthly': 'M',
+}
+
+
+def build_posting_frame(columns):
+    """由 PostingColumns 构建记账行 DataFrame
+
+    Returns:
+        DataFrame: date（datetime64）、account、currency（分类）、amount（float64）、scaled（按币种定标的int64）
+    """
+    return pd.DataFrame(
+        {
+            'date': (columns.date.astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]'),
+            'account': pd.Categorical.from_codes(columns.account, categories=columns.account_names),
+            'currency': pd.Categorical.from_codes(columns.currency, categories=columns.currency_names),
+            'amount': columns.amount,
+            'scaled': columns.scaled,
+        }
+    )
+
+
+def posting_timeseries(
+    frame, columns, prefixes, currency, interval='monthly', start_date=None, end_date=None, depth=None, max_periods=None
+):
+    """按周期汇总指定账户（含子账户）的金额
+
+    Args:
+        frame: build_posting_frame() 构建的 DataFrame
+        columns: 同一快照的 PostingColumns
+        prefixes: 账户或父账户列表，每项汇总为一条序列（包含其全部子账户）
+        currency: 只统计该币种的记账行
+        interval: daily / weekly / monthly
+        start_date: 开始日期（含），None表示从匹配的第一笔记账行开始
+        end_date: 结束日期（含），None表示到匹配的最后一笔记账行为止
+        depth: 指定时把每个前缀下的账户按前depth级账户拆分为多条序列（分类明细）
+        max_periods: 周期数上限，None表示不限
+
+    Returns:
+        tuple: (各周期起始日期列表, [(前缀, 序列名, 各周期金额列表, 合计), ...])；
+            序列按前缀顺序、再按序列名排列，不指定depth时序列名即前缀
+
+    Raises:
+        ValueError: 周期数超过上限
+    """
+    freq = INTERVALS[interval]
+    currency_id = columns.currency_ids.get(currency, -1)
+    codes = frame['account'].cat.codes.to_numpy()
+    row_mask = frame['currency'].cat.codes.to_numpy() == currency_id
+    if start_date is not None:
+        row_mask &= (frame['date'] >= pd.Timestamp(start_date)).to_numpy()
+    if end_date is not None:
+        row_mask &= (frame['date'] <= pd.Timestamp(end_date)).to_numpy()
+
+    # 可精确定标的币种按整数求和，换算后的金额没有浮点累加误差
+    exact = currency_id >= 0 and bool(columns.exact[currency_id])
+    value_column = 'scaled' if exact else 'amount'
+
+    parts = []
+    for position, prefix in enumerate(prefixes):
+        matched = np.array(
+            [account == prefix or account.startswith(prefix + ':') for account in columns.account_names], dtype=bool
+        )
+        selected = frame.loc[row_mask & matched[codes]]
+        if depth is None:
+            labels = prefix
+        else:
+            labels = selected['account'].astype(object).map(lambda account: account_root(account, depth))
+        parts.append(
+            pd.DataFrame(
+                {
+                    'position': position,
+                    'series': labels,
+                    'period': selected['date'].dt.to_period(freq),
+                    'value': selected[value_column],
+                }
+            )
+        )
+    rows = pd.concat(parts, ignore_index=True)
+
+    # 未指定起止日期时取匹配记账行的范围
+    if rows.empty and (start_date is None or end_date is None):
+        periods = pd.PeriodIndex([], freq=freq)
+    else:
+        first = pd.Period(start_date, freq=freq) if start_date is not None else rows['period'].min()
+        last = pd.Period(end_date, freq=freq) if end_date is not None else rows['period'].max()
+        periods = pd.period_range(first, last, freq=freq)
+    if max_periods is not None and len(periods) > max_periods:
+        raise ValueError(f"周期数 {len(periods)} 超过上限 {max_periods}")
+
+    # 展开为 (前缀, 序列) × 周期 的表，没有记账行的周期为0
+    table = rows.groupby(['position', 'series', 'period'])['value'].sum().unstack('period', fill_value=0)
+    if depth is None:
+        table = table.reindex(list(enumerate(prefixes)), fill_value=0)
+    table = table.reindex(columns=periods, fill_value=0)
+    totals = table.sum(axis=1)
+    if exact:
+        scale = 10.0 ** int(columns.scales[currency_id])
+        table = table / scale
+        totals = totals / scale
+
+    series = [
+        (prefixes[position], name, [float(value) for value in values], float(total))
+        for (position, name), values, total in zip(table.index, table.to_numpy(), totals)
+    ]
+    return [str(period.start_time.date()) for period in periods], series
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+beanquery 查询计划缓存
+
+beanquery 执行查询时先把查询文本解析为语法树，再针对当前账本编译、执行。
+其中解析（PEG解析器）是最耗时的一步，常常比在中等规模的账本上执行查询还慢，而语法树与账本内容无关。
+
+查询文本先规范化：字符串之外的连续空白合并为一个空格，日期字面量替换为命名参数（%(d0)s ...），
+只有日期不同的查询（例如统计接口按日期范围生成的查询）共用同一个缓存的语法树，跨账本版本复用；
+每次执行时只需用本次的日期编译语法树（开销很小）。
+"""
+import datetime
+import os
+import re
+
+import beanquery
+
+from app.utils.lru_cache import LRUCache
+
+# 配置
+QUERY_PLAN_CACHE_SIZE = int(os.getenv('QUERY_PLAN_CACHE_SIZE', 256))  # 最多缓存的查询语法树数
+
+# 字符串字面量（双引号或单引号，单引号字符串中用两个单引号表示单引号）
+STRING_PATTERN = re.compile(r'"[^"]*"|\'(?:[^\']|\'\')*\'')
+DATE_PATTERN = re.compile(r'(?<![\w.])(\d{4}-\d{2}-\d{2})(?![\w.])')
+# OPEN ON / CLOSE ON 之后的日期在语法上必须是字面量
+DATE_KEYWORD_PATTERN = re.compile(r'\bON\s*$', re.IGNORECASE)
+# 注释和用户自己的参数占位符出现时不做规范化，保持原样解析
+UNSAFE_PATTERN = re.compile(r'/\*|;|%')
+
+# 语法树与账本版本无关，缓存使用固定的版本号
+PLAN_VERSION = 0
+
+
+def normalize_query(query):
+    """规范化查询文本，日期字面量按出现顺序替换为命名参数 d0、d1 ...
+
+    编译器会改写位置参数（%s）节点的名称，缓存的语法树被多次编译时只能使用命名参数。
+
+    Returns:
+        tuple: (规范化的查询文本, {参数名: 日期})；无法安全规范化时返回 (原查询文本, None)
+    """
+    segments = []
+    params = {}
+    position = 0
+    for match in [*STRING_PATTERN.finditer(query), None]:
+        end = match.start() if match is not None else len(query)
+        text = query[position:end]
+        if "'" in text or '"' in text or UNSAFE_PATTERN.search(text):
+            # 引号不成对、包含注释或占位符
+            return query, None
+
+        def parameterize(date_match):
+            try:
+                value = datetime.date.fromisoformat(date_match.group(1))
+            except ValueError:
+                # 无效的日期保留原样，由解析器报告错误
+                return date_match.group(0)
+            if DATE_KEYWORD_PATTERN.search(date_match.string[: date_match.start()]):
+                return date_match.group(0)
+            name = f'd{len(params)}'
+            params[name] = value
+            return f'%({name})s'
+
+        segments.append(DATE_PATTERN.sub(parameterize, re.sub(r'\s+', ' ', text)))
+        if match is not None:
+            segments.append(match.group(0))
+            position = match.end()
+    return ''.join(segments).strip(), params
+
+
+class QueryPlanCache:
+    """规范化查询文本 -> 解析后的语法树（线程安全）"""
+
+    def __init__(self, max_entries=QUERY_PLAN_CACHE_SIZE):
+        # 语法树很小，只按条目数限制
+        self._cache = LRUCache(max_entries=max_entries, sizeof=lambda plan: 0)
+
+    def get(self, query):
+        """获取查询的语法树和参数
+
+        Returns:
+            tuple: (语法树, 参数字典或None)
+
+        Raises:
+            beanquery.ParseError: 查询语法错误
+        """
+        text, params = normalize_query(query)
+        statement = self._cache.get(text, PLAN_VERSION)
+        if statement is None:
+            try:
+                statement = beanquery.parser.parse(text)
+            except beanquery.ParseError:
+                if params is None:
+                    raise
+                # 语法上不允许使用参数的位置出现了日期，按原查询文本解析
+                text, params = query, None
+                statement = self._cache.get(text, PLAN_VERSION)
+                if statement is None:
+                    statement = beanquery.parser.parse(text)
+            self._cache.put(text, statement, PLAN_VERSION)
+        return statement, params
+
+    def stats(self):
+        stats = self._cache.stats()
+        return {key: stats[key] for key in ('entries', 'max_entries', 'hits', 'misses', 'evictions')}
+
+
+plan_cache = QueryPlanCache()
+
+
+def run_query(entries, options, query):
+    """执行查询（使用缓存的语法树），返回值与 beanquery.query.run_query 相同
+
+    Returns:
+        tuple: (结果列描述, 结果行列表)
+    """
+    statement, params = plan_cache.get(query)
+    context = beanquery.connect('beancount:', entries=entries, errors=[], options=options)
+    cursor = context.execute(statement, params)
+    return cursor.description, cursor.fetchall()
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+自定义查询进程池
+
+POST /api/ledger/query 的 beanquery 查询在独立的工作进程中执行，耗时的查询不会占用请求线程的GIL，
+其他请求不受影响。
+
+服务进程处理请求时是多线程的，在其中fork出的子进程可能继承被其他线程持有的锁（日志、内存分配器、
+导入锁等）而永久阻塞。因此服务进程在启动任何后台线程之前（gunicorn 的 post_fork、run.py 启动服务器之前）
+调用 start() fork 一个单线程的派生进程，之后的查询进程都由派生进程fork：
+派生进程以写时复制的方式持有启动时的账本快照；账本更新后，派生进程在下一次创建查询进程时
+从磁盘重新加载账本（增量解析，只重新解析有变化的文件），空闲的旧查询进程被回收。
+派生进程与服务进程之间通过 Unix 套接字通信，新查询进程的管道以文件描述符的方式传回服务进程。
+
+每个查询有总的时间上限（包括等待空闲进程的时间），超时或客户端断开连接时直接结束执行查询的进程，
+查询结果最多返回 QUERY_MAX_ROWS 行。
+"""
+import datetime
+import gc
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import select
+import signal
+import socket
+import threading
+import time
+
+from beancount.core.amount import Amount
+from beancount.core.inventory import Inventory
+from beancount.core.position import Cost, Position
+
+from app.utils.query_plans import run_query
+
+# 配置
+QUERY_WORKERS = int(os.getenv('QUERY_WORKERS', 2))  # 执行自定义查询的进程数，0表示在请求线程中执行
+QUERY_TIMEOUT = float(os.getenv('QUERY_TIMEOUT', 30))  # 单个查询最多执行的秒数（包括排队等待）
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', 10000))  # 单个查询最多返回的行数
+
+# 检查结果、超时和客户端连接的间隔秒数
+POLL_INTERVAL = 0.1
+
+# ASGI模式下由 app.asgi 写入WSGI环境的断开检测函数
+DISCONNECTED_ENVIRON_KEY = 'moneymint.disconnected'
+
+
+class QueryTimeout(Exception):
+    """查询超过时间上限"""
+
+
+class QueryCancelled(Exception):
+    """客户端已断开连接，查询被取消"""
+
+
+def _plain_value(value):
+    """把结果中的值转换为可直接编码为JSON的类型（金额类对象使用 beancount 的文本格式）"""
+    if isinstance(value, (Inventory, Position, Amount, Cost)):
+        return str(value)
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return value
+
+
+def execute_query(entries, options, query, max_rows):
+    """执行查询，返回 (列名列表, 结果行列表, 是否被截断)
+
+    Raises:
+        Exception: 查询语法错误或执行失败
+    """
+    columns, rows = run_query(entries, options, query)
+    headers = [column.name for column in columns]
+    results = [[_plain_value(value) for value in row] for row in rows[:max_rows]]
+    return headers, results, len(rows) > max_rows
+
+
+def _reset_signals():
+    """重置fork出的进程继承的信号处理
+
+    SIGINT 被有意忽略：终端中的 Ctrl-C 会发给整个进程组，由父进程统一处理中断，再结束子进程；
+    其余信号恢复默认处理，父进程可以直接结束子进程。
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for signum in (signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+
+
+def _worker_main(conn, entries, options, max_rows, parent_pid):
+    """工作进程：依次执行收到的查询，结果经管道返回"""
+    _reset_signals()
+    # 继承的账本对象不再变化，移出GC跟踪，避免垃圾回收触发写时复制
+    gc.freeze()
+
+    while True:
+        try:
+            # 父进程（派生进程）退出后不再有新的查询，定期检查父进程是否还在
+            while not conn.poll(1.0):
+                if os.getppid() != parent_pid:
+                    return
+            query = conn.recv()
+        except (EOFError, OSError):
+            return
+        try:
+            result = ('ok', *execute_query(entries, options, query, max_rows))
+        except Exception as e:
+            result = ('error', str(e))
+        try:
+            conn.send(result)
+        except (EOFError, OSError):
+            return
+        except Exception as e:
+            # 结果中有无法序列化的值
+            conn.send(('error', f"查询结果无法返回: {e}"))
+
+
+def _spawner_main(sock, entries, options, key, loader, max_rows, parent_pid):
+    """派生进程：按服务进程的请求fork查询进程
+
+    请求为 (序号, 快照键)，快照键与当前持有的账本不同时先调用 loader() 重新加载账本；
+    回复 (序号, 查询进程pid, 错误信息)，并附带与查询进程相连的管道的文件描述符。
+    """
+    _reset_signals()
+    # 查询进程由服务进程直接结束，退出后由系统自动回收
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    gc.freeze()
+
+    while True:
+        try:
+            readable, _, _ = select.select([sock], [], [], 1.0)
+            if not readable:
+                # 服务进程被强制结束时套接字不一定会关闭，定期检查父进程是否还在
+                if os.getppid() != parent_pid:
+                    return
+                continue
+            request = sock.recv(4096)
+        except OSError:
+            return
+        if not request:
+            return  # 服务进程已关闭套接字
+        sequence, requested_key = pickle.loads(request)
+
+        if requested_key != key:
+            try:
+                entries, options = loader()
+            except Exception as e:
+                _spawner_reply(sock, (sequence, None, f"账本加载失败: {e}"))
+                continue
+            key = requested_key
+            gc.freeze()
+
+        parent_conn, child_conn = multiprocessing.Pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                sock.close()
+                parent_conn.close()
+                _worker_main(child_conn, entries, options, max_rows, os.getppid())
+            finally:
+                os._exit(0)
+        child_conn.close()
+        # 文件描述符随消息复制给服务进程，派生进程中的这一端随即关闭，查询进程不会继承其他查询进程的管道
+        sent = _spawner_reply(sock, (sequence, pid, None), parent_conn.fileno())
+        parent_conn.close()
+        if not sent:
+            return
+
+
+def _spawner_reply(sock, reply, fd=None):
+    try:
+        payload = pickle.dumps(reply)
+        if fd is None:
+            sock.send(payload)
+        else:
+            socket.send_fds(sock, [payload], [fd])
+        return True
+    except OSError:
+        return False
+
+
+class _Spawner:
+    """服务进程中派生进程的句柄"""
+
+    def __init__(self, snapshot, loader, max_rows):
+        self._sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        entries, options, key = (None, None, None) if snapshot is None else (
+            snapshot['entries'], snapshot['options'], _snapshot_key(snapshot)
+        )
+        parent_pid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self._sock.close()
+                _spawner_main(child_sock, entries, options, key, loader, max_rows, parent_pid)
+            finally:
+                os._exit(0)
+        child_sock.close()
+        self.pid = pid
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+    def spawn(self, key, deadline, cancelled):
+        """请求派生进程fork一个持有 key 对应账本的查询进程
+
+        Returns:
+            _Worker: 新的查询进程
+
+        Raises:
+            QueryTimeout: 超过截止时间（例如等待派生进程重新加载账本）
+            QueryCancelled: cancelled() 返回True
+            ValueError: 派生进程已退出或账本加载失败
+        """
+        if not self._lock.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise QueryTimeout()
+        try:
+            self._sequence += 1
+            sequence = self._sequence
+            try:
+                self._sock.send(pickle.dumps((sequence, key)))
+            except OSError:
+                raise ValueError("查询派生进程已退出")
+            while True:
+                readable, _, _ = select.select([self._sock], [], [], POLL_INTERVAL)
+                if not readable:
+                    if time.monotonic() >= deadline:
+                        raise QueryTimeout()
+                    if cancelled is not None and cancelled():
+                        raise QueryCancelled()
+                    continue
+                try:
+                    message, fds, _, _ = socket.recv_fds(self._sock, 4096, 1)
+                except OSError:
+                    message, fds = b'', []
+                if not message:
+                    raise ValueError("查询派生进程已退出")
+                reply_sequence, pid, error = pickle.loads(message)
+                if reply_sequence != sequence:
+                    # 之前超时或取消的请求迟到的回复：关闭管道，查询进程随之退出
+                    for fd in fds:
+                        os.close(fd)
+                    continue
+                if error is not None:
+                    raise ValueError(error)
+                return _Worker(key, pid, multiprocessing.connection.Connection(fds[0]))
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """关闭套接字，派生进程随之退出，它的空闲查询进程在检测到父进程退出后退出"""
+        self._sock.close()
+
+
+class _Worker:
+    """持有某个账本快照的查询进程"""
+
+    def __init__(self, key, pid, conn):
+        self.key = key
+        self.pid = pid
+        self.conn = conn
+        self.alive = True
+
+    def execute(self, query, deadline, cancelled):
+        """发送查询并等待结果
+
+        Raises:
+            QueryTimeout: 超过截止时间
+            QueryCancelled: cancelled() 返回True
+            ValueError: 查询执行失败
+        """
+        self.conn.send(query)
+        while not self.conn.poll(POLL_INTERVAL):
+            if time.monotonic() >= deadline:
+                raise QueryTimeout()
+            if cancelled is not None and cancelled():
+                raise QueryCancelled()
+        try:
+            status, *result = self.conn.recv()
+        except EOFError:
+            self.alive = False
+            raise ValueError("查询进程异常退出")
+        if status == 'error':
+            raise ValueError(result[0])
+        return tuple(result)
+
+    def close(self):
+        """结束进程（执行中的查询被直接中断）；进程由派生进程回收"""
+        if self.alive:
+            self.alive = False
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.conn.close()
+
+
+def _snapshot_key(snapshot):
+    # 派生进程按版本号判断持有的账本是否需要重新加载
+    return snapshot['version']
+
+
+class QueryPool:
+    """执行自定义查询的进程池（线程安全）"""
+
+    def __init__(self, size=QUERY_WORKERS, timeout=QUERY_TIMEOUT, max_rows=QUERY_MAX_ROWS):
+        self.size = size
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self._spawner = None  # 由 start() 创建
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(size, 1))
+        self._idle = []  # 空闲的 _Worker
+        self.started = 0  # 启动的进程数
+        self.executed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self._inline_warned = False
+
+    def start(self, snapshot, loader):
+        """fork派生进程（必须在当前进程启动任何其他线程之前调用）
+
+        Args:
+            snapshot: 派生进程初始持有的账本快照，None表示在第一次查询时加载
+            loader: 在派生进程中重新加载账本的函数，返回 (entries, options)
+        """
+        if self.size <= 0:
+            return
+        if self._spawner is not None:
+            self.close()
+        self._spawner = _Spawner(snapshot, loader, self.max_rows)
+        print(f"Query pool spawner started (pid {self._spawner.pid})")
+
+    def run(self, snapshot, query, cancelled=None):
+        """在工作进程中执行查询
+
+        Args:
+            snapshot: 账本快照
+            query: beanquery查询语句
+            cancelled: 返回True时取消查询的函数（例如检测客户端是否断开），执行期间定期调用
+
+        Returns:
+            tuple: (列名列表, 结果行列表, 是否被截断)
+
+        Raises:
+            QueryTimeout: 超过时间上限
+            QueryCancelled: 查询被取消
+            ValueError: 查询执行失败
+        """
+        if self.size <= 0 or self._spawner is None:
+            if self.size > 0 and not self._inline_warned:
+                # 未调用 start()（例如 flask run），无法安全地fork查询进程
+                self._inline_warned = True
+                print("Query pool not started, running queries in the request thread without timeout")
+            # 不使用进程池：在请求线程中执行，无法中断
+            return self._count(lambda: execute_query(snapshot['entries'], snapshot['options'], query, self.max_rows))
+
+        deadline = time.monotonic() + self.timeout
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count_error(QueryTimeout)
+            raise QueryTimeout()
+        try:
+            try:
+                worker = self._checkout(snapshot, deadline, cancelled)
+            except Exception as e:
+                self._count_error(type(e))
+                raise
+            try:
+                result = self._count(lambda: worker.execute(query, deadline, cancelled))
+            except (QueryTimeout, QueryCancelled):
+                # 进程仍在执行查询，只能直接结束
+                worker.close()
+                raise
+            except ValueError:
+                if not worker.alive:
+                    worker.close()
+                else:
+                    self._checkin(worker)
+                raise
+            self._checkin(worker)
+            return result
+        finally:
+            self._slots.release()
+
+    def _count(self, execute):
+        try:
+            result = execute()
+        except Exception as e:
+            self._count_error(type(e))
+            raise
+        with self._lock:
+            self.executed += 1
+        return result
+
+    def _count_error(self, error_type):
+        with self._lock:
+            if error_type is QueryTimeout:
+                self.timed_out += 1
+            elif error_type is QueryCancelled:
+                self.cancelled += 1
+            else:
+                self.failed += 1
+
+    def _checkout(self, snapshot, deadline, cancelled):
+        """取出持有该快照的空闲进程，没有时由派生进程fork新进程；持有旧快照的空闲进程被回收"""
+        key = _snapshot_key(snapshot)
+        stale = []
+        worker = None
+        with self._lock:
+            for idle in self._idle:
+                if worker is None and idle.key == key:
+                    worker = idle
+                elif idle.key != key:
+                    stale.append(idle)
+            self._idle = [idle for idle in self._idle if idle is not worker and idle not in stale]
+        for idle in stale:
+            idle.close()
+        if worker is None:
+            worker = self._spawner.spawn(key, deadline, cancelled)
+            with self._lock:
+                self.started += 1
+        return worker
+
+    def _checkin(self, worker):
+        with self._lock:
+            self._idle.append(worker)
+
+    def close(self):
+        """结束全部空闲进程和派生进程"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            spawner, self._spawner = self._spawner, None
+        for worker in idle:
+            worker.close()
+        if spawner is not None:
+            spawner.close()
+
+    def reset_after_fork(self):
+        """fork出的子进程中调用：丢弃继承自父进程的派生进程和工作进程（它们属于父进程）"""
+        if self._spawner is not None:
+            self._spawner.close()
+        for worker in self._idle:
+            worker.conn.close()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(self.size, 1))
+        self._idle = []
+        self._spawner = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.size,
+                'spawner': self._spawner.pid if self._spawner is not None else None,
+                'idle': len(self._idle),
+                'started': self.started,
+                'executed': self.executed,
+                'failed': self.failed,
+                'timed_out': self.timed_out,
+                'cancelled': self.cancelled,
+                'timeout': self.timeout,
+                'max_rows': self.max_rows,
+            }
+
+
+def client_disconnected(environ):
+    """检测发起请求的客户端是否已断开连接（请求体已读取完毕之后调用）
+
+    ASGI模式下使用 app.asgi 提供的检测函数；gunicorn 和开发服务器下直接检查连接的套接字。
+    无法检测时返回False。
+    """
+    disconnected = environ.get(DISCONNECTED_ENVIRON_KEY)
+    if disconnected is not None:
+        return disconnected()
+
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if not isinstance(sock, socket.socket):
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        # 可读但没有数据表示对端已关闭连接
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except (BlockingIOError, InterruptedError):
+        return False
+    except ValueError:
+        # TLS套接字不支持 MSG_PEEK，无法检测
+        return False
+    except OSError:
+        # 连接已被重置
+        return True
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+并发请求合并（single-flight）
+
+同一个键的计算同时只执行一次：第一个调用方负责计算，
+其余同时到达的调用方等待并共享同一个结果（或异常）。
+"""
+import threading
+
+
+class _Call:
+    """一次进行中的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """按键合并并发的相同计算"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, func):
+        """执行func并返回结果；同一个键已有计算在进行时等待其结果
+
+        Args:
+            key: 计算的键（可哈希）
+            func: 无参数的计算函数
+
+        Returns:
+            func的返回值
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """统计信息：实际执行次数和共享结果的次数"""
+        with self._lock:
+            return {'executed': self.executed, 'shared': self.shared, 'in_flight': len(self._calls)}
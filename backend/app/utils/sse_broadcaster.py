@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+SSE事件广播
+
+每个订阅者持有一个有界队列，读取端阻塞等待新事件（空闲连接不占用CPU），
+事件发布后立即送达。队列写满（客户端消费过慢）时按配置丢弃最旧的事件或断开该订阅者。
+
+事件按发布顺序编号（"进程纪元:序号"），最近的事件保存在环形缓冲区中，
+客户端重连时携带 Last-Event-ID 即可补发断开期间错过的事件。
+"""
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+# 配置
+SSE_QUEUE_SIZE = int(os.getenv('SSE_QUEUE_SIZE', 100))  # 每个订阅者最多积压的事件数
+SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', 15))  # 空闲时发送保活注释的间隔秒数
+SSE_SLOW_CONSUMER_POLICY = os.getenv('SSE_SLOW_CONSUMER_POLICY', 'disconnect').lower()  # drop / disconnect
+SSE_REPLAY_BUFFER = int(os.getenv('SSE_REPLAY_BUFFER', 256))  # 保留用于重连补发的最近事件数
+
+# 订阅被断开时放入队列的标记
+CLOSED = object()
+
+
+class Subscription:
+    """单个订阅者的事件队列"""
+
+    def __init__(self, maxsize, start_id):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.start_id = start_id  # 订阅时最后一个已发布事件的ID，之后的事件都会进入队列
+        self.closed = False
+        self.dropped = 0  # 因队列写满被丢弃的事件数
+
+    def get(self, timeout=None):
+        """阻塞等待下一个事件
+
+        Returns:
+            事件；超时返回None，订阅被断开时返回 CLOSED
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _put(self, event, policy):
+        """写入事件，队列已满时按策略处理；返回False表示该订阅者应被断开"""
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            pass
+
+        if policy != 'drop':
+            return False
+
+        # 丢弃最旧的事件，为新事件腾出位置
+        try:
+            self._queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+        return True
+
+    def _close(self):
+        """断开订阅：清空积压的事件并唤醒读取端"""
+        self.closed = True
+        while True:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            # 并发的发布可能在清空后又写入了事件，重试直到放入断开标记
+            try:
+                self._queue.put_nowait(CLOSED)
+                return
+            except queue.Full:
+                continue
+
+
+class AsyncSubscription:
+    """事件循环中的订阅者（ASGI模式）：发布线程写入，协程异步等待，不占用线程"""
+
+    def __init__(self, maxsize, start_id, loop):
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self._loop = loop
+        self._ready = asyncio.Event()
+        self.start_id = start_id
+        self.closed = False
+        self.dropped = 0
+
+    def _wake(self):
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # 事件循环已关闭
+            self.closed = True
+
+    async def get(self, timeout=None):
+        """等待下一个事件
+
+        Returns:
+            事件；超时返回None，订阅被断开时返回 CLOSED
+        """
+        while True:
+            with self._lock:
+                if self._items:
+                    return self._items.popleft()
+            # 检查与清除之间没有await，发布线程之后写入的事件一定会再次唤醒
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+    def _put(self, event, policy):
+        with self._lock:
+            if len(self._items) >= self._maxsize:
+                if policy != 'drop':
+                    return False
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(event)
+        self._wake()
+        return not self.closed
+
+    def _close(self):
+        with self._lock:
+            self.closed = True
+            self._items.clear()
+            self._items.append(CLOSED)
+        self._wake()
+
+
+class SseBroadcaster:
+    """线程安全的SSE事件广播器"""
+
+    def __init__(self, queue_size=SSE_QUEUE_SIZE, policy=SSE_SLOW_CONSUMER_POLICY, replay_size=SSE_REPLAY_BUFFER):
+        self.queue_size = queue_size
+        self.policy = policy
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self.disconnected = 0  # 因消费过慢被断开的订阅者数
+        self._history = deque(maxlen=replay_size)  # (序号, 事件)，按序号排列
+        self._next_sequence = None
+        self._new_epoch()
+
+    def _new_epoch(self, epoch=None, next_sequence=None):
+        # 进程纪元：服务重启后序号从头开始，纪元不同的事件ID一律视为无法补发
+        self.epoch = epoch or f'{os.getpid():x}{time.time_ns():x}'
+        self._next_sequence = next_sequence
+        self._sequence = 0
+        self._history.clear()
+
+    def use_shared_sequence(self, epoch, next_sequence):
+        """使用跨进程共享的纪元和事件序号（多进程部署时由事件总线设置）
+
+        Args:
+            epoch: 所有进程共用的纪元
+            next_sequence: 返回下一个全局递增序号的函数
+        """
+        with self._lock:
+            self._new_epoch(epoch, next_sequence)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._subscriptions)
+
+    def _event_id(self, sequence):
+        return f'{self.epoch}:{sequence}'
+
+    @property
+    def last_event_id(self):
+        """最后一个已发布事件的ID"""
+        with self._lock:
+            return self._event_id(self._sequence)
+
+    def _missed_events_locked(self, last_event_id):
+        """last_event_id之后的事件；无法确定（纪元不同或已超出缓冲区）时返回None"""
+        epoch, _, sequence = str(last_event_id).rpartition(':')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence > self._sequence:
+            return None
+        oldest = self._history[0][0] if self._history else self._sequence + 1
+        if sequence + 1 < oldest:
+            return None
+        return [event for event_sequence, event in self._history if event_sequence > sequence]
+
+    def subscribe(self, last_event_id=None, loop=None):
+        """注册一个新的订阅者
+
+        Args:
+            last_event_id: 客户端重连时携带的最后一个事件ID
+            loop: 订阅者所在的事件循环；指定时返回 AsyncSubscription，在协程中等待事件
+
+        Returns:
+            tuple: (订阅者, 错过的事件列表)；未携带ID或无法补发时错过的事件为None，需要完整同步
+        """
+        with self._lock:
+            start_id = self._event_id(self._sequence)
+            if loop is not None:
+                subscription = AsyncSubscription(self.queue_size, start_id, loop)
+            else:
+                subscription = Subscription(self.queue_size, start_id)
+            missed = None
+            if last_event_id:
+                missed = self._missed_events_locked(last_event_id)
+            # 注册与读取缓冲区在同一把锁内完成，补发的事件和之后的新事件既不重复也不遗漏
+            self._subscriptions.add(subscription)
+        return subscription, missed
+
+    def unsubscribe(self, subscription):
+        """移除订阅者（可重复调用）"""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event, event_id=None):
+        """为事件编号并发送给所有订阅者，不会因为某个订阅者消费过慢而阻塞
+
+        Args:
+            event: 事件字典（event、data）
+            event_id: 已由其他进程编号的事件ID（经事件总线转发的事件）
+
+        Returns:
+            str: 事件ID
+        """
+        slow_subscriptions = []
+        with self._lock:
+            if event_id is not None:
+                sequence = int(str(event_id).rpartition(':')[2])
+            elif self._next_sequence is not None:
+                sequence = self._next_sequence()
+            else:
+                sequence = self._sequence + 1
+            self._sequence = max(self._sequence, sequence)
+            event = dict(event, id=self._event_id(sequence))
+
+            # 其他进程的事件可能稍晚到达，按序号插入缓冲区
+            if self._history and self._history[-1][0] > sequence:
+                items = sorted([*self._history, (sequence, event)], key=lambda item: item[0])
+                self._history.clear()
+                self._history.extend(items)
+            else:
+                self._history.append((sequence, event))
+
+            # 在锁内写入各队列（不阻塞），保证同一订阅者收到的事件不会乱序
+            for subscription in self._subscriptions:
+                if not subscription._put(event, self.policy):
+                    slow_subscriptions.append(subscription)
+            for subscription in slow_subscriptions:
+                self._subscriptions.discard(subscription)
+                self.disconnected += 1
+
+        for subscription in slow_subscriptions:
+            print(f"SSE subscriber too slow, disconnecting ({self.queue_size} events pending)")
+            subscription._close()
+        return event['id']
+
+    def reset_after_fork(self):
+        """fork出的子进程中调用：清空继承自父进程的订阅者和事件，并使用新的纪元"""
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._new_epoch()
+
+    def stats(self):
+        """广播器统计信息"""
+        with self._lock:
+            return {
+                'subscribers': len(self._subscriptions),
+                'queue_size': self.queue_size,
+                'policy': self.policy,
+                'disconnected': self.disconnected,
+                'last_event_id': self._event_id(self._sequence),
+                'replay_buffer': len(self._history),
+            }
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+统计聚合引擎
+
+每个账本快照上只遍历一次全部记账行，物化按 (年, 月, 账户) 汇总的各币种金额，
+并向上汇总到各级父账户。统计接口（月度支出、月度收支、账户统计）都从汇总结果中读取，
+任意日期范围的统计只需合并所涉及月份的分组，不再扫描记账行；
+日期范围的起止不在月初/月末时，边界月份使用按日汇总的结果。
+
+提供快照的列式记账行（见 posting_columns）时，可精确定标的记账行通过向量化分组求和一次得到各分组的合计，
+只有带成本的记账行（以及无法精确定标的币种）逐条累加。
+
+新快照只比旧快照多出若干笔交易时（例如 add_entry 追加一笔交易），
+由旧快照的引擎派生新引擎：只复制并更新受影响的分组，其余分组与旧引擎共享。
+
+汇总结果与 beanquery 中 sum(position) / sum(cost(position)) 的结果一致（Inventory）。
+"""
+import calendar
+import copy
+import re
+from datetime import date
+
+import numpy as np
+from beancount.core import convert, data
+from beancount.core.amount import Amount
+from beancount.core.inventory import Inventory
+from beancount.core.position import Position
+
+# datetime64 的纪元（1970-01-01）对应的 date.toordinal()
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def account_matcher(*patterns):
+    """账户匹配函数，规则与 beanquery 的 `account ~ 'pattern'` 一致（不区分大小写的正则搜索），匹配任一模式即可"""
+    regexes = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    return lambda account: any(regex.search(account) for regex in regexes)
+
+
+def month_bounds(year, month):
+    """月份的第一天和最后一天"""
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def account_root(account, depth):
+    """账户的前depth级名称，与 beanquery 的 root(account, depth) 一致"""
+    return ':'.join(account.split(':')[:depth])
+
+
+class Totals:
+    """一组记账行的合计
+
+    units 与 beanquery 的 sum(position) 一致，cost 与 sum(cost(position)) 一致。
+    """
+
+    __slots__ = ('units', 'cost')
+
+    def __init__(self):
+        self.units = Inventory()
+        self.cost = Inventory()
+
+    def copy(self):
+        totals = Totals()
+        totals.units = copy.copy(self.units)
+        totals.cost = copy.copy(self.cost)
+        return totals
+
+    def add_posting(self, posting):
+        position = Position(posting.units, posting.cost)
+        self.units.add_position(position)
+        self.cost.add_amount(convert.get_cost(position))
+
+    def add_totals(self, other):
+        self.units.add_inventory(other.units)
+        self.cost.add_inventory(other.cost)
+
+    @classmethod
+    def from_sums(cls, sums):
+        """由各币种的合计构建（无成本的记账行，units与cost相同）
+
+        Args:
+            sums: [(币种, Decimal), ...]，按币种首次出现的顺序
+        """
+        totals = cls()
+        for currency, number in sums:
+            amount = Amount(number, currency)
+            totals.units.add_amount(amount)
+            totals.cost.add_amount(amount)
+        return totals
+
+
+class StatsEngine:
+    """按 (年, 月, 账户) 汇总的记账行合计（构建完成后只读）"""
+
+    def __init__(self, entries=(), columns=None):
+        """
+        Args:
+            entries: 快照的全部条目
+            columns: 同一快照的 PostingColumns，提供时向量化构建
+        """
+        self._months = {}  # (年, 月) -> {账户: Totals}，账户自身的记账行
+        self._subtrees = {}  # (年, 月) -> {账户或父账户: Totals}，包含全部子账户
+        self._days = {}  # (年, 月) -> {账户: [(日期, Totals), ...]}
+        self._transactions = []  # 参与汇总的交易，按条目顺序
+        self._fresh = None  # 派生过程中已复制的分组键；None表示全部分组归本引擎所有
+
+        if columns is not None:
+            self._build_from_columns(entries, columns)
+            return
+        for entry in entries:
+            if isinstance(entry, data.Transaction):
+                self._add_transaction(entry)
+
+    def _build_from_columns(self, entries, columns):
+        self._transactions = [entry for entry in entries if isinstance(entry, data.Transaction)]
+        fast = columns.exact_rows()
+        rows = np.flatnonzero(fast)
+        # 日期序数 -> 自1970年1月起的月份序号
+        epoch_days = (columns.date.astype(np.int64) - EPOCH_ORDINAL).astype('datetime64[D]')
+        months = epoch_days.astype('datetime64[M]')
+        month_numbers = months.astype(np.int64)
+
+        def month_key(number):
+            number = int(number)
+            return (1970 + number // 12, number % 12 + 1)
+
+        def collect(group_keys, currencies, numbers, first_rows, group_of):
+            """把分组求和的结果按 group_of(键...) 归并为 Totals，币种按组内首次出现的顺序加入"""
+            grouped = {}
+            for *keys, currency_id, number, first_row in zip(*group_keys, currencies, numbers, first_rows):
+                grouped.setdefault(group_of(*keys), []).append((first_row, columns.currency_names[currency_id], number))
+            return {
+                group: Totals.from_sums([(currency, number) for _, currency, number in sorted(sums)])
+                for group, sums in grouped.items()
+            }
+
+        # 账户自身的月度合计
+        sums = columns.group_sums([month_numbers, columns.account], rows)
+        for (month, account), totals in collect(
+            *sums, lambda month, account: (month_key(month), columns.account_names[account])
+        ).items():
+            self._months.setdefault(month, {})[account] = totals
+
+        # 各级父账户（包括账户自身）的月度合计
+        prefix_names = []
+        prefix_ids = {}
+        levels = []  # 每一级：账户ID -> 前缀ID（层级不足时为-1）
+        for account_id, account in enumerate(columns.account_names):
+            parts = account.split(':')
+            for level in range(len(parts)):
+                if level == len(levels):
+                    levels.append(np.full(len(columns.account_names), -1, dtype=np.int64))
+                prefix = ':'.join(parts[: level + 1])
+                if prefix not in prefix_ids:
+                    prefix_ids[prefix] = len(prefix_names)
+                    prefix_names.append(prefix)
+                levels[level][account_id] = prefix_ids[prefix]
+        for level in levels:
+            prefixes = level[columns.account]
+            level_rows = rows[prefixes[rows] >= 0]
+            sums = columns.group_sums([month_numbers, prefixes], level_rows)
+            for (month, prefix), totals in collect(
+                *sums, lambda month, prefix: (month_key(month), prefix_names[prefix])
+            ).items():
+                self._subtrees.setdefault(month, {})[prefix] = totals
+
+        # 按日合计，每个账户的日期列表按日期升序
+        sums = columns.group_sums([columns.date, columns.account], rows)
+        for (ordinal, account), totals in collect(*sums, lambda ordinal, account: (int(ordinal), int(account))).items():
+            day = date.fromordinal(ordinal)
+            month = (day.year, day.month)
+            self._days.setdefault(month, {}).setdefault(columns.account_names[account], []).append((day, totals))
+
+        # 带成本或无法精确定标的记账行逐条累加
+        for row in np.flatnonzero(~fast):
+            entry = entries[columns.entry[row]]
+            self._add_posting(entry, entry.postings[columns.slot[row]])
+
+    def _writable(self, key, obj, copy_func):
+        """派生新引擎时，首次修改与旧引擎共享的分组之前先复制"""
+        if self._fresh is None or key in self._fresh:
+            return obj
+        self._fresh.add(key)
+        return copy_func(obj)
+
+    def _group(self, store, key, fresh_key, factory, copy_func):
+        """store[key] 的可写版本，不存在时新建；fresh_key 在整个引擎中唯一标识该分组"""
+        obj = store.get(key)
+        if obj is None:
+            obj = factory()
+            if self._fresh is not None:
+                self._fresh.add(fresh_key)
+        else:
+            obj = self._writable(fresh_key, obj, copy_func)
+        store[key] = obj
+        return obj
+
+    def _add_transaction(self, entry):
+        self._transactions.append(entry)
+        for posting in entry.postings:
+            self._add_posting(entry, posting)
+
+    def _add_posting(self, entry, posting):
+        if posting.units is None:
+            return
+        month = (entry.date.year, entry.date.month)
+        month_totals = self._group(self._months, month, ('months', month), dict, dict.copy)
+        subtrees = self._group(self._subtrees, month, ('subtrees', month), dict, dict.copy)
+        month_days = self._group(self._days, month, ('days', month), dict, dict.copy)
+
+        account = posting.account
+        self._group(month_totals, account, ('months', month, account), Totals, Totals.copy).add_posting(posting)
+
+        # 向上汇总到各级父账户（包括账户自身）
+        parts = account.split(':')
+        for i in range(1, len(parts) + 1):
+            prefix = ':'.join(parts[:i])
+            self._group(subtrees, prefix, ('subtrees', month, prefix), Totals, Totals.copy).add_posting(posting)
+
+        # 同一天的记账行合并到同一项
+        days = self._group(month_days, account, ('days', month, account), list, list.copy)
+        for i in range(len(days) - 1, -1, -1):
+            if days[i][0] == entry.date:
+                day_totals = self._writable(('day', month, account, entry.date), days[i][1], Totals.copy)
+                days[i] = (entry.date, day_totals)
+                break
+        else:
+            day_totals = Totals()
+            days.append((entry.date, day_totals))
+            if self._fresh is not None:
+                self._fresh.add(('day', month, account, entry.date))
+        day_totals.add_posting(posting)
+
+    def updated(self, entries):
+        """为新快照派生统计引擎
+
+        新快照的交易相对本快照只有新增（按条目顺序对比）时，复制本引擎并只更新新增交易所在的分组，
+        本引擎不会被修改，仍可供旧快照的读者使用。
+
+        Args:
+            entries: 新快照的全部条目
+
+        Returns:
+            StatsEngine: 派生的新引擎；交易有修改或删除时返回None，需要重新构建
+        """
+        transactions = [entry for entry in entries if isinstance(entry, data.Transaction)]
+        old = self._transactions
+        added_count = len(transactions) - len(old)
+        if added_count < 0:
+            return None
+
+        added = []
+        i = 0
+        for entry in transactions:
+            if i < len(old) and (entry is old[i] or entry == old[i]):
+                i += 1
+                continue
+            added.append(entry)
+            if len(added) > added_count:
+                return None
+
+        engine = StatsEngine()
+        engine._months = dict(self._months)
+        engine._subtrees = dict(self._subtrees)
+        engine._days = dict(self._days)
+        engine._fresh = set()
+        for entry in added:
+            engine._add_transaction(entry)
+        engine._transactions = transactions
+        engine._fresh = None
+        return engine
+
+    def aggregate(self, start_date=None, end_date=None, match=None, depth=None):
+        """[start_date, end_date] 区间内按 (年, 月, 账户) 汇总的合计
+
+        Args:
+            start_date: 开始日期（含），None表示不限
+            end_date: 结束日期（含），None表示不限
+            match: 账户过滤函数，见 account_matcher()
+            depth: 按前depth级账户汇总（与 root(account, depth) 分组一致），None表示按完整账户；
+                指定时过滤函数作用于汇总后的账户名
+
+        Returns:
+            list: [((年, 月, 账户), Totals), ...]，按年、月、账户排序；
+                只包含区间内有记账行的组合。返回的 Totals 可能是引擎内部的对象，调用方不能修改
+        """
+        matched = {}  # 账户 -> 是否匹配，每个账户只计算一次
+
+        def account_matches(account):
+            if match is None:
+                return True
+            if account not in matched:
+                matched[account] = bool(match(account))
+            return matched[account]
+
+        result = []
+        for month in sorted(self._months):
+            first, last = month_bounds(*month)
+            if (start_date is not None and last < start_date) or (end_date is not None and first > end_date):
+                continue
+
+            if (start_date is None or start_date <= first) and (end_date is None or last <= end_date):
+                # 整月都在区间内，直接使用物化的月度分组
+                groups = self._month_groups(month, depth)
+            else:
+                # 边界月份：合并区间内各天的合计
+                groups = self._day_groups(month, depth, start_date, end_date)
+            for account in sorted(groups):
+                if account_matches(account):
+                    result.append(((*month, account), groups[account]))
+        return result
+
+    def _month_groups(self, month, depth):
+        month_totals = self._months[month]
+        if depth is None:
+            return month_totals
+        subtrees = self._subtrees[month]
+        groups = {prefix: totals for prefix, totals in subtrees.items() if prefix.count(':') == depth - 1}
+        # 层级不足depth的账户只包含自身的记账行，它的子账户归入更深一级的分组
+        for account, totals in month_totals.items():
+            if account.count(':') < depth - 1:
+                groups[account] = totals
+        return groups
+
+    def _day_groups(self, month, depth, start_date, end_date):
+        groups = {}
+        for account, days in self._days[month].items():
+            key = account if depth is None else account_root(account, depth)
+            for day, day_totals in days:
+                if (start_date is None or day >= start_date) and (end_date is None or day <= end_date):
+                    if key not in groups:
+                        groups[key] = Totals()
+                    groups[key].add_totals(day_totals)
+        return groups
+
+    def account_totals(self, start_date=None, end_date=None, match=None):
+        """[start_date, end_date] 区间内按账户汇总的合计
+
+        Returns:
+            dict: {账户: Totals}，按账户排序
+        """
+        result = {}
+        for (_, _, account), totals in self.aggregate(start_date, end_date, match):
+            if account not in result:
+                result[account] = Totals()
+            result[account].add_totals(totals)
+        return dict(sorted(result.items()))
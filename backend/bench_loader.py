@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+账本加载性能测试
+
+对比 beancount.loader.load_file 与增量加载器（冷启动 / 文件未变化时的重新加载）的耗时，
+并测量在进程池中并行解析各文件（结果传回主进程）相对串行解析的耗时。
+进程池并行解析实测比串行更慢，加载器因此只串行解析，这里保留测量以便在其他机器和账本上复核。
+
+用法：python bench_loader.py [账本文件] [--workers N] [--repeat N]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import beancount.loader
+
+from app.utils.ledger_loader import LedgerLoader, _parse_content
+from app.utils.ledger_utils import LEDGER_FILE, analyze_include_structure
+
+
+def timed(func, repeat):
+    """执行repeat次，返回最短耗时和最后一次的结果"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def read_files(files):
+    contents = []
+    for filename in files:
+        with open(filename, 'rb') as f:
+            contents.append(f.read())
+    return contents
+
+
+def parse_serial(files, contents):
+    return [_parse_content(filename, content, 'utf-8') for filename, content in zip(files, contents)]
+
+
+def parse_in_pool(files, contents, workers):
+    """在进程池中解析各文件，解析结果序列化后传回主进程"""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(
+            pool.map(
+                _parse_content,
+                files,
+                contents,
+                ['utf-8'] * len(files),
+                chunksize=max(1, len(files) // (workers * 4)),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MoneyMint 账本加载性能测试')
+    parser.add_argument('ledger', nargs='?', default=LEDGER_FILE, help='主账本文件路径')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='并行解析的进程数')
+    parser.add_argument('--repeat', type=int, default=3, help='每种方式的重复次数（取最短耗时）')
+    args = parser.parse_args()
+
+    # 关闭beancount自带的pickle缓存，保证每次都是真实的完整加载
+    beancount.loader.initialize(use_cache=False)
+
+    _, reverse_include = analyze_include_structure(args.ledger)
+    files = [args.ledger, *reverse_include]
+    print(f"Ledger: {args.ledger} ({len(files)} files), workers: {args.workers}")
+
+    baseline, (entries, _, _) = timed(lambda: beancount.loader.load_file(args.ledger, encoding='utf-8'), args.repeat)
+    serial, _ = timed(lambda: LedgerLoader().load_file(args.ledger), args.repeat)
+
+    # 所有文件均未变化时的增量重新加载
+    warm_loader = LedgerLoader()
+    warm_loader.load_file(args.ledger)
+    incremental, _ = timed(lambda: warm_loader.load_file(args.ledger), args.repeat)
+
+    # 只比较逐文件解析阶段：串行解析与进程池并行解析（包括结果传回主进程）
+    contents = read_files(files)
+    parse_serial_seconds, serial_results = timed(lambda: parse_serial(files, contents), args.repeat)
+    parse_pool_seconds, pool_results = timed(lambda: parse_in_pool(files, contents, args.workers), args.repeat)
+
+    print(f"Entries: {len(entries)}")
+    print(f"{'mode':<32}{'seconds':>10}{'speedup':>10}")
+    for name, seconds in [
+        ('beancount.loader.load_file', baseline),
+        ('LedgerLoader (cold)', serial),
+        ('LedgerLoader (incremental, warm)', incremental),
+    ]:
+        print(f"{name:<32}{seconds:>10.4f}{baseline / seconds:>9.2f}x")
+
+    identical = [result[0] for result in serial_results] == [result[0] for result in pool_results]
+    print(f"\nParsing files only (pool result identical: {identical})")
+    print(f"{'mode':<32}{'seconds':>10}{'speedup':>10}")
+    for name, seconds in [
+        ('serial', parse_serial_seconds),
+        (f'process pool ({args.workers} workers)', parse_pool_seconds),
+    ]:
+        print(f"{name:<32}{seconds:>10.4f}{parse_serial_seconds / seconds:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,6 +10,10 @@ load_status = load_dotenv()
 
 # 然后再导入app，确保环境变量在app初始化前已加载
 from app import app
+from app.utils import ledger_utils
+
+# 运行模式：wsgi（Flask内置服务器）或 asgi（uvicorn，SSE连接由协程处理）
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()
 
 if __name__ == '__main__':
     ENV = os.getenv('FLASK_ENV', 'development')
@@ -22,4 +26,15 @@ if __name__ == '__main__':
             for key, value in os.environ.items():
                 print(f"{key}: {value}")
 
-    app.run(debug=ENV == 'development', host='0.0.0.0', port=5000)
+    # 查询进程池的派生进程要在任何后台线程启动之前fork；
+    # 开发服务器的重新加载器主进程不处理请求，只在实际运行应用的子进程中启动
+    use_reloader = SERVER_MODE != 'asgi' and ENV == 'development'
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        ledger_utils.start_query_pool()
+
+    if SERVER_MODE == 'asgi':
+        import uvicorn
+
+        uvicorn.run('app.asgi:application', host='0.0.0.0', port=5000, lifespan='on')
+    else:
+        app.run(debug=ENV == 'development', host='0.0.0.0', port=5000)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+MoneyMint 后端生产环境启动入口
+
+使用 gunicorn 以多进程（每个进程多线程）方式提供服务。账本及其索引在主进程中加载一次，
+之后再fork工作进程，各工作进程以写时复制的方式共享已解析的账本，无需各自重新解析。
+"""
+import gc
+import os
+import shutil
+from dotenv import load_dotenv
+
+# 首先加载环境变量文件
+load_dotenv()
+
+from gunicorn.app.base import BaseApplication
+
+from app import app
+from app.utils import ledger_utils
+from app.utils.event_bus import create_bus_directory
+
+# 配置
+SERVER_BIND = os.getenv('SERVER_BIND', '0.0.0.0:5000')
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', 2))  # 工作进程数
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', 8))  # 每个工作进程的线程数（wsgi模式）
+SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', 120))  # 工作进程无响应多少秒后被重启
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi').lower()  # wsgi（gthread）或 asgi（uvicorn-worker）
+EVENT_BUS_DIR = os.getenv('EVENT_BUS_DIR', '')  # 进程间事件总线的套接字目录，为空时使用临时目录
+
+# 本次运行使用的事件总线目录（在fork之前创建）
+bus_directory = None
+
+
+def post_fork(server, worker):
+    """工作进程启动后重新初始化父进程中的后台线程，并加入进程间事件总线"""
+    # 此时工作进程中只有一个线程：reinit_after_fork 先fork查询进程池的派生进程，再启动文件监听线程
+    ledger_utils.reinit_after_fork()
+    ledger_utils.start_event_bus(bus_directory)
+
+
+def worker_exit(server, worker):
+    """工作进程退出时移除其事件总线套接字"""
+    if ledger_utils.event_bus is not None:
+        ledger_utils.event_bus.stop()
+
+
+def on_exit(server):
+    """主进程退出时清理自动创建的事件总线目录"""
+    if bus_directory and not EVENT_BUS_DIR:
+        shutil.rmtree(bus_directory, ignore_errors=True)
+
+
+class MoneyMintServer(BaseApplication):
+    """以编程方式配置的 gunicorn 应用"""
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def build_server(mode=SERVER_MODE):
+    """按运行模式构建 gunicorn 配置
+
+    Args:
+        mode: wsgi（gthread 工作进程）或 asgi（uvicorn-worker 提供的 UvicornWorker）
+
+    Returns:
+        tuple: (应用, 配置字典)
+    """
+    options = {
+        'bind': SERVER_BIND,
+        'workers': SERVER_WORKERS,
+        'timeout': SERVER_TIMEOUT,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+        'on_exit': on_exit,
+        'accesslog': '-',
+    }
+    if mode == 'asgi':
+        from app.asgi import application
+
+        options['worker_class'] = 'uvicorn_worker.UvicornWorker'
+    else:
+        application = app
+        options['worker_class'] = 'gthread'
+        options['threads'] = SERVER_THREADS
+    return application, options
+
+
+def main():
+    global bus_directory
+
+    # 在主进程中加载账本和索引，fork之后由工作进程共享
+    ledger_utils.warm_ledger()
+    ledger_utils.prepare_for_fork()
+    # 将预热的对象移出GC跟踪范围，避免垃圾回收在工作进程中改写这些内存页
+    gc.collect()
+    gc.freeze()
+
+    # 写入请求只会到达其中一个工作进程，通过事件总线通知其余进程
+    bus_directory = create_bus_directory(EVENT_BUS_DIR or None)
+
+    application, options = build_server()
+    print(f"Starting MoneyMint backend on {SERVER_BIND} ({SERVER_MODE}, {SERVER_WORKERS} workers)")
+    MoneyMintServer(application, options).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ setup(
     name='moneymint-backend',
     version='0.1.0',
     packages=find_packages(),
+    py_modules=['run', 'serve'],
     include_package_data=True,
     description='A personal finance management system backend based on Beancount',
     long_description=long_description,
@@ -34,7 +35,7 @@ setup(
     ],
     entry_points={
         'console_scripts': [
-            'moneymint-backend = run:app',
+            'moneymint-backend = serve:main',
         ],
     },
 )
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共配置
+
+app 的模块在导入时读取环境变量（账本路径等），账本不存在时还会创建默认账本，
+因此必须在导入 app 之前把账本指向临时目录。
+"""
+import os
+import random
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+os.environ['LEDGER_FILE'] = os.path.join(tempfile.mkdtemp(prefix='moneymint-test-'), 'main.bean')
+os.environ['LEDGER_DISK_CACHE'] = 'false'
+
+import pytest
+
+ACCOUNTS = [
+    'Assets:Bank:Checking',
+    'Assets:Cash',
+    'Assets:Broker',
+    'Liabilities:CreditCard',
+    'Income:Salary',
+    'Expenses:Food:Dining',
+    'Expenses:Food:Groceries',
+    'Expenses:Transport',
+    'Expenses:Travel',
+    'Equity:Opening-Balances',
+]
+
+
+def write_files(directory, files):
+    """按 {相对路径: 内容} 写入文件"""
+    for relative_path, content in files.items():
+        file_path = os.path.join(directory, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+def generate_ledger(directory, months=6, per_month=30, seed=1):
+    """生成多文件、多币种的测试账本（按年月分文件，包含成本记账行），返回主文件路径"""
+    rng = random.Random(seed)
+    files = {
+        'main.bean': (
+            'option "title" "Test Ledger"\n'
+            'option "operating_currency" "CNY"\n'
+            'include "accounts.bean"\n'
+            'include "date/ledge.bean"\n'
+        ),
+        'accounts.bean': ''.join(f'2020-01-01 open {account}\n' for account in ACCOUNTS)
+        + '2020-01-01 commodity STK\n',
+    }
+
+    year_includes = {}
+    for month_index in range(months):
+        year = 2021 + month_index // 12
+        month = month_index % 12 + 1
+        lines = []
+        for _ in range(per_month):
+            day = date(year, month, rng.randint(1, 28))
+            expense = rng.choice([account for account in ACCOUNTS if account.startswith('Expenses')])
+            source = rng.choice(['Assets:Bank:Checking', 'Assets:Cash', 'Liabilities:CreditCard'])
+            currency = rng.choice(['CNY', 'CNY', 'CNY', 'USD'])
+            number = f'{rng.randint(1, 50000) / 100:.2f}'
+            lines.append(f'{day} * "Shop" "Purchase #{rng.randint(1, 999)}"\n')
+            lines.append(f'  {expense}  {number} {currency}\n')
+            lines.append(f'  {source}  -{number} {currency}\n\n')
+        payday = date(year, month, 25)
+        lines.append(f'{payday} * "Employer" "Salary"\n  Assets:Bank:Checking  12000.00 CNY\n  Income:Salary\n\n')
+        lines.append(
+            f'{payday + timedelta(days=1)} * "Broker" "Buy"\n'
+            f'  Assets:Broker  {rng.randint(1, 9)} STK {{{rng.randint(10, 90)}.50 USD}}\n'
+            f'  Assets:Bank:Checking\n\n'
+        )
+        files[f'date/{year}/{year}-{month:02d}.bean'] = ''.join(lines)
+        year_includes.setdefault(year, []).append(f'include "{year}-{month:02d}.bean"\n')
+
+    for year, includes in year_includes.items():
+        files[f'date/{year}/{year}.bean'] = ''.join(includes)
+    files['date/ledge.bean'] = ''.join(f'include "{year}/{year}.bean"\n' for year in year_includes)
+
+    write_files(directory, files)
+    return os.path.join(directory, 'main.bean')
+
+
+@pytest.fixture
+def ledger_file(tmp_path):
+    """临时目录中的测试账本主文件"""
+    return generate_ledger(str(tmp_path))
+
+
+@pytest.fixture
+def app_ledger():
+    """把应用使用的账本（LEDGER_FILE）替换为新生成的测试账本，返回主文件路径"""
+    from app.utils import ledger_utils
+
+    directory = os.path.dirname(ledger_utils.LEDGER_FILE)
+    shutil.rmtree(directory)
+    os.makedirs(directory)
+    generate_ledger(directory)
+    ledger_utils.mark_ledger_changed(wait_fresh=True)
+    return ledger_utils.LEDGER_FILE
+
+
+@pytest.fixture
+def client(app_ledger):
+    from app import app
+
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    from flask_jwt_extended import create_access_token
+
+    from app import app
+
+    with app.app_context():
+        token = create_access_token(identity='test')
+    return {'Authorization': f'Bearer {token}'}
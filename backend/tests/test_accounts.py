@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+from decimal import Decimal
+
+import beancount.loader
+from beancount.core import data
+
+
+def expected_change(ledger_file, account, start_date, end_date):
+    """区间内账户各币种数值的合计（与接口的 balance 口径一致）"""
+    entries, _, _ = beancount.loader.load_file(ledger_file)
+    total = Decimal(0)
+    for entry in entries:
+        if isinstance(entry, data.Transaction) and start_date <= entry.date <= end_date:
+            for posting in entry.postings:
+                if posting.account == account:
+                    total += posting.units.number
+    return total
+
+
+def test_balances_in_date_range(client, auth_headers, app_ledger):
+    response = client.get('/api/accounts/balances?start_date=2020-01-01&end_date=2021-03-15', headers=auth_headers)
+    assert response.status_code == 200
+    balances = {item['name']: item for item in response.get_json()}
+
+    expected = expected_change(app_ledger, 'Expenses:Food:Dining', date(2020, 1, 1), date(2021, 3, 15))
+    assert balances['Expenses:Food:Dining']['balance'] == float(expected)
+    assert balances['Expenses:Food:Dining']['type'] == 'Expenses'
+    assert balances['Expenses:Food:Dining']['subtype'] == 'Food'
+    # 按账户类型（资产、负债、收入、支出、权益）排序
+    order = ['Assets', 'Liabilities', 'Income', 'Expenses', 'Equity']
+    types = [order.index(item['type']) for item in balances.values()]
+    assert types == sorted(types)
+
+
+def test_balances_use_a_single_snapshot(client, auth_headers, monkeypatch):
+    from app.accounts import routes
+    from app.utils import ledger_utils
+
+    snapshots = []
+
+    def recording_get_ledger_snapshot(wait_fresh=None):
+        snapshot = ledger_utils.get_ledger_snapshot(wait_fresh)
+        snapshots.append(snapshot)
+        return snapshot
+
+    monkeypatch.setattr(routes, 'get_ledger_snapshot', recording_get_ledger_snapshot)
+    assert client.get('/api/accounts/balances', headers=auth_headers).status_code == 200
+
+    # options 和余额索引来自同一个快照
+    assert len(snapshots) == 1
+    assert 'balance' in snapshots[0]['indexes']
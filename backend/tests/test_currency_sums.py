@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import math
+from datetime import date
+from decimal import Decimal
+
+import beancount.loader
+import pytest
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.inventory import Inventory
+from beancount.core.number import D
+from beancount.core.position import Cost, Position
+
+from app.utils.currency_sums import CurrencySums, to_json
+
+
+def test_reads_inventory_position_and_amount():
+    inventory = Inventory()
+    inventory.add_amount(Amount(D('12.30'), 'CNY'))
+    inventory.add_amount(Amount(D('4.56'), 'USD'))
+    inventory.add_amount(Amount(D('0.70'), 'CNY'))
+    assert CurrencySums.of(inventory) == {'CNY': D('13.00'), 'USD': D('4.56')}
+
+    # 按成本持有的仓位取其数量和商品
+    position = Position(Amount(D('3'), 'STK'), Cost(D('10.50'), 'USD', date(2021, 1, 26), None))
+    assert CurrencySums.of(position) == {'STK': D('3')}
+    assert CurrencySums.of(Amount(D('-8.25'), 'CNY')) == {'CNY': D('-8.25')}
+    assert CurrencySums.of(None) == {}
+
+
+def test_rejects_non_amount_values():
+    with pytest.raises(TypeError):
+        CurrencySums.of('12.30 CNY')
+    with pytest.raises(TypeError):
+        CurrencySums.of(Decimal('12.30'))
+
+
+def test_multi_currency_rows_are_kept():
+    total = CurrencySums()
+    for row in [Amount(D('10.00'), 'CNY'), Amount(D('2.50'), 'USD'), Amount(D('1.00'), 'JPY')]:
+        total += CurrencySums.of(row)
+    assert total == {'CNY': D('10.00'), 'USD': D('2.50'), 'JPY': D('1.00')}
+    assert total.number('CNY') == D('10.00')
+    # 没有该币种时为0
+    assert total.number('EUR') == 0
+
+    difference = total - CurrencySums({'USD': D('2.50'), 'EUR': D('3')})
+    assert difference == {'CNY': D('10.00'), 'USD': D('0.00'), 'JPY': D('1.00'), 'EUR': D('-3')}
+    assert abs(difference) == {'CNY': D('10.00'), 'USD': D('0.00'), 'JPY': D('1.00'), 'EUR': D('3')}
+    assert isinstance(difference, CurrencySums)
+
+
+def test_precision_is_kept_until_to_json():
+    total = CurrencySums()
+    for _ in range(10):
+        total.add('CNY', D('0.1'))
+    # float 累加会得到 0.9999999999999999
+    assert total['CNY'] == D('1.0')
+    assert to_json(total) == {'CNY': 1.0}
+
+    precise = CurrencySums.of(Amount(D('1234567890.123456789'), 'CNY'))
+    assert precise['CNY'] == D('1234567890.123456789')
+    assert to_json(precise['CNY']) == float('1234567890.123456789')
+
+
+def test_to_json_converts_nested_values():
+    sums = CurrencySums({'USD': D('1.50'), 'CNY': D('-0.00')})
+    result = to_json({'total': D('2.25'), 'amounts': sums, 'rows': [(D('1'), 'x')], 'name': 'Expenses'})
+    assert result == {'total': 2.25, 'amounts': {'CNY': 0.0, 'USD': 1.5}, 'rows': [[1.0, 'x']], 'name': 'Expenses'}
+    # 币种排序，且不输出 -0.0
+    assert list(result['amounts']) == ['CNY', 'USD']
+    assert math.copysign(1, result['amounts']['CNY']) == 1
+
+
+def test_monthly_expenses_report_every_currency(client, auth_headers, app_ledger):
+    entries, _, _ = beancount.loader.load_file(app_ledger)
+    expected = CurrencySums()
+    for entry in entries:
+        if isinstance(entry, data.Transaction) and date(2021, 2, 1) <= entry.date <= date(2021, 3, 31):
+            for posting in entry.postings:
+                if posting.account.startswith('Expenses:'):
+                    expected += CurrencySums.of(posting.units)
+
+    response = client.get(
+        '/api/stats/monthly-expenses',
+        headers=auth_headers,
+        query_string={'start_date': '2021-02-01', 'end_date': '2021-03-31'},
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert set(expected) == {'CNY', 'USD'}
+    assert body['total_expense_by_currency'] == to_json(expected)
+    assert body['total_expense'] == to_json(expected['CNY'])
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+import base64
+import csv
+import io
+import json
+import os
+from datetime import date
+from decimal import Decimal
+
+import beancount.loader
+import pytest
+from beancount.core import data
+
+
+def balance_before(ledger_file, account, date, currency):
+    entries, _, _ = beancount.loader.load_file(ledger_file)
+    total = Decimal(0)
+    for entry in entries:
+        if isinstance(entry, data.Transaction) and entry.date < date:
+            for posting in entry.postings:
+                if posting.account == account and posting.units.currency == currency:
+                    total += posting.units.number
+    return total
+
+
+def month_file_text(ledger_file):
+    with open(ledger_file.replace('main.bean', 'date/2021/2021-06.bean'), encoding='utf-8') as f:
+        return f.read()
+
+
+def test_balance_of_multi_currency_account_compares_its_own_currency(client, auth_headers, app_ledger):
+    cash_cny = balance_before(app_ledger, 'Assets:Cash', date(2021, 6, 28), 'CNY')
+    assert balance_before(app_ledger, 'Assets:Cash', date(2021, 6, 28), 'USD') != 0
+
+    response = client.post(
+        '/api/entries',
+        headers=auth_headers,
+        json={'type': 'Balance', 'date': '2021-06-28', 'account': 'Assets:Cash', 'amount': f'{cash_cny} CNY'},
+    )
+    assert response.status_code == 200
+    # 该币种的余额已经一致，不需要Pad（其他币种的余额不参与比较）
+    assert 'pad Assets:Cash' not in month_file_text(app_ledger)
+    assert client.get('/api/ledger?fresh=1', headers=auth_headers).get_json()['errors_count'] == 0
+
+
+def test_balance_mismatch_adds_pad(client, auth_headers, app_ledger):
+    response = client.post(
+        '/api/entries',
+        headers=auth_headers,
+        json={'type': 'Balance', 'date': '2021-06-28', 'account': 'Assets:Cash', 'amount': '123.45 CNY'},
+    )
+    assert response.status_code == 200
+    assert '2021-06-27 pad Assets:Cash Equity:Opening-Balances' in month_file_text(app_ledger)
+    assert client.get('/api/ledger?fresh=1', headers=auth_headers).get_json()['errors_count'] == 0
+
+
+def test_balance_with_invalid_amount(client, auth_headers):
+    response = client.post(
+        '/api/entries',
+        headers=auth_headers,
+        json={'type': 'Balance', 'date': '2021-06-28', 'account': 'Assets:Cash', 'amount': 'abc CNY'},
+    )
+    assert response.status_code == 400
+
+
+def entry_ids(client, auth_headers, **params):
+    response = client.get('/api/entries', headers=auth_headers, query_string={'page_size': 1000, **params})
+    assert response.status_code == 200
+    return [entry['id'] for entry in response.get_json()['entries']]
+
+
+def cursor_pages(client, auth_headers, page_size=7, **params):
+    """以游标方式翻完所有页，返回条目ID列表和每页的游标"""
+    ids, cursors, cursor = [], [], ''
+    while True:
+        response = client.get(
+            '/api/entries', headers=auth_headers, query_string={'page_size': page_size, 'cursor': cursor, **params}
+        )
+        assert response.status_code == 200
+        body = response.get_json()
+        assert len(body['entries']) <= page_size
+        ids.extend(entry['id'] for entry in body['entries'])
+        if not body['pagination']['has_more']:
+            return ids, cursors
+        cursor = body['pagination']['next_cursor']
+        cursors.append(cursor)
+
+
+def test_cursor_round_trip(app_ledger):
+    from app.entries.routes import decode_cursor, encode_cursor
+
+    directory = os.path.dirname(os.path.abspath(app_ledger))
+    for filename in [os.path.join(directory, 'date', '2021', '2021-06.bean'), app_ledger, '<pad>', '']:
+        key = (date(2021, 6, 28), 3, 17, filename)
+        for order in ('asc', 'desc'):
+            cursor = encode_cursor(key, order)
+            # 游标中不包含服务器上的绝对路径
+            assert directory not in base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+            assert decode_cursor(cursor) == (key, order)
+
+
+@pytest.mark.parametrize(
+    'payload',
+    [
+        ['2021-06-28', 3, 17, '/etc/passwd', 'desc'],
+        ['2021-06-28', 3, 17, 'main.bean', 'sideways'],
+        ['2021-06-28', 3, -1, 'main.bean', 'desc'],
+        ['2021-06-28', '3', 17, 'main.bean', 'desc'],
+        ['2021-06-28', 3, 17, ['main.bean'], 'desc'],
+        ['2021-13-45', 3, 17, 'main.bean', 'desc'],
+        ['2021-06-28', 3, 17, 'main.bean'],
+        {'date': '2021-06-28'},
+    ],
+)
+def test_invalid_cursor_is_rejected(client, auth_headers, payload):
+    cursor = base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+    for value in (cursor, 'not a cursor!'):
+        response = client.get('/api/entries', headers=auth_headers, query_string={'cursor': value, 'order': 'desc'})
+        assert response.status_code == 400
+
+
+@pytest.mark.parametrize('order', ['desc', 'asc'])
+@pytest.mark.parametrize('params', [{}, {'account': 'Assets:Cash'}, {'account': 'Expenses', 'include_children': 'true'}])
+def test_cursor_pagination_has_no_gaps_or_duplicates(client, auth_headers, order, params):
+    expected = entry_ids(client, auth_headers, order=order, **params)
+    ids, cursors = cursor_pages(client, auth_headers, order=order, **params)
+    assert len(expected) > 7
+    assert ids == expected
+    assert len(set(ids)) == len(ids)
+    assert len(cursors) == (len(expected) - 1) // 7
+
+
+def test_cursor_pagination_is_stable_across_writes(client, auth_headers):
+    expected = entry_ids(client, auth_headers, order='desc')
+    first = client.get('/api/entries', headers=auth_headers, query_string={'page_size': 7, 'cursor': ''}).get_json()
+
+    # 在已翻过的位置插入新条目（降序时排在第一页之前），后续页不受影响
+    response = client.post(
+        '/api/entries',
+        headers=auth_headers,
+        json={
+            'type': 'Transaction',
+            'date': '2021-06-30',
+            'narration': 'Inserted while paging',
+            'postings': [
+                {'account': 'Expenses:Food:Dining', 'amount': '1.00 CNY'},
+                {'account': 'Assets:Cash', 'amount': '-1.00 CNY'},
+            ],
+        },
+    )
+    assert response.status_code == 200
+
+    ids = [entry['id'] for entry in first['entries']]
+    cursor = first['pagination']['next_cursor']
+    while cursor:
+        body = client.get(
+            '/api/entries', headers=auth_headers, query_string={'page_size': 7, 'cursor': cursor}
+        ).get_json()
+        ids.extend(entry['id'] for entry in body['entries'])
+        cursor = body['pagination']['next_cursor']
+    assert ids == expected
+
+
+def serialized_entries(app_ledger):
+    """按接口默认顺序（日期降序）直接序列化的全部条目，不经过编码缓存"""
+    from app import app
+    from app.entries.routes import serialize_entry
+    from app.utils.ledger_index import entry_order_key
+
+    entries, _, _ = beancount.loader.load_file(app_ledger)
+    entries = sorted(sorted(entries, key=entry_order_key), key=lambda entry: entry.date, reverse=True)
+    with app.app_context():
+        # 与jsonify相同的编码规则（Decimal、日期等）
+        return [json.loads(app.json.dumps(serialize_entry(entry))) for entry in entries]
+
+
+def test_encoded_entries_match_serialize_entry_after_reload(client, auth_headers, app_ledger):
+    from app.utils.ledger_utils import get_entry_indexes, mark_ledger_changed
+
+    entries = client.get('/api/entries', headers=auth_headers, query_string={'page_size': 1000}).get_json()['entries']
+    assert entries == serialized_entries(app_ledger)
+    date_index, _ = get_entry_indexes()
+
+    # 修改已缓存编码的条目，重新加载后返回新内容而不是旧快照的编码
+    month_file = app_ledger.replace('main.bean', 'date/2021/2021-06.bean')
+    with open(month_file, encoding='utf-8') as f:
+        text = f.read()
+    with open(month_file, 'w', encoding='utf-8') as f:
+        f.write(text.replace('"Salary"', '"Salary (edited)"'))
+    mark_ledger_changed(wait_fresh=True)
+
+    assert get_entry_indexes()[0] is not date_index
+    entries = client.get('/api/entries', headers=auth_headers, query_string={'page_size': 1000}).get_json()['entries']
+    assert entries == serialized_entries(app_ledger)
+    assert 'Salary (edited)' in [entry.get('narration') for entry in entries]
+
+
+EXPORT_FILTERS = [
+    {},
+    {'account': 'Assets:Cash'},
+    {'account': 'Expenses', 'include_children': 'true', 'type': 'Transaction'},
+    {'type': 'Open'},
+    {'start_date': '2021-02-10', 'end_date': '2021-04-15', 'account': 'Assets:Bank:Checking'},
+    {'order': 'desc', 'end_date': '2021-03-01'},
+]
+
+
+def export_text(client, auth_headers, **params):
+    response = client.get('/api/entries/export', headers=auth_headers, query_string=params)
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('params', EXPORT_FILTERS)
+def test_ndjson_export_matches_entry_listing(client, auth_headers, params):
+    from app import app
+    from app.entries.routes import encode_entry
+    from app.utils.ledger_utils import get_entry_indexes
+
+    lines = export_text(client, auth_headers, format='ndjson', **params).splitlines()
+    listing = client.get(
+        '/api/entries', headers=auth_headers, query_string={'page_size': 1000, 'order': 'asc', **params}
+    ).get_json()['entries']
+    assert lines
+    assert [json.loads(line) for line in lines] == listing
+
+    # 每行即为该条目 encode_entry 的结果
+    date_index, _ = get_entry_indexes()
+    with app.app_context():
+        encoded = {json.loads(text)['id']: text for text in map(encode_entry, date_index.entries)}
+    assert lines == [encoded[entry['id']] for entry in listing]
+
+
+@pytest.mark.parametrize('params', EXPORT_FILTERS)
+def test_csv_export_rows(client, auth_headers, params):
+    rows = list(csv.reader(io.StringIO(export_text(client, auth_headers, format='csv', **params))))
+    assert rows[0] == ['id', 'date', 'type', 'narration', 'account', 'number', 'currency']
+
+    # 交易的每个记账行一行，Open等没有记账行的条目一行（没有金额）
+    expected = []
+    for line in export_text(client, auth_headers, format='ndjson', **params).splitlines():
+        entry = json.loads(line)
+        base = [entry['id'], entry['date'], entry['type'], entry.get('narration', '')]
+        if entry.get('postings'):
+            for posting in entry['postings']:
+                expected.append(base + [posting['account'], posting['units']['number'], posting['units']['currency']])
+        else:
+            expected.append(base + [entry.get('account', ''), '', ''])
+    assert rows[1:] == expected
+
+
+def test_csv_export_of_multi_posting_transactions_and_opens(client, auth_headers):
+    rows = list(csv.reader(io.StringIO(export_text(client, auth_headers, format='csv', end_date='2021-01-31'))))
+
+    opens = [row for row in rows if row[2] == 'Open']
+    assert {row[4] for row in opens} >= {'Assets:Cash', 'Income:Salary', 'Equity:Opening-Balances'}
+    assert all(row[1] == '2020-01-01' and row[3:] == ['', row[4], '', ''] for row in opens)
+
+    # 工资交易的两个记账行各占一行，自动补全的记账行也带有金额
+    salary = [row for row in rows if row[3] == 'Salary']
+    assert [row[4:] for row in salary] == [
+        ['Assets:Bank:Checking', '12000.00', 'CNY'],
+        ['Income:Salary', '-12000.00', 'CNY'],
+    ]
+    assert salary[0][:4] == salary[1][:4]
+    assert salary[0][1] == '2021-01-25'
+
+
+def test_export_rejects_unsupported_format(client, auth_headers):
+    response = client.get('/api/entries/export', headers=auth_headers, query_string={'format': 'xlsx'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Unsupported export format: xlsx'}
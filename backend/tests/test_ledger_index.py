@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from datetime import date, timedelta
+
+import beancount.loader
+import pytest
+
+from app.utils.ledger_index import EntryAccountIndex, EntryDateIndex, entry_accounts, entry_order_key
+
+
+@pytest.fixture
+def date_index(ledger_file):
+    entries, errors, _ = beancount.loader.load_file(ledger_file)
+    assert not errors
+    return EntryDateIndex(entries)
+
+
+def expected_positions(index, start_date, end_date):
+    return [
+        position
+        for position, entry in enumerate(index.entries)
+        if (start_date is None or entry.date >= start_date) and (end_date is None or entry.date <= end_date)
+    ]
+
+
+def empty_dates(index):
+    """首末条目之间没有条目的日期"""
+    dates = set(index.dates)
+    day, last = index.dates[0], index.dates[-1]
+    result = []
+    while day <= last:
+        if day not in dates:
+            result.append(day)
+        day += timedelta(days=1)
+    return result
+
+
+def test_entries_are_sorted_by_order_key(date_index):
+    keys = [entry_order_key(entry) for entry in date_index.entries]
+    assert keys == sorted(keys)
+    assert date_index.keys == keys
+
+
+def test_bounds_on_dates_without_entries(date_index):
+    gaps = empty_dates(date_index)
+    # 生成的账本每月29日之后没有条目
+    assert date(2021, 1, 30) in gaps
+    first, last = date_index.dates[0], date_index.dates[-1]
+    candidates = gaps[:3] + gaps[-3:] + [first - timedelta(days=10), last + timedelta(days=10), first, last, None]
+
+    for start_date in candidates:
+        for end_date in candidates:
+            lo, hi = date_index.bounds(start_date, end_date)
+            assert list(range(lo, hi)) == expected_positions(date_index, start_date, end_date)
+
+
+def test_bounds_of_empty_ranges(date_index):
+    first, last = date_index.dates[0], date_index.dates[-1]
+    # 起止日期都落在同一段空白内、早于全部条目、晚于全部条目、起始晚于结束
+    for start_date, end_date in [
+        (date(2021, 1, 29), date(2021, 1, 31)),
+        (first - timedelta(days=30), first - timedelta(days=1)),
+        (last + timedelta(days=1), last + timedelta(days=30)),
+        (date(2021, 3, 31), date(2021, 3, 1)),
+    ]:
+        lo, hi = date_index.bounds(start_date, end_date)
+        assert lo == hi
+        assert list(date_index.iter_range(start_date, end_date)) == []
+
+
+def test_iter_range_reverse_keeps_order_within_day(date_index):
+    start_date, end_date = date(2021, 2, 10), date(2021, 4, 15)
+    forward = list(date_index.iter_range(start_date, end_date))
+    backward = list(date_index.iter_range(start_date, end_date, reverse=True))
+    # 按日期稳定倒序：日期降序，同一天内保持原有顺序
+    assert backward == sorted(forward, key=lambda entry: entry.date, reverse=True)
+    assert backward != forward[::-1]
+
+
+def matching_entries(index, account, include_children, entry_type, start_date, end_date, reverse):
+    """逐条筛选并按日期稳定排序的期望结果"""
+    entries = []
+    for entry in index.entries:
+        if (start_date and entry.date < start_date) or (end_date and entry.date > end_date):
+            continue
+        if entry_type and type(entry).__name__ != entry_type:
+            continue
+        if account:
+            accounts = entry_accounts(entry)
+            if account not in accounts and not (
+                include_children and any(name.startswith(account + ':') for name in accounts)
+            ):
+                continue
+        entries.append(entry)
+    return sorted(entries, key=lambda entry: entry.date, reverse=reverse)
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+@pytest.mark.parametrize(
+    'account,include_children,entry_type',
+    [
+        ('Assets:Cash', False, None),
+        ('Assets', True, None),
+        ('Assets', True, 'Open'),
+        ('Expenses', True, 'Transaction'),
+        ('Assets:Bank:Checking', False, 'Transaction'),
+        (None, False, 'Open'),
+    ],
+)
+@pytest.mark.parametrize('start_date,end_date', [(None, None), (date(2021, 2, 10), date(2021, 4, 15))])
+def test_iter_subset_with_account_and_type_filters(
+    date_index, account, include_children, entry_type, start_date, end_date, reverse
+):
+    account_index = EntryAccountIndex(date_index)
+    expected = matching_entries(date_index, account, include_children, entry_type, start_date, end_date, reverse)
+    if entry_type != 'Open' or start_date is None:
+        assert expected
+
+    # 与条目列表接口相同的组合方式：账户倒排索引确定子集，类型在遍历时筛选
+    subset = account_index.positions(account, include_children) if account else account_index.by_type[entry_type]
+    lo, hi = date_index.bounds(start_date, end_date)
+    positions = [
+        position
+        for position in date_index.iter_subset(subset, lo, hi, reverse)
+        if entry_type is None or type(date_index.entries[position]).__name__ == entry_type
+    ]
+    assert [date_index.entries[position] for position in positions] == expected
+
+
+def test_account_positions_are_sorted_and_complete(date_index):
+    account_index = EntryAccountIndex(date_index)
+    for positions in [*account_index.by_account.values(), *account_index.by_prefix.values()]:
+        assert positions == sorted(set(positions))
+    # 父账户的位置列表是各子账户位置列表的并集
+    children = [positions for name, positions in account_index.by_account.items() if name.startswith('Expenses:')]
+    assert account_index.positions('Expenses', include_children=True) == sorted(set().union(*children))
+    assert account_index.positions('Expenses') == []
+    assert account_index.positions('Unknown:Account', include_children=True) == []
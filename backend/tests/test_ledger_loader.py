@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+
+import beancount.loader
+import pytest
+
+from app.utils.ledger_loader import LedgerLoader
+
+
+@pytest.fixture(autouse=True)
+def no_beancount_cache():
+    # beancount 自带的pickle缓存会掩盖文件变化
+    beancount.loader.initialize(use_cache=False)
+
+
+def assert_same_result(result, expected):
+    entries, errors, options = result
+    expected_entries, expected_errors, expected_options = expected
+    assert entries == expected_entries
+    assert [error.message for error in errors] == [error.message for error in expected_errors]
+    for key in ('title', 'operating_currency', 'include', 'input_hash'):
+        assert options[key] == expected_options[key]
+
+
+def test_load_matches_beancount(ledger_file):
+    loader = LedgerLoader()
+    result = loader.load_file(ledger_file)
+    assert len(result[0]) > 100
+    assert_same_result(result, beancount.loader.load_file(ledger_file))
+    assert loader.last_stats['reused_files'] == 0
+
+
+def test_reload_reparses_only_changed_files(ledger_file):
+    loader = LedgerLoader()
+    loader.load_file(ledger_file)
+
+    month_file = os.path.join(os.path.dirname(ledger_file), 'date', '2021', '2021-03.bean')
+    with open(month_file, 'a', encoding='utf-8') as f:
+        f.write('2021-03-30 * "Added"\n  Expenses:Travel  10.00 CNY\n  Assets:Cash\n')
+
+    result = loader.load_file(ledger_file)
+    assert loader.last_stats['parsed_files'] == 1
+    assert_same_result(result, beancount.loader.load_file(ledger_file))
+
+    # 没有变化时全部复用
+    assert_same_result(loader.load_file(ledger_file), beancount.loader.load_file(ledger_file))
+    assert loader.last_stats['parsed_files'] == 0
+
+
+def test_removed_include_is_dropped(ledger_file):
+    loader = LedgerLoader()
+    loader.load_file(ledger_file)
+    year_file = os.path.join(os.path.dirname(ledger_file), 'date', '2021', '2021.bean')
+    with open(year_file, encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(year_file, 'w', encoding='utf-8') as f:
+        f.writelines(lines[:-1])
+
+    result = loader.load_file(ledger_file)
+    assert_same_result(result, beancount.loader.load_file(ledger_file))
+    assert not any(filename.endswith('2021-06.bean') for filename in loader.file_hashes)
+
+
+def test_errors_match_beancount(tmp_path):
+    (tmp_path / 'main.bean').write_text(
+        'include "missing.bean"\n'
+        'include "other.bean"\n'
+        '2020-01-01 open Assets:Cash\n'
+        '2020-01-02 * "Unbalanced"\n'
+        '  Assets:Cash  10.00 CNY\n'
+        '  Expenses:Unknown  -5.00 CNY\n'
+    )
+    (tmp_path / 'other.bean').write_text('2020-01-01 open Expenses:Food\n2020-01-03 balance Assets:Cash  1 CNY\n')
+    ledger_file = str(tmp_path / 'main.bean')
+    result = LedgerLoader().load_file(ledger_file)
+    assert len(result[1]) >= 3
+    assert_same_result(result, beancount.loader.load_file(ledger_file))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import time
+
+from app.utils import ledger_store
+from app.utils.ledger_store import CacheWriter
+
+
+def make_snapshot(title):
+    return {
+        'entries': [],
+        'errors': [],
+        'options': {'title': title},
+        'include_structure': {},
+        'reverse_include': {},
+        'file_entries': {},
+        'year_month_files': {},
+    }
+
+
+def test_snapshot_round_trip(tmp_path):
+    ledger = tmp_path / 'main.bean'
+    ledger.write_text('option "title" "Test"\n')
+    cache_file = str(tmp_path / 'ledger.cache')
+    file_hashes = ledger_store.compute_file_hashes([str(ledger)])
+
+    ledger_store.save_snapshot(cache_file, make_snapshot('Test'), file_hashes)
+    snapshot, hashes = ledger_store.load_snapshot(cache_file)
+    assert snapshot['options'] == {'title': 'Test'}
+    assert hashes == file_hashes
+
+    # 任一文件变化后缓存失效
+    ledger.write_text('option "title" "Changed"\n')
+    assert ledger_store.load_snapshot(cache_file) is None
+
+
+def test_cache_writer_writes_only_latest_snapshot(tmp_path):
+    cache_file = str(tmp_path / 'ledger.cache')
+    writer = CacheWriter(delay=0.2)
+    writer.schedule(cache_file, make_snapshot('first'), {})
+    writer.schedule(cache_file, make_snapshot('second'), {})
+    assert not (tmp_path / 'ledger.cache').exists()
+
+    deadline = time.monotonic() + 5
+    while writer.written == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert writer.written == 1
+    assert ledger_store.load_snapshot(cache_file)[0]['options'] == {'title': 'second'}
+
+
+def test_cache_writer_flush(tmp_path):
+    cache_file = str(tmp_path / 'ledger.cache')
+    writer = CacheWriter(delay=60)
+    writer.schedule(cache_file, make_snapshot('pending'), {})
+    writer.flush()
+    assert writer.written == 1
+    assert ledger_store.load_snapshot(cache_file)[0]['options'] == {'title': 'pending'}
+    assert writer._thread is None
+
+    # 没有待写入的快照时不重复写入
+    writer.flush()
+    assert writer.written == 1
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+from app.utils import ledger_store
+from app.utils.ledger_utils import _changed_during_load
+from app.utils.ledger_watcher import LedgerWatcher
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture(params=['inotify', 'poll'])
+def watcher(request):
+    watcher = LedgerWatcher(mode=request.param, poll_interval=0.05)
+    try:
+        watcher.start()
+    except OSError:
+        pytest.skip('inotify is not available')
+    yield watcher
+    watcher.stop()
+
+
+def test_modified_file_bumps_version(watcher, tmp_path):
+    ledger = tmp_path / 'main.bean'
+    ledger.write_text('option "title" "Test"\n')
+    watcher.watch([str(ledger)])
+    time.sleep(0.1)
+
+    ledger.write_text('option "title" "Changed"\n')
+    assert wait_for(lambda: watcher.version >= 1)
+
+
+def test_unrelated_file_is_ignored(watcher, tmp_path):
+    ledger = tmp_path / 'main.bean'
+    ledger.write_text('')
+    watcher.watch([str(ledger)])
+    time.sleep(0.1)
+
+    (tmp_path / 'notes.txt').write_text('not part of the ledger')
+    time.sleep(0.3)
+    assert watcher.version == 0
+
+
+def test_file_in_directory_created_later(watcher, tmp_path):
+    # 被include的文件所在目录尚不存在（例如新年份的目录）
+    ledger = tmp_path / 'main.bean'
+    ledger.write_text('include "date/2027/2027.bean"\n')
+    included = tmp_path / 'date' / '2027' / '2027.bean'
+    watcher.watch([str(ledger), str(included)])
+    time.sleep(0.1)
+
+    included.parent.mkdir(parents=True)
+    included.write_text('2027-01-01 open Assets:Cash\n')
+    assert wait_for(lambda: watcher.version >= 1)
+
+    # 目录创建后继续监听该目录中的文件
+    version = watcher.version
+    time.sleep(0.2)
+    included.write_text('2027-01-01 open Assets:Bank\n')
+    assert wait_for(lambda: watcher.version > version)
+
+
+def test_changed_during_load_by_content_hash(tmp_path):
+    ledger = tmp_path / 'main.bean'
+    ledger.write_text('2020-01-01 open Assets:Cash\n')
+    hashes = {str(ledger): ledger_store.hash_file(str(ledger))}
+    assert not _changed_during_load([str(ledger)], hashes, time.time())
+
+    ledger.write_text('2020-01-01 open Assets:Bank\n')
+    assert _changed_during_load([str(ledger)], hashes, time.time())
+
+    # 加载时不存在、之后才创建的文件
+    created = tmp_path / 'new.bean'
+    assert not _changed_during_load([str(created)], hashes, time.time())
+    created.write_text('')
+    assert _changed_during_load([str(created)], hashes, time.time())
+
+
+def test_changed_during_load_by_mtime(tmp_path):
+    ledger = tmp_path / 'main.bean'
+    ledger.write_text('')
+    old = time.time() - 60
+    os.utime(ledger, (old, old))
+    assert not _changed_during_load([str(ledger)], None, time.time())
+    assert _changed_during_load([str(ledger)], None, old)
+
+
+def test_acknowledged_write_does_not_bump_twice(watcher, tmp_path):
+    ledger = tmp_path / 'main.bean'
+    ledger.write_text('')
+    watcher.watch([str(ledger)])
+    time.sleep(0.1)
+
+    # 应用自身写入：记录文件状态后立即递增版本号，随后到达的文件事件不再递增
+    with open(ledger, 'a') as f:
+        f.write('2020-01-01 open Assets:Cash\n')
+    watcher.acknowledge()
+    watcher.bump()
+    assert wait_for(lambda: watcher.ignored >= 1)
+    assert watcher.version == 1
+
+    # 之后的外部修改照常递增
+    with open(ledger, 'a') as f:
+        f.write('2020-01-01 open Assets:Bank\n')
+    assert wait_for(lambda: watcher.version == 2)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from app.utils.lru_cache import LRUCache, approximate_size
+
+
+def sized_cache(**kwargs):
+    # 值本身即为其字节数，便于精确控制内存上限
+    return LRUCache(sizeof=lambda value: value, **kwargs)
+
+
+def test_eviction_by_max_entries():
+    cache = sized_cache(max_entries=3, max_bytes=1000)
+    for key in 'abc':
+        cache.put(key, 1, 1)
+    # 访问 a 之后 b 成为最久未使用的条目
+    assert cache.get('a', 1) == 1
+    cache.put('d', 1, 1)
+
+    assert cache.get('b', 1) is None
+    assert [cache.get(key, 1) for key in 'acd'] == [1, 1, 1]
+    stats = cache.stats()
+    assert stats['entries'] == 3
+    assert stats['evictions'] == 1
+
+
+def test_eviction_by_max_bytes():
+    cache = sized_cache(max_entries=100, max_bytes=100)
+    cache.put('a', 40, 1)
+    cache.put('b', 40, 1)
+    cache.put('c', 40, 1)
+
+    assert cache.get('a', 1) is None
+    assert cache.stats()['bytes'] == 80
+    assert cache.stats()['evictions'] == 1
+
+    # 替换同一个键时按新值重新计算占用
+    cache.put('b', 10, 1)
+    assert cache.stats()['bytes'] == 50
+    assert cache.stats()['entries'] == 2
+
+
+def test_oversized_value_is_skipped():
+    cache = sized_cache(max_entries=10, max_bytes=100)
+    cache.put('a', 50, 1)
+    cache.put('huge', 101, 1)
+
+    assert cache.get('huge', 1) is None
+    # 已有的条目不会为放不下的值被淘汰
+    assert cache.get('a', 1) == 50
+    assert cache.stats()['evictions'] == 0
+    assert cache.stats()['bytes'] == 50
+
+
+def test_version_bump_purges_cache():
+    cache = sized_cache()
+    cache.put('a', 1, 1)
+    cache.put('b', 1, 1)
+
+    # 新版本的读取清空旧版本的全部结果
+    assert cache.get('a', 2) is None
+    stats = cache.stats()
+    assert stats['entries'] == 0
+    assert stats['bytes'] == 0
+    assert stats['version'] == 2
+    assert stats['purges'] == 1
+
+    # 新版本的写入同样会清空旧版本的结果
+    cache.put('c', 1, 2)
+    cache.put('d', 1, 3)
+    assert cache.get('c', 3) is None
+    assert cache.get('d', 3) == 1
+
+
+def test_stale_version_is_ignored():
+    cache = sized_cache()
+    cache.put('a', 1, 5)
+
+    # 旧快照的读者计算完成得较晚：结果直接丢弃，也不会清空新版本的缓存
+    cache.put('b', 1, 4)
+    assert cache.get('b', 5) is None
+    assert cache.get('a', 4) is None
+    assert cache.get('a', 5) == 1
+    assert cache.stats()['version'] == 5
+    assert cache.stats()['purges'] == 0
+
+
+def test_approximate_size_grows_with_content():
+    small = [('Assets:Cash', '1.00 CNY')]
+    large = small * 100
+    assert approximate_size(large) > approximate_size(small) * 50
+    assert approximate_size({'key': 'x' * 1000}) > 1000
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from collections import defaultdict
+from decimal import Decimal
+
+import beancount.loader
+import numpy as np
+import pytest
+from beancount.core import data
+
+from app.utils.posting_columns import PostingColumns
+
+
+@pytest.fixture
+def columns_and_postings(ledger_file):
+    entries, errors, _ = beancount.loader.load_file(ledger_file)
+    assert not errors
+    postings = [
+        posting
+        for entry in entries
+        if isinstance(entry, data.Transaction)
+        for posting in entry.postings
+        if posting.units is not None
+    ]
+    return PostingColumns(entries), postings
+
+
+def reference_sums(columns, postings, keys, rows):
+    """逐条累加 Decimal 的分组合计：{(键..., 币种): Decimal}"""
+    sums = defaultdict(Decimal)
+    for row in rows:
+        posting = postings[row]
+        sums[(*(int(key[row]) for key in keys), posting.units.currency)] += posting.units.number
+    return dict(sums)
+
+
+def grouped(columns, keys, rows):
+    group_keys, currencies, numbers, first_rows = columns.group_sums(keys, rows)
+    assert len(numbers) == len(currencies) == len(first_rows)
+    return {
+        (*(int(key) for key in row_keys), columns.currency_names[currency]): number
+        for *row_keys, currency, number in zip(*group_keys, currencies, numbers)
+    }
+
+
+def test_group_sums_match_decimal_reference(columns_and_postings):
+    columns, postings = columns_and_postings
+    assert len(columns) == len(postings)
+    rows = np.flatnonzero(columns.exact_rows())
+    assert 0 < len(rows) < len(columns)
+    for keys in ([columns.account], [columns.date, columns.account], [columns.entry]):
+        result = grouped(columns, keys, rows)
+        expected = reference_sums(columns, postings, keys, rows)
+        assert result == expected
+        # 小数位数同样与逐条累加的结果一致
+        assert {key: str(number) for key, number in result.items()} == {
+            key: str(number) for key, number in expected.items()
+        }
+
+
+def test_group_sums_with_keys_too_large_for_a_combined_int64(columns_and_postings):
+    columns, postings = columns_and_postings
+    rows = np.flatnonzero(columns.exact_rows())
+    # 各键的取值范围之积远超 int64，不能组合为一个整数键
+    large = columns.entry.astype(np.int64) * 2**40
+    keys = [large, columns.account.astype(np.int64) * 2**40, large]
+    assert grouped(columns, keys, rows) == reference_sums(columns, postings, keys, rows)
+
+
+def test_group_order_is_stable_across_both_sort_paths(columns_and_postings):
+    columns, _ = columns_and_postings
+    rows = np.flatnonzero(columns.exact_rows())
+    small = columns._sort_groups([columns.account, columns.date], rows)
+    # 放大键值，使组合键超出 int64 范围
+    wide_account = columns.account.astype(np.int64) * 2**40
+    wide_date = columns.date.astype(np.int64) * 2**30
+    large = columns._sort_groups([wide_account, wide_date], rows)
+    # 两种排序方式得到相同的行顺序和分组
+    assert np.array_equal(small[0], large[0])
+    assert np.array_equal(small[1], large[1])
+
+
+def test_float_sums_match_group_sums(columns_and_postings):
+    columns, _ = columns_and_postings
+    rows = np.flatnonzero(columns.exact_rows())
+    keys = [columns.date, columns.account]
+    exact = columns.group_sums(keys, rows)
+    approximate = columns.float_sums(keys, rows)
+    assert np.array_equal(exact[1], approximate[1])
+    assert np.allclose([float(number) for number in exact[2]], approximate[2])
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import beancount.loader
+import beanquery
+import beanquery.query
+import pytest
+
+from app.utils.query_plans import QueryPlanCache, normalize_query, run_query
+
+
+def test_dates_become_named_params():
+    text, params = normalize_query(
+        'SELECT  account,\n  sum(position)\nWHERE date >= 2021-02-01   AND date <= 2021-03-31 GROUP BY account'
+    )
+    assert text == 'SELECT account, sum(position) WHERE date >= %(d0)s AND date <= %(d1)s GROUP BY account'
+    assert params == {'d0': datetime.date(2021, 2, 1), 'd1': datetime.date(2021, 3, 31)}
+
+
+def test_queries_differing_only_in_dates_share_text():
+    first = normalize_query('SELECT account WHERE date >= 2021-01-01')
+    second = normalize_query('SELECT account\tWHERE  date >= 2024-12-31 ')
+    assert first[0] == second[0]
+    assert first[1] != second[1]
+
+
+def test_strings_are_left_untouched():
+    text, params = normalize_query(
+        "SELECT narration WHERE narration = 'paid  on 2021-01-01' AND payee ~ \"a  b\" AND date > 2021-01-01"
+    )
+    assert text == "SELECT narration WHERE narration = 'paid  on 2021-01-01' AND payee ~ \"a  b\" AND date > %(d0)s"
+    assert params == {'d0': datetime.date(2021, 1, 1)}
+
+    # 单引号字符串中用两个单引号表示单引号
+    text, params = normalize_query("SELECT narration WHERE narration = 'it''s 2021-01-01'")
+    assert text == "SELECT narration WHERE narration = 'it''s 2021-01-01'"
+    assert params == {}
+
+
+@pytest.mark.parametrize('keyword', ['ON', 'on', 'On'])
+def test_dates_after_on_stay_literal(keyword):
+    text, params = normalize_query(f'SELECT account FROM OPEN {keyword}  2021-01-01 CLOSE {keyword} 2021-12-31')
+    assert text == f'SELECT account FROM OPEN {keyword} 2021-01-01 CLOSE {keyword} 2021-12-31'
+    assert params == {}
+
+    text, params = normalize_query('SELECT account FROM OPEN ON 2021-01-01 WHERE date < 2021-06-01')
+    assert text == 'SELECT account FROM OPEN ON 2021-01-01 WHERE date < %(d0)s'
+    assert params == {'d0': datetime.date(2021, 6, 1)}
+
+
+def test_invalid_dates_and_date_like_tokens_stay_literal():
+    text, params = normalize_query('SELECT account WHERE date > 2021-13-45 AND x = 2021-01-01.5 AND y = a2021-01-01')
+    assert text == 'SELECT account WHERE date > 2021-13-45 AND x = 2021-01-01.5 AND y = a2021-01-01'
+    assert params == {}
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        'SELECT account WHERE date > 2021-01-01; SELECT 1',
+        'SELECT account WHERE date > %s',
+        'SELECT account /* comment */ WHERE date > 2021-01-01',
+        "SELECT account WHERE narration = 'unbalanced AND date > 2021-01-01",
+        'SELECT account WHERE narration = "unbalanced',
+    ],
+)
+def test_unsafe_queries_are_not_normalized(query):
+    assert normalize_query(query) == (query, None)
+
+
+def test_percent_inside_string_is_allowed():
+    text, params = normalize_query("SELECT account WHERE narration ~ '100%' AND date > 2021-01-01")
+    assert text == "SELECT account WHERE narration ~ '100%' AND date > %(d0)s"
+    assert params == {'d0': datetime.date(2021, 1, 1)}
+
+
+@pytest.fixture
+def ledger(ledger_file):
+    entries, errors, options = beancount.loader.load_file(ledger_file)
+    assert not errors
+    return entries, options
+
+
+@pytest.mark.parametrize(
+    'query',
+    [
+        'SELECT account, sum(position) WHERE date >= 2021-02-01 AND date <= 2021-03-31 GROUP BY account ORDER BY account',
+        'SELECT year, month, root(account, 1) AS account, sum(cost(position)) GROUP BY year, month, account',
+        "SELECT date, narration WHERE narration ~ 'Purchase' AND date = 2021-03-26 ORDER BY date",
+        'SELECT account FROM OPEN ON 2021-03-01 CLOSE ON 2021-04-01 WHERE date < 2021-03-15',
+        "SELECT account WHERE narration ~ '100%'",
+    ],
+)
+def test_run_query_matches_beanquery(ledger, query):
+    entries, options = ledger
+    columns, rows = run_query(entries, options, query)
+    expected_columns, expected_rows = beanquery.query.run_query(entries, options, query)
+    assert [column.name for column in columns] == [column.name for column in expected_columns]
+    assert rows == expected_rows
+    # 使用缓存的语法树再次执行，结果不变
+    assert run_query(entries, options, query)[1] == expected_rows
+
+
+def test_plan_cache_is_shared_by_queries_with_different_dates():
+    cache = QueryPlanCache()
+    first, first_params = cache.get('SELECT account WHERE date >= 2021-01-01')
+    second, second_params = cache.get('SELECT account  WHERE date >= 2022-06-30')
+    assert second is first
+    assert first_params == {'d0': datetime.date(2021, 1, 1)}
+    assert second_params == {'d0': datetime.date(2022, 6, 30)}
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_plan_cache_reports_syntax_errors():
+    with pytest.raises(beanquery.ParseError):
+        QueryPlanCache().get('SELEC broken WHERE date > 2021-01-01')
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+from app.utils import query_pool as query_pool_module
+from app.utils.query_pool import QueryPool, QueryTimeout, execute_query
+
+QUERY = 'SELECT account, sum(position) AS total GROUP BY account ORDER BY account'
+
+
+@pytest.fixture
+def pools():
+    """创建的进程池在测试结束后关闭（派生进程随之退出）"""
+    created = []
+
+    def create(*args, **kwargs):
+        pool = QueryPool(*args, **kwargs)
+        created.append(pool)
+        return pool
+
+    yield create
+    for pool in created:
+        pool.close()
+
+
+def test_query_in_worker_matches_inline(app_ledger, pools):
+    from app.utils import ledger_utils
+
+    snapshot = ledger_utils.get_ledger_snapshot()
+    pool = pools(size=1, timeout=30)
+    pool.start(snapshot, ledger_utils._load_query_ledger)
+
+    expected = execute_query(snapshot['entries'], snapshot['options'], QUERY, pool.max_rows)
+    assert pool.run(snapshot, QUERY) == expected
+    # 第二次查询复用空闲的查询进程
+    assert pool.run(snapshot, QUERY) == expected
+    stats = pool.stats()
+    assert stats['started'] == 1
+    assert stats['executed'] == 2
+    assert stats['spawner'] is not None
+
+
+def test_spawner_reloads_ledger_after_change(app_ledger, pools):
+    from app.utils import ledger_utils
+
+    pool = pools(size=1, timeout=30)
+    pool.start(ledger_utils.get_ledger_snapshot(), ledger_utils._load_query_ledger)
+    assert pool.run(ledger_utils.get_ledger_snapshot(), QUERY)
+
+    with open(app_ledger.replace('main.bean', 'date/2021/2021-06.bean'), 'a', encoding='utf-8') as f:
+        f.write('\n2021-06-30 * "Added"\n  Expenses:Unseen  1.00 CNY\n  Assets:Cash\n')
+    with open(app_ledger.replace('main.bean', 'accounts.bean'), 'a', encoding='utf-8') as f:
+        f.write('2020-01-01 open Expenses:Unseen\n')
+    ledger_utils.mark_ledger_changed()
+    snapshot = ledger_utils.get_ledger_snapshot(wait_fresh=True)
+
+    headers, rows, _ = pool.run(snapshot, QUERY)
+    assert ['Expenses:Unseen', '(1.00 CNY)'] in rows
+    assert (headers, rows, False) == execute_query(snapshot['entries'], snapshot['options'], QUERY, pool.max_rows)
+    # 持有旧账本的空闲查询进程被回收
+    assert pool.stats()['started'] == 2
+    assert pool.stats()['idle'] == 1
+
+
+def test_loader_failure_is_reported(pools):
+    def failing_loader():
+        raise OSError('ledger is gone')
+
+    pool = pools(size=1, timeout=30)
+    pool.start(None, failing_loader)
+    with pytest.raises(ValueError, match='ledger is gone'):
+        pool.run({'version': 1, 'entries': [], 'options': {}}, QUERY)
+    assert pool.stats()['failed'] == 1
+
+
+def test_pool_not_started_runs_inline(app_ledger):
+    from app.utils import ledger_utils
+
+    snapshot = ledger_utils.get_ledger_snapshot()
+    pool = QueryPool(size=1, timeout=30)
+    assert pool.run(snapshot, QUERY) == execute_query(snapshot['entries'], snapshot['options'], QUERY, pool.max_rows)
+    assert pool.stats()['spawner'] is None
+
+
+def test_timed_out_query_returns_504(client, auth_headers, monkeypatch, pools):
+    from app.ledger import routes
+    from app.utils import ledger_utils
+
+    def slow_query(entries, options, query, max_rows):
+        time.sleep(60)
+
+    # 派生进程fork时继承替换后的函数
+    monkeypatch.setattr(query_pool_module, 'execute_query', slow_query)
+    pool = pools(size=1, timeout=0.5)
+    pool.start(ledger_utils.get_ledger_snapshot(), ledger_utils._load_query_ledger)
+    monkeypatch.setattr(routes, 'query_pool', pool)
+
+    started_at = time.monotonic()
+    response = client.post('/api/ledger/query', headers=auth_headers, json={'query': QUERY})
+    assert response.status_code == 504
+    assert time.monotonic() - started_at < 5
+    assert pool.stats()['timed_out'] == 1
+    # 执行超时查询的进程已被结束，不会回到空闲列表
+    assert pool.stats()['idle'] == 0
+
+
+def test_timed_out_worker_is_killed(app_ledger, monkeypatch, pools):
+    from app.utils import ledger_utils
+
+    def slow_query(entries, options, query, max_rows):
+        time.sleep(60)
+
+    monkeypatch.setattr(query_pool_module, 'execute_query', slow_query)
+    pool = pools(size=1, timeout=0.5)
+    pool.start(ledger_utils.get_ledger_snapshot(), ledger_utils._load_query_ledger)
+
+    workers = []
+    spawn = query_pool_module._Spawner.spawn
+
+    def recording_spawn(self, *args):
+        worker = spawn(self, *args)
+        workers.append(worker.pid)
+        return worker
+
+    monkeypatch.setattr(query_pool_module._Spawner, 'spawn', recording_spawn)
+    with pytest.raises(QueryTimeout):
+        pool.run(ledger_utils.get_ledger_snapshot(), QUERY)
+
+    # 由派生进程回收
+    for _ in range(50):
+        try:
+            os.kill(workers[0], 0)
+        except ProcessLookupError:
+            break
+        time.sleep(0.1)
+    else:
+        pytest.fail('timed out query process is still running')
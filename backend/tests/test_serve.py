@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import serve
+
+
+def load_server(mode):
+    application, options = serve.build_server(mode)
+    return application, serve.MoneyMintServer(application, options)
+
+
+def test_wsgi_server_config():
+    from app import app
+
+    application, server = load_server('wsgi')
+    assert application is app
+    assert server.load() is app
+    cfg = server.cfg
+    assert cfg.worker_class_str == 'gthread'
+    assert cfg.threads == serve.SERVER_THREADS
+    assert cfg.workers == serve.SERVER_WORKERS
+    assert cfg.timeout == serve.SERVER_TIMEOUT
+    # 账本在主进程中预热，fork后由工作进程共享
+    assert cfg.preload_app
+    assert cfg.post_fork is serve.post_fork
+    assert cfg.worker_exit is serve.worker_exit
+    assert cfg.on_exit is serve.on_exit
+
+
+def test_asgi_server_config():
+    from app.asgi import application as asgi_application
+
+    application, server = load_server('asgi')
+    assert application is asgi_application
+    cfg = server.cfg
+    # uvicorn.workers 已弃用，使用 uvicorn-worker 包提供的工作进程类
+    assert cfg.worker_class_str == 'uvicorn_worker.UvicornWorker'
+    assert cfg.preload_app
+    assert cfg.post_fork is serve.post_fork
+
+    pytest.importorskip('uvicorn_worker')
+    assert cfg.worker_class.__module__.startswith('uvicorn_worker')
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from app.utils.single_flight import SingleFlight
+
+WAITERS = 8
+
+
+def run_concurrently(flight, key, func):
+    """同时发起 WAITERS 个相同键的调用，返回各调用的结果或异常"""
+    outcomes = [None] * WAITERS
+
+    def call(index):
+        try:
+            outcomes[index] = ('ok', flight.do(key, func))
+        except Exception as e:
+            outcomes[index] = ('error', e)
+
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(WAITERS)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for_waiters(flight):
+    # 等到其余调用方都已加入进行中的计算
+    for _ in range(500):
+        if flight.stats()['shared'] == WAITERS - 1:
+            return
+        threading.Event().wait(0.01)
+    pytest.fail('callers did not join the in-flight call')
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return {'rows': [1, 2, 3]}
+
+    threads, outcomes = run_concurrently(flight, 'query', compute)
+    wait_for_waiters(flight)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    results = [result for status, result in outcomes if status == 'ok']
+    assert len(results) == WAITERS
+    # 所有调用方拿到同一个结果对象
+    assert all(result is results[0] for result in results)
+    assert flight.stats() == {'executed': 1, 'shared': WAITERS - 1, 'in_flight': 0}
+
+
+def test_exception_propagates_to_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        raise ValueError('syntax error')
+
+    threads, outcomes = run_concurrently(flight, 'query', compute)
+    wait_for_waiters(flight)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert [status for status, _ in outcomes] == ['error'] * WAITERS
+    assert all(isinstance(error, ValueError) and str(error) == 'syntax error' for _, error in outcomes)
+    assert flight.stats()['in_flight'] == 0
+
+    # 失败的计算不会被缓存，之后的调用重新执行
+    assert flight.do('query', lambda: 'ok') == 'ok'
+    assert flight.stats()['executed'] == 2
+
+
+def test_different_keys_do_not_wait_for_each_other():
+    flight = SingleFlight()
+    release = threading.Event()
+    threads, _ = run_concurrently(flight, 'slow', lambda: release.wait(5))
+    try:
+        assert flight.do('fast', lambda: 42) == 42
+    finally:
+        release.set()
+        for thread in threads:
+            thread.join()
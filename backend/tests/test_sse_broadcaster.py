@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from app.utils.sse_broadcaster import CLOSED, SseBroadcaster
+
+
+def publish_events(broadcaster, count, start=0):
+    return [broadcaster.publish({'event': 'entry_added', 'data': {'n': n}}) for n in range(start, start + count)]
+
+
+def drain(subscription):
+    events = []
+    while True:
+        event = subscription.get(timeout=0)
+        if event is None:
+            return events
+        events.append(event)
+
+
+def test_replay_after_last_event_id():
+    broadcaster = SseBroadcaster(queue_size=10, replay_size=10)
+    ids = publish_events(broadcaster, 5)
+
+    subscription, missed = broadcaster.subscribe(last_event_id=ids[1])
+    assert [event['id'] for event in missed] == ids[2:]
+    assert [event['data']['n'] for event in missed] == [2, 3, 4]
+
+    # 补发的事件与订阅后的新事件衔接，没有重复
+    later = publish_events(broadcaster, 2, start=5)
+    assert [event['id'] for event in drain(subscription)] == later
+
+
+def test_replay_up_to_date_client():
+    broadcaster = SseBroadcaster(queue_size=10, replay_size=10)
+    ids = publish_events(broadcaster, 3)
+    _, missed = broadcaster.subscribe(last_event_id=ids[-1])
+    assert missed == []
+
+
+def test_replay_not_possible_requires_full_sync():
+    broadcaster = SseBroadcaster(queue_size=10, replay_size=3)
+    ids = publish_events(broadcaster, 6)
+    epoch, _, sequence = ids[-1].rpartition(':')
+
+    # 超出缓冲区、其他纪元（服务已重启）、未来的序号和无效的ID都无法补发
+    for last_event_id in [ids[0], ids[1], f'other:{sequence}', f'{epoch}:{int(sequence) + 1}', f'{epoch}:x', 'x']:
+        _, missed = broadcaster.subscribe(last_event_id=last_event_id)
+        assert missed is None, last_event_id
+
+    # 缓冲区中最旧事件之前的一个事件仍可补发
+    _, missed = broadcaster.subscribe(last_event_id=ids[2])
+    assert [event['id'] for event in missed] == ids[3:]
+
+    _, missed = broadcaster.subscribe()
+    assert missed is None
+
+
+def test_events_from_other_processes_are_replayed_in_order():
+    broadcaster = SseBroadcaster(queue_size=10, replay_size=10)
+    broadcaster.use_shared_sequence('shared', None)
+    for sequence in [1, 2, 4, 3, 5]:
+        broadcaster.publish({'event': 'entry_added', 'data': {}}, event_id=f'shared:{sequence}')
+
+    _, missed = broadcaster.subscribe(last_event_id='shared:1')
+    assert [event['id'] for event in missed] == ['shared:2', 'shared:3', 'shared:4', 'shared:5']
+
+
+def test_overflow_drop_keeps_newest_events():
+    broadcaster = SseBroadcaster(queue_size=3, policy='drop')
+    subscription, _ = broadcaster.subscribe()
+    ids = publish_events(broadcaster, 5)
+
+    assert [event['id'] for event in drain(subscription)] == ids[2:]
+    assert subscription.dropped == 2
+    assert not subscription.closed
+    assert broadcaster.disconnected == 0
+    assert len(broadcaster) == 1
+
+
+def test_overflow_disconnect_closes_slow_subscriber():
+    broadcaster = SseBroadcaster(queue_size=3, policy='disconnect')
+    slow, _ = broadcaster.subscribe()
+    publish_events(broadcaster, 3)
+    fast, _ = broadcaster.subscribe()
+    publish_events(broadcaster, 1, start=3)
+
+    # 积压的事件被清空，读取端收到断开标记
+    assert slow.closed
+    assert slow.get(timeout=0) is CLOSED
+    assert broadcaster.disconnected == 1
+    assert len(broadcaster) == 1
+    assert [event['data']['n'] for event in drain(fast)] == [3]
+
+
+def test_async_subscription_overflow():
+    async def run():
+        loop = asyncio.get_running_loop()
+        dropping = SseBroadcaster(queue_size=2, policy='drop')
+        subscription, _ = dropping.subscribe(loop=loop)
+        ids = publish_events(dropping, 4)
+        received = [await subscription.get(timeout=1), await subscription.get(timeout=1)]
+        assert [event['id'] for event in received] == ids[2:]
+        assert subscription.dropped == 2
+        assert await subscription.get(timeout=0.01) is None
+
+        disconnecting = SseBroadcaster(queue_size=2, policy='disconnect')
+        subscription, _ = disconnecting.subscribe(loop=loop)
+        publish_events(disconnecting, 3)
+        assert await subscription.get(timeout=1) is CLOSED
+        assert disconnecting.disconnected == 1
+
+    asyncio.run(run())
+
+
+def test_bus_messages_do_not_block_receiver(app_ledger, monkeypatch):
+    import threading
+
+    from app.utils import ledger_utils
+
+    # 记录在当前线程（相当于总线接收线程）中等待快照的调用
+    waits = []
+    get_ledger_snapshot = ledger_utils.get_ledger_snapshot
+
+    def recording_get_ledger_snapshot(*args, **kwargs):
+        waits.append(threading.get_ident())
+        return get_ledger_snapshot(*args, **kwargs)
+
+    monkeypatch.setattr(ledger_utils, 'get_ledger_snapshot', recording_get_ledger_snapshot)
+    version = ledger_utils.ledger_watcher.version
+    subscription, _ = ledger_utils.sse_broadcaster.subscribe()
+    try:
+        ledger_utils._on_bus_message({'type': 'bump'})
+        message = {'type': 'event', 'id': 'other:7', 'event': 'entry_added', 'data': {'id': 'x'}}
+        ledger_utils._on_bus_message(message)
+        assert ledger_utils.ledger_watcher.version > version
+        assert threading.get_ident() not in waits
+        # 事件进入分发队列，尚未发布
+        assert subscription.get(timeout=0) is None
+        assert ledger_utils._bus_events.get_nowait() is message
+
+        ledger_utils._publish_bus_event(message)
+        event = subscription.get(timeout=0)
+        assert event['event'] == 'entry_added'
+        assert event['id'].endswith(':7')
+        # 发布前已等待包含本次修改的快照
+        assert ledger_utils.ledger_cache['version'] > version
+    finally:
+        ledger_utils.sse_broadcaster.unsubscribe(subscription)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import beancount.loader
+import beanquery.query
+import pytest
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.number import D
+
+from app.utils.posting_columns import PostingColumns
+from app.utils.stats_engine import StatsEngine, account_matcher
+
+DATE_RANGES = [
+    (None, None),
+    (datetime.date(2021, 2, 1), datetime.date(2021, 4, 30)),
+    # 起止不在月初/月末，边界月份按日汇总
+    (datetime.date(2021, 2, 10), datetime.date(2021, 4, 15)),
+    (datetime.date(2021, 3, 26), datetime.date(2021, 3, 26)),
+]
+
+
+@pytest.fixture
+def ledger(ledger_file):
+    entries, errors, options = beancount.loader.load_file(ledger_file)
+    assert not errors
+    return entries, options
+
+
+def query_totals(entries, options, start_date, end_date, pattern=None, depth=None):
+    """用 beanquery 计算按 (年, 月, 账户) 分组的 sum(position) 和 sum(cost(position))"""
+    account = 'account' if depth is None else f'root(account, {depth})'
+    conditions = []
+    if start_date is not None:
+        conditions.append(f'date >= {start_date}')
+    if end_date is not None:
+        conditions.append(f'date <= {end_date}')
+    query = f'SELECT year, month, {account} AS account, sum(position) AS units, sum(cost(position)) AS cost'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' GROUP BY year, month, account ORDER BY year, month, account'
+    _, rows = beanquery.query.run_query(entries, options, query)
+    return [
+        ((year, month, account), (units, cost))
+        for year, month, account, units, cost in rows
+        if pattern is None or account_matcher(pattern)(account)
+    ]
+
+
+def engine_totals(engine, start_date, end_date, pattern=None, depth=None):
+    match = account_matcher(pattern) if pattern else None
+    return [(key, (totals.units, totals.cost)) for key, totals in engine.aggregate(start_date, end_date, match, depth)]
+
+
+def engines(entries):
+    """逐条构建和由列式记账行向量化构建的引擎"""
+    return [StatsEngine(entries), StatsEngine(entries, columns=PostingColumns(entries))]
+
+
+@pytest.mark.parametrize('start_date,end_date', DATE_RANGES)
+@pytest.mark.parametrize('depth', [None, 1, 2])
+def test_aggregate_matches_beanquery(ledger, start_date, end_date, depth):
+    entries, options = ledger
+    expected = query_totals(entries, options, start_date, end_date, depth=depth)
+    assert expected
+    for engine in engines(entries):
+        assert engine_totals(engine, start_date, end_date, depth=depth) == expected
+
+
+def test_aggregate_with_account_filter(ledger):
+    entries, options = ledger
+    for pattern in ['Expenses:*', 'assets:broker', 'Cash|CreditCard']:
+        expected = query_totals(entries, options, None, None, pattern=pattern)
+        assert expected
+        for engine in engines(entries):
+            assert engine_totals(engine, None, None, pattern=pattern) == expected
+
+
+def test_multi_currency_and_cost_totals(ledger):
+    entries, options = ledger
+    for engine in engines(entries):
+        totals = engine.account_totals(match=account_matcher('^Assets:Broker$'))['Assets:Broker']
+        # 持仓按成本记账：units 为 STK，cost 为 USD
+        assert {position.units.currency for position in totals.units} == {'STK'}
+        assert {position.units.currency for position in totals.cost} == {'USD'}
+        food = engine.account_totals(match=account_matcher('^Expenses:Food:Dining$'))['Expenses:Food:Dining']
+        assert {position.units.currency for position in food.units} == {'CNY', 'USD'}
+
+
+def new_transaction(day, number, narration='Added'):
+    meta = data.new_metadata('<test>', 0)
+    return data.Transaction(
+        meta,
+        day,
+        '*',
+        'Shop',
+        narration,
+        data.EMPTY_SET,
+        data.EMPTY_SET,
+        [
+            data.Posting('Expenses:Travel', Amount(D(number), 'CNY'), None, None, None, None),
+            data.Posting('Assets:Cash', Amount(-D(number), 'CNY'), None, None, None, None),
+        ],
+    )
+
+
+def snapshot_totals(engine):
+    return [(key, (totals.units, totals.cost)) for key, totals in engine.aggregate()]
+
+
+def test_updated_with_added_transactions(ledger):
+    entries, options = ledger
+    for engine in engines(entries):
+        # 追加到末尾，以及插入到中间的新交易（例如补记较早日期的交易）
+        new_entries = list(entries) + [new_transaction(datetime.date(2021, 3, 5), '12.34')]
+        new_entries.insert(len(entries) // 2, new_transaction(datetime.date(2021, 1, 7), '56.78'))
+
+        updated = engine.updated(new_entries)
+        assert updated is not None
+        assert snapshot_totals(updated) == snapshot_totals(StatsEngine(new_entries))
+        assert updated.aggregate() != engine.aggregate()
+        # 旧引擎不受影响（与新构建的引擎比较，而不是与共享的 Totals 对象比较），旧快照的读者仍看到原来的结果
+        assert snapshot_totals(engine) == snapshot_totals(StatsEngine(entries))
+
+
+def test_updated_returns_none_on_edit_or_delete(ledger):
+    entries, options = ledger
+    positions = [i for i, entry in enumerate(entries) if isinstance(entry, data.Transaction)]
+    for engine in engines(entries):
+        # 删除交易
+        deleted = list(entries)
+        del deleted[positions[3]]
+        assert engine.updated(deleted) is None
+
+        # 修改交易（条目数不变）
+        edited = list(entries)
+        edited[positions[3]] = edited[positions[3]]._replace(narration='Edited')
+        assert engine.updated(edited) is None
+
+        # 修改交易的同时新增交易（交易数增加，但原有交易有改动）
+        edited.append(new_transaction(datetime.date(2021, 3, 5), '1.00'))
+        assert engine.updated(edited) is None
+
+        # 条目未变化时派生的引擎与原引擎一致
+        assert snapshot_totals(engine.updated(list(entries))) == snapshot_totals(engine)
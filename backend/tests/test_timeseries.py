@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+import beancount.loader
+import pytest
+from beancount.core import data
+from beancount.core.amount import Amount
+from beancount.core.number import D
+
+from app.utils.posting_columns import PostingColumns
+from app.utils.posting_frame import build_posting_frame, posting_timeseries
+from app.utils.stats_engine import account_root
+
+
+@pytest.fixture
+def entries(ledger_file):
+    entries, errors, _ = beancount.loader.load_file(ledger_file)
+    assert not errors
+    return entries
+
+
+def period_start(day, interval):
+    if interval == 'daily':
+        return day
+    if interval == 'weekly':
+        # W-SUN 周期以周日结束，起始日为周一
+        return day - datetime.timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def next_period(start, interval):
+    if interval == 'daily':
+        return start + datetime.timedelta(days=1)
+    if interval == 'weekly':
+        return start + datetime.timedelta(days=7)
+    return (start + datetime.timedelta(days=31)).replace(day=1)
+
+
+def period_range(first, last, interval):
+    periods = [period_start(first, interval)]
+    while periods[-1] < period_start(last, interval):
+        periods.append(next_period(periods[-1], interval))
+    return periods
+
+
+def reference_series(entries, prefix, currency, interval, start_date=None, end_date=None, depth=None):
+    """逐条累加 Decimal：({序列名: {周期起始日: 金额}}, 匹配的记账日期列表)"""
+    sums = defaultdict(lambda: defaultdict(Decimal))
+    dates = []
+    for entry in entries:
+        if not isinstance(entry, data.Transaction):
+            continue
+        if (start_date and entry.date < start_date) or (end_date and entry.date > end_date):
+            continue
+        for posting in entry.postings:
+            account = posting.account
+            if posting.units.currency != currency or not (account == prefix or account.startswith(prefix + ':')):
+                continue
+            name = prefix if depth is None else account_root(account, depth)
+            sums[name][period_start(entry.date, interval)] += posting.units.number
+            dates.append(entry.date)
+    return sums, dates
+
+
+def timeseries(entries, prefixes, currency='CNY', interval='monthly', start_date=None, end_date=None, depth=None):
+    columns = PostingColumns(entries)
+    return posting_timeseries(
+        build_posting_frame(columns), columns, prefixes, currency, interval, start_date, end_date, depth
+    )
+
+
+@pytest.mark.parametrize('interval', ['daily', 'weekly', 'monthly'])
+@pytest.mark.parametrize('start_date,end_date', [(None, None), (datetime.date(2021, 2, 3), datetime.date(2021, 4, 15))])
+def test_intervals_match_decimal_reference(entries, interval, start_date, end_date):
+    prefixes = ['Expenses', 'Assets:Cash']
+    periods, series = timeseries(entries, prefixes, 'CNY', interval, start_date, end_date)
+
+    references = {
+        prefix: reference_series(entries, prefix, 'CNY', interval, start_date, end_date) for prefix in prefixes
+    }
+    # 未指定起止日期时，周期范围覆盖全部前缀匹配的记账行
+    dates = [day for _, prefix_dates in references.values() for day in prefix_dates]
+    expected_periods = period_range(start_date or min(dates), end_date or max(dates), interval)
+    assert periods == [str(period) for period in expected_periods]
+
+    assert [prefix for prefix, _, _, _ in series] == prefixes
+    for prefix, name, values, total in series:
+        assert name == prefix
+        sums, _ = references[prefix]
+        assert values == [float(sums[prefix][period]) for period in expected_periods]
+        assert total == pytest.approx(float(sum(sums[prefix].values())))
+
+
+def test_weekly_periods_start_on_monday(entries):
+    periods, _ = timeseries(entries, ['Expenses'], interval='weekly')
+    starts = [datetime.date.fromisoformat(period) for period in periods]
+    assert all(start.weekday() == 0 for start in starts)
+    assert all(later - earlier == datetime.timedelta(days=7) for earlier, later in zip(starts, starts[1:]))
+
+
+def test_prefix_matches_whole_account_components(entries):
+    meta = data.new_metadata('<test>', 0)
+    lookalike = data.Transaction(
+        meta,
+        datetime.date(2021, 3, 5),
+        '*',
+        'Shop',
+        'Lookalike',
+        data.EMPTY_SET,
+        data.EMPTY_SET,
+        [
+            data.Posting('Expenses:Foodie', Amount(D('7.00'), 'CNY'), None, None, None, None),
+            data.Posting('Assets:Cash', Amount(D('-7.00'), 'CNY'), None, None, None, None),
+        ],
+    )
+    before = timeseries(entries, ['Expenses:Food', 'Expenses:Food:Dining'])
+    after = timeseries(entries + [lookalike], ['Expenses:Food', 'Expenses:Food:Dining'])
+    # Expenses:Foodie 不是 Expenses:Food 的子账户
+    assert after == before
+
+    _, series = timeseries(entries, ['Expenses:Food', 'Expenses:Food:Dining', 'Expenses:Food:Groceries'])
+    food, dining, groceries = (values for _, _, values, _ in series)
+    assert food == pytest.approx([a + b for a, b in zip(dining, groceries)])
+
+
+def test_depth_splits_series_by_subaccount(entries):
+    _, [(_, _, values, total)] = timeseries(entries, ['Expenses'])
+    periods, series = timeseries(entries, ['Expenses'], depth=2)
+
+    names = [name for _, name, _, _ in series]
+    assert names == ['Expenses:Food', 'Expenses:Transport', 'Expenses:Travel']
+    assert all(prefix == 'Expenses' for prefix, _, _, _ in series)
+    sums, _ = reference_series(entries, 'Expenses', 'CNY', 'monthly', depth=2)
+    for _, name, series_values, _ in series:
+        assert series_values == [float(sums[name][datetime.date.fromisoformat(period)]) for period in periods]
+    # 各明细序列之和等于不拆分时的序列
+    columns = zip(*(series_values for _, _, series_values, _ in series))
+    assert [sum(column) for column in columns] == pytest.approx(values)
+    assert sum(series_total for _, _, _, series_total in series) == pytest.approx(total)
+
+
+def test_unknown_currency_and_empty_range(entries):
+    periods, series = timeseries(entries, ['Expenses'], currency='EUR')
+    assert periods == []
+    assert series == [('Expenses', 'Expenses', [], 0.0)]
+
+    periods, series = timeseries(
+        entries, ['Expenses'], start_date=datetime.date(2022, 1, 1), end_date=datetime.date(2022, 3, 31)
+    )
+    assert periods == ['2022-01-01', '2022-02-01', '2022-03-01']
+    assert series == [('Expenses', 'Expenses', [0.0, 0.0, 0.0], 0.0)]
+
+
+def test_max_periods_is_enforced(entries):
+    columns = PostingColumns(entries)
+    frame = build_posting_frame(columns)
+    start_date, end_date = datetime.date(2021, 1, 1), datetime.date(2021, 1, 10)
+    periods, _ = posting_timeseries(frame, columns, ['Expenses'], 'CNY', 'daily', start_date, end_date, max_periods=10)
+    assert len(periods) == 10
+    with pytest.raises(ValueError):
+        posting_timeseries(frame, columns, ['Expenses'], 'CNY', 'daily', start_date, end_date, max_periods=9)
+
+
+def test_timeseries_endpoint(client, auth_headers):
+    response = client.get(
+        '/api/stats/timeseries',
+        headers=auth_headers,
+        query_string={'accounts': 'Expenses:Food, Expenses:Travel', 'interval': 'weekly', 'depth': '3'},
+    )
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['interval'] == 'weekly'
+    assert body['currency'] == 'CNY'
+    assert [(item['prefix'], item['account']) for item in body['series']] == [
+        ('Expenses:Food', 'Expenses:Food:Dining'),
+        ('Expenses:Food', 'Expenses:Food:Groceries'),
+        ('Expenses:Travel', 'Expenses:Travel'),
+    ]
+    assert all(len(item['values']) == len(body['periods']) for item in body['series'])
+
+
+@pytest.mark.parametrize(
+    'params',
+    [
+        {'interval': 'yearly'},
+        {'depth': '0'},
+        {'depth': 'x'},
+        {'start_date': '2021/01/01'},
+        {'accounts': ' , '},
+    ],
+)
+def test_timeseries_endpoint_rejects_invalid_parameters(client, auth_headers, params):
+    response = client.get('/api/stats/timeseries', headers=auth_headers, query_string=params)
+    assert response.status_code == 400
+
+
+def test_timeseries_endpoint_rejects_too_many_periods(client, auth_headers):
+    from app.stats.routes import TIMESERIES_MAX_PERIODS
+
+    start_date = datetime.date(2000, 1, 1)
+    end_date = start_date + datetime.timedelta(days=TIMESERIES_MAX_PERIODS)
+    params = {'interval': 'daily', 'start_date': str(start_date), 'end_date': str(end_date)}
+    response = client.get('/api/stats/timeseries', headers=auth_headers, query_string=params)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == '日期范围过大'
+
+    # 恰好等于上限时正常返回
+    params['end_date'] = str(end_date - datetime.timedelta(days=1))
+    response = client.get('/api/stats/timeseries', headers=auth_headers, query_string=params)
+    assert response.status_code == 200
+    assert len(response.get_json()['periods']) == TIMESERIES_MAX_PERIODS
+
+
+def test_monthly_totals_match_monthly_expenses(client, auth_headers):
+    body = client.get(
+        '/api/stats/timeseries', headers=auth_headers, query_string={'accounts': 'Expenses', 'interval': 'monthly'}
+    ).get_json()
+    [series] = body['series']
+    assert body['periods'] == [f'2021-{month:02d}-01' for month in range(1, 7)]
+
+    for period, value in zip(body['periods'], series['values']):
+        start = datetime.date.fromisoformat(period)
+        end = (start + datetime.timedelta(days=31)).replace(day=1) - datetime.timedelta(days=1)
+        response = client.get(
+            '/api/stats/monthly-expenses',
+            headers=auth_headers,
+            query_string={'start_date': str(start), 'end_date': str(end)},
+        )
+        assert response.status_code == 200
+        assert response.get_json()['total_expense'] == pytest.approx(value)
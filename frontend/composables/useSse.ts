@@ -12,6 +12,7 @@ const createSseInstance = () => {
     let reader: ReadableStreamDefaultReader | undefined = undefined
     let decoder: TextDecoder | null = null
     let reconnectTimeout: number | null = null
+    let lastEventId: string | null = null // 最后收到的事件ID，重连时用于补发错过的事件
     const { $api } = useNuxtApp()
     const { user, authToken } = $api
 
@@ -56,7 +57,8 @@ const createSseInstance = () => {
                 method: 'GET',
                 headers: {
                     'Authorization': authToken.value ? `Bearer ${authToken.value}` : '',
-                    'Accept': 'text/event-stream'
+                    'Accept': 'text/event-stream',
+                    ...(lastEventId ? { 'Last-Event-ID': lastEventId } : {})
                 },
                 credentials: 'include'
             }).then(async (response) => {
@@ -119,6 +121,10 @@ const createSseInstance = () => {
                     if (!eventLine.trim()) continue
 
                     // 解析SSE事件格式
+                    const idLine = eventLine.split('\n').find(line => line.startsWith('id:'))
+                    if (idLine) {
+                        lastEventId = idLine.substring(3).trim()
+                    }
                     const dataLines = eventLine.split('\n').filter(line => line.startsWith('data:'))
                     if (dataLines.length > 0) {
                         const data = dataLines.map(line => line.substring(5).trim()).join('\n')
@@ -168,6 +174,7 @@ const createSseInstance = () => {
 
         source = null
         decoder = null
+        lastEventId = null // 主动断开（如登出）后重新连接时完整同步
         isConnected.value = false
         console.log('SSE disconnected')
     }